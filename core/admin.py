@@ -1,8 +1,20 @@
-﻿from django.contrib import admin
+﻿import json
+
+from django.contrib import admin
 from django.utils import timezone
 from django.utils.html import format_html
 
-from .models import IronTask, IronIncomingWebhook, IronWebhookDelivery
+from .models import (
+    IronChord,
+    IronIncomingWebhook,
+    IronIncomingWebhookArchive,
+    IronTask,
+    IronTaskArchive,
+    IronTaskProfile,
+    IronTaskResult,
+    IronWebhookDelivery,
+    IronWebhookDeliveryArchive,
+)
 
 
 class StatusColorMixin:
@@ -31,8 +43,31 @@ class StatusColorMixin:
         )
 
 
+class PayloadMixin:
+    """
+    Списки не читают тела: payload (и raw_body) отложены и грузятся только
+    на странице объекта. Там же показывается payload, вынесенный
+    в IronPayloadBlob.
+    """
+
+    deferred_fields = ("payload",)
+    exclude = ("payload", "payload_blob")
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer(*self.deferred_fields)
+
+    def payload_display(self, obj):
+        payload = obj.data if isinstance(obj, IronIncomingWebhook) else obj.get_payload()
+        return format_html(
+            '<pre style="font-size:11px">{}</pre>',
+            json.dumps(payload, indent=2, ensure_ascii=False),
+        )
+
+    payload_display.short_description = "Payload"
+
+
 @admin.register(IronTask)
-class IronTaskAdmin(StatusColorMixin, admin.ModelAdmin):
+class IronTaskAdmin(PayloadMixin, StatusColorMixin, admin.ModelAdmin):
     """
     адачи очереди.
     """
@@ -40,21 +75,23 @@ class IronTaskAdmin(StatusColorMixin, admin.ModelAdmin):
     list_display = (
         "short_id",
         "name",
+        "queue",
         "status_colored",
         "priority",
         "attempts",
         "scheduled_at",
         "created_at",
     )
-    list_filter = ("status", "priority", "created_at")
+    list_filter = ("status", "queue", "priority", "created_at")
     search_fields = ("id", "name")
     ordering = ("-created_at",)
 
     readonly_fields = (
         "id",
         "name",
+        "queue",
         "status",
-        "payload",
+        "payload_display",
         "priority",
         "attempts",
         "scheduled_at",
@@ -95,6 +132,7 @@ class IronTaskAdmin(StatusColorMixin, admin.ModelAdmin):
                         "status",
                         "attempts",
                         "scheduled_at",
+                        "claim_rank",
                         "last_error",
                     ]
                 )
@@ -104,7 +142,7 @@ class IronTaskAdmin(StatusColorMixin, admin.ModelAdmin):
 
 
 @admin.register(IronIncomingWebhook)
-class IronIncomingWebhookAdmin(StatusColorMixin, admin.ModelAdmin):
+class IronIncomingWebhookAdmin(PayloadMixin, StatusColorMixin, admin.ModelAdmin):
     """
     ходящие вебхуки.
     """
@@ -120,12 +158,16 @@ class IronIncomingWebhookAdmin(StatusColorMixin, admin.ModelAdmin):
     search_fields = ("id", "source", "event")
     ordering = ("-created_at",)
 
+    deferred_fields = ("payload", "raw_body")
+    exclude = ("payload", "raw_body", "payload_blob")
     readonly_fields = (
         "id",
         "source",
         "event",
         "status",
-        "payload",
+        "payload_display",
+        "idempotency_key",
+        "handler_task",
         "created_at",
     )
 
@@ -142,7 +184,7 @@ class IronIncomingWebhookAdmin(StatusColorMixin, admin.ModelAdmin):
 
 
 @admin.register(IronWebhookDelivery)
-class IronWebhookDeliveryAdmin(StatusColorMixin, admin.ModelAdmin):
+class IronWebhookDeliveryAdmin(PayloadMixin, StatusColorMixin, admin.ModelAdmin):
     """
     сходящие вебхуки (доставки).
     """
@@ -164,7 +206,7 @@ class IronWebhookDeliveryAdmin(StatusColorMixin, admin.ModelAdmin):
         "event",
         "target_url",
         "status",
-        "payload",
+        "payload_display",
         "attempts",
         "last_response_code",
         "last_response_body",
@@ -180,4 +222,143 @@ class IronWebhookDeliveryAdmin(StatusColorMixin, admin.ModelAdmin):
         return self.render_status_badge(obj.status)
 
     status_colored.short_description = "Status"
-    status_colored.admin_order_field = "status"
+    status_colored.admin_order_field = "status"
+
+
+class ArchiveAdminMixin:
+    """
+    Архивные таблицы только для чтения.
+    """
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(IronTaskArchive)
+class IronTaskArchiveAdmin(ArchiveAdminMixin, PayloadMixin, StatusColorMixin, admin.ModelAdmin):
+    """
+    Архив завершённых задач.
+    """
+
+    list_display = ("id", "name", "status_colored", "attempts", "finished_at")
+    list_filter = ("status", "finished_at")
+    search_fields = ("id", "name")
+    readonly_fields = ("payload_display",)
+
+    def status_colored(self, obj):
+        return self.render_status_badge(obj.status)
+
+    status_colored.short_description = "Status"
+    status_colored.admin_order_field = "status"
+
+
+@admin.register(IronWebhookDeliveryArchive)
+class IronWebhookDeliveryArchiveAdmin(ArchiveAdminMixin, PayloadMixin, StatusColorMixin, admin.ModelAdmin):
+    """
+    Архив исходящих вебхуков.
+    """
+
+    list_display = ("id", "event", "status_colored", "last_response_code", "finished_at")
+    list_filter = ("status", "finished_at")
+    search_fields = ("id", "event", "target_url")
+    readonly_fields = ("payload_display",)
+
+    def status_colored(self, obj):
+        return self.render_status_badge(obj.status)
+
+    status_colored.short_description = "Status"
+    status_colored.admin_order_field = "status"
+
+
+@admin.register(IronIncomingWebhookArchive)
+class IronIncomingWebhookArchiveAdmin(ArchiveAdminMixin, PayloadMixin, StatusColorMixin, admin.ModelAdmin):
+    """
+    Архив входящих вебхуков.
+    """
+
+    list_display = ("id", "source", "event", "status_colored", "created_at")
+    list_filter = ("status", "source")
+    search_fields = ("id", "source", "event")
+    readonly_fields = ("payload_display",)
+
+    def status_colored(self, obj):
+        return self.render_status_badge(obj.status)
+
+    status_colored.short_description = "Status"
+    status_colored.admin_order_field = "status"
+
+
+@admin.register(IronTaskProfile)
+class IronTaskProfileAdmin(ArchiveAdminMixin, admin.ModelAdmin):
+    """
+    Профили медленных выполнений задач.
+    """
+
+    list_display = ("name", "duration_display", "worker_id", "task_id", "created_at")
+    list_filter = ("name", "created_at")
+    search_fields = ("name", "task_id")
+    ordering = ("-created_at",)
+
+    fields = (
+        "name",
+        "task_id",
+        "worker_id",
+        "duration",
+        "created_at",
+        "functions_display",
+        "allocations_display",
+    )
+    readonly_fields = fields
+
+    def duration_display(self, obj):
+        return f"{obj.duration:.3f}s"
+
+    duration_display.short_description = "Duration"
+    duration_display.admin_order_field = "duration"
+
+    def functions_display(self, obj):
+        return format_html('<pre style="font-size:11px">{}</pre>', obj.functions or "—")
+
+    functions_display.short_description = "Functions (cProfile)"
+
+    def allocations_display(self, obj):
+        return format_html('<pre style="font-size:11px">{}</pre>', obj.allocations or "—")
+
+    allocations_display.short_description = "Allocations (tracemalloc)"
+
+
+@admin.register(IronTaskResult)
+class IronTaskResultAdmin(ArchiveAdminMixin, StatusColorMixin, admin.ModelAdmin):
+    """
+    Результаты задач @task(store_result=True).
+    """
+
+    list_display = ("task_id", "name", "status_colored", "created_at", "expires_at")
+    list_filter = ("status", "name")
+    search_fields = ("task_id", "name")
+    ordering = ("-created_at",)
+
+    def status_colored(self, obj):
+        return self.render_status_badge(obj.status)
+
+    status_colored.short_description = "Status"
+    status_colored.admin_order_field = "status"
+
+
+@admin.register(IronChord)
+class IronChordAdmin(ArchiveAdminMixin, admin.ModelAdmin):
+    """
+    Chord-ы, ждущие завершения своей группы.
+    """
+
+    list_display = ("id", "callback_name", "remaining", "failed", "size", "created_at")
+    search_fields = ("id",)
+    ordering = ("-created_at",)
+
+    def callback_name(self, obj):
+        return obj.callback.get("name")
+
+    callback_name.short_description = "Callback"
@@ -0,0 +1,95 @@
+# core/bench.py
+#
+# Нагрузочный замер endpoint-ов IronRelay: сколько запросов в секунду
+# выдерживает сервер при N одновременных клиентах (keep-alive).
+# Используется командой ironrelay_bench, чтобы сравнить sync (WSGI)
+# и async (ASGI) версии приёма вебхуков на одной и той же БД.
+
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * q), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def parse_target(target: str) -> tuple:
+    """
+    "[имя=]URL" -> (имя, URL). "=" внутри URL (query string) имя не
+    отделяет: имя — только то, что до "=" и без "://".
+    """
+    name, sep, url = target.partition("=")
+    if not sep or "://" in name or not name:
+        return target, target
+    return name, url
+
+
+def run_load(url: str, method: str = "POST", body: bytes = b"", duration: float = 10.0,
+             concurrency: int = 50, warmup: float = 1.0) -> dict:
+    """
+    `concurrency` потоков без пауз шлют запросы на `url` в течение
+    warmup + duration секунд; считаются только последние `duration`.
+
+    Возвращает {"requests", "errors", "rps", "p50", "p95", "p99"}
+    (задержки в миллисекундах).
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    headers = {"Content-Type": "application/json"}
+
+    started = time.monotonic()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+
+    def client():
+        local_latencies = []
+        local_errors = 0
+        while True:
+            begin = time.monotonic()
+            if begin >= deadline:
+                break
+            try:
+                resp = session.request(method, url, data=body, headers=headers, timeout=30)
+                ok = resp.status_code < 400
+                resp.close()
+            except requests.RequestException:
+                ok = False
+            end = time.monotonic()
+            if begin < measure_from:
+                continue
+            if ok:
+                local_latencies.append(end - begin)
+            else:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    session.close()
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rps": len(latencies) / duration,
+        "p50": _percentile(latencies, 0.50) * 1000,
+        "p95": _percentile(latencies, 0.95) * 1000,
+        "p99": _percentile(latencies, 0.99) * 1000,
+    }
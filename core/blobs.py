@@ -0,0 +1,163 @@
+# core/blobs.py
+#
+# Большие тела вне горячих таблиц.
+#
+# Аргументы задачи, payload исходящего вебхука или тело входящего длиннее
+# IRONRELAY_PAYLOAD_OFFLOAD_BYTES пишутся сжатыми в IronPayloadBlob, а в
+# строке остаётся только ссылка payload_blob (payload = NULL / raw_body = "").
+# Ключ блоба — sha256 содержимого: одинаковые тела хранятся один раз.
+#
+# Claim-запрос воркера, дашборд и списки админки тела не читают; блоб
+# загружается, только когда задача реально выполняется (get_payload()).
+#
+# Настройки:
+#   IRONRELAY_PAYLOAD_OFFLOAD_BYTES = 65536   (None / 0 — не выносить)
+#   IRONRELAY_PAYLOAD_CODEC = "zlib" | "zstd" (zstd — нужен пакет zstandard)
+#   IRONRELAY_PAYLOAD_COMPRESS_LEVEL = None   (уровень кодека по умолчанию)
+#
+# Блобы, на которые больше никто не ссылается, удаляет prune_finished.
+
+import hashlib
+import json
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import (
+    IronIncomingWebhook,
+    IronIncomingWebhookArchive,
+    IronPayloadBlob,
+    IronTask,
+    IronTaskArchive,
+    IronWebhookDelivery,
+    IronWebhookDeliveryArchive,
+)
+
+
+DEFAULT_OFFLOAD_BYTES = 64 * 1024
+DEFAULT_CODEC = IronPayloadBlob.CODEC_ZLIB
+
+# Свежий блоб без ссылок не трогаем: строка, которая на него сошлётся,
+# может быть ещё не вставлена
+ORPHAN_GRACE = timedelta(hours=1)
+
+# Модели со ссылкой payload_blob
+REFERENCING_MODELS = (
+    IronTask,
+    IronWebhookDelivery,
+    IronIncomingWebhook,
+    IronTaskArchive,
+    IronWebhookDeliveryArchive,
+    IronIncomingWebhookArchive,
+)
+
+
+def offload_bytes():
+    return getattr(settings, "IRONRELAY_PAYLOAD_OFFLOAD_BYTES", DEFAULT_OFFLOAD_BYTES)
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImproperlyConfigured(
+            'IRONRELAY_PAYLOAD_CODEC = "zstd" requires the zstandard package'
+        ) from e
+    return zstandard
+
+
+def compress(raw: bytes, codec: str) -> bytes:
+    level = getattr(settings, "IRONRELAY_PAYLOAD_COMPRESS_LEVEL", None)
+    if codec == IronPayloadBlob.CODEC_ZLIB:
+        return zlib.compress(raw, 6 if level is None else level)
+    if codec == IronPayloadBlob.CODEC_ZSTD:
+        return _zstd().ZstdCompressor(level=3 if level is None else level).compress(raw)
+    raise ImproperlyConfigured(f"Unknown IRONRELAY_PAYLOAD_CODEC: {codec}")
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    # BinaryField в PostgreSQL отдаёт memoryview
+    data = bytes(data)
+    if codec == IronPayloadBlob.CODEC_ZLIB:
+        return zlib.decompress(data)
+    if codec == IronPayloadBlob.CODEC_ZSTD:
+        return _zstd().ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unknown payload codec: {codec}")
+
+
+def _inline_body(obj):
+    """
+    Тело несохранённой строки в байтах (None — тела нет).
+    """
+    if isinstance(obj, IronIncomingWebhook):
+        return obj.raw_body.encode("utf-8") if obj.raw_body else None
+    if obj.payload is None:
+        return None
+    return json.dumps(obj.payload).encode("utf-8")
+
+
+def offload(objects, using=None):
+    """
+    Выносит большие тела несохранённых строк в IronPayloadBlob. Вызывается
+    перед их вставкой: блобы пишутся сразу, строкам проставляется
+    payload_blob, а payload / raw_body очищаются.
+    """
+    limit = offload_bytes()
+    if not limit:
+        return
+
+    codec = getattr(settings, "IRONRELAY_PAYLOAD_CODEC", DEFAULT_CODEC)
+    blobs = {}
+    for obj in objects:
+        raw = _inline_body(obj)
+        if raw is None or len(raw) < limit:
+            continue
+
+        digest = hashlib.sha256(raw).hexdigest()
+        if digest not in blobs:
+            blobs[digest] = IronPayloadBlob(
+                hash=digest,
+                codec=codec,
+                size=len(raw),
+                data=compress(raw, codec),
+            )
+
+        obj.payload_blob_id = digest
+        if isinstance(obj, IronIncomingWebhook):
+            obj.raw_body = ""
+        else:
+            obj.payload = None
+
+    if blobs:
+        # уже существующий блоб только "освежаем", чтобы его не удалили
+        # как сироту, пока строка со ссылкой не вставлена
+        IronPayloadBlob.objects.using(using).bulk_create(
+            list(blobs.values()),
+            update_conflicts=True,
+            unique_fields=["hash"],
+            update_fields=["created_at"],
+        )
+
+
+def load(blob_id: str) -> bytes:
+    """
+    Несжатое содержимое блоба.
+    """
+    blob = IronPayloadBlob.objects.only("codec", "data").get(hash=blob_id)
+    return decompress(blob.data, blob.codec)
+
+
+def delete_orphan_blobs() -> int:
+    """
+    Удаляет блобы, на которые не ссылается ни одна строка (после удаления
+    или архивации в режиме "delete").
+    """
+    orphans = IronPayloadBlob.objects.filter(created_at__lt=timezone.now() - ORPHAN_GRACE)
+    for model in REFERENCING_MODELS:
+        orphans = orphans.exclude(Exists(model.objects.filter(payload_blob=OuterRef("pk"))))
+    deleted, _ = orphans.delete()
+    return deleted
@@ -0,0 +1,386 @@
+# core/broker.py
+#
+# Низкоуровневые операции очереди IronRelay поверх БД:
+# захват (claim) пачки задач воркером, продление аренды (heartbeat)
+# и возврат в очередь задач умерших воркеров (reaper).
+#
+# Именованные очереди: воркер с --queues a:5,b:1 выбирает очередь для
+# каждого claim-а взвешенным round-robin-ом (WeightedQueues) — при
+# очереди работ в обеих a получает 5 пачек из 6. Пустая очередь
+# пропускается, её доля достаётся остальным.
+#
+# Старение приоритета: задачи выбираются по claim_rank =
+#   scheduled_at (секунды) - priority * IRONRELAY_PRIORITY_AGING_SECONDS,
+# то есть по "эффективному приоритету" priority + ожидание / AGING.
+# Каждая единица приоритета стоит AGING секунд ожидания: задача с
+# priority=0 обгоняет свежие задачи с priority=5 после 5 * AGING секунд
+# в очереди и не голодает при постоянном потоке важной работы. Ключ
+# считается при постановке, поэтому выборка остаётся проходом по индексу.
+# AGING = None — строгий порядок по приоритету, как раньше. Новое значение
+# настройки применяется к задачам, поставленным (или отложенным) после него.
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q, Value
+from django.utils import timezone
+
+from .models import IronTask
+
+
+# Сколько задач воркер забирает за один поход в БД по умолчанию
+DEFAULT_CLAIM_BATCH = 10
+
+# Аренда (lease) задачи: locked_at — время последнего heartbeat-а воркера.
+# Если воркер не продлевал аренду дольше этого срока — считаем его мёртвым.
+DEFAULT_LEASE_SECONDS = 60
+
+
+# Сколько секунд ожидания стоит единица приоритета
+DEFAULT_PRIORITY_AGING_SECONDS = 60
+
+# "Строгий" шаг: единица приоритета дороже любого реального ожидания
+STRICT_PRIORITY_STEP = 10**9
+
+
+def lease_seconds() -> int:
+    return getattr(settings, "IRONRELAY_LEASE_SECONDS", DEFAULT_LEASE_SECONDS)
+
+
+def priority_step() -> float:
+    aging = getattr(settings, "IRONRELAY_PRIORITY_AGING_SECONDS", DEFAULT_PRIORITY_AGING_SECONDS)
+    return aging or STRICT_PRIORITY_STEP
+
+
+def claim_rank(scheduled_at, priority: int) -> float:
+    """
+    Ключ выборки задачи (меньше — раньше).
+    """
+    return scheduled_at.timestamp() - priority * priority_step()
+
+
+def claim_rank_expression(scheduled_at):
+    """
+    claim_rank для UPDATE многих строк с разным priority.
+    """
+    return Value(scheduled_at.timestamp()) - F("priority") * Value(float(priority_step()))
+
+
+# Статус 'pending' вписан литералом, а не параметром: только так
+# планировщик может доказать условие частичного индекса iron_task_claim_idx.
+_CLAIM_SQL = """
+UPDATE {table}
+   SET status = %s, locked_at = %s, locked_by = %s, updated_at = %s
+ WHERE id IN (
+        SELECT id FROM {table}{hint}
+         WHERE status = 'pending' AND scheduled_at <= %s{queue}{names}
+         ORDER BY claim_rank
+         LIMIT %s
+         {lock}
+       )
+RETURNING *
+"""
+
+CLAIM_INDEX = "iron_task_claim_idx"
+QUEUE_CLAIM_INDEX = "iron_task_queue_claim_idx"
+
+
+def supports_update_returning() -> bool:
+    """
+    UPDATE ... RETURNING есть в PostgreSQL и в SQLite начиная с 3.35.
+    """
+    if connection.vendor == "postgresql":
+        return True
+    if connection.vendor == "sqlite":
+        import sqlite3
+
+        return sqlite3.sqlite_version_info >= (3, 35, 0)
+    return False
+
+
+def claim_statement(worker_id: str, limit: int, now, names=None, queue=None):
+    """
+    SQL и параметры claim-запроса UPDATE ... RETURNING
+    (используется и для EXPLAIN в ironrelay_explain).
+    """
+    index = QUEUE_CLAIM_INDEX if queue is not None else CLAIM_INDEX
+    sql = _CLAIM_SQL.format(
+        table=connection.ops.quote_name(IronTask._meta.db_table),
+        # SQLite без свежего ANALYZE выбирает индекс (scheduled_at)
+        # и сортирует на лету — подсказываем ему нужный индекс явно
+        hint=f" INDEXED BY {index}" if connection.vendor == "sqlite" else "",
+        lock="FOR UPDATE SKIP LOCKED" if connection.vendor == "postgresql" else "",
+        queue=" AND queue = %s" if queue is not None else "",
+        names=" AND name IN ({})".format(", ".join(["%s"] * len(names))) if names else "",
+    )
+    params = [
+        IronTask.STATUS_RUNNING,
+        now,
+        worker_id,
+        now,
+        now,
+        *([queue] if queue is not None else []),
+        *(names or []),
+        limit,
+    ]
+    return sql, params
+
+
+def _claim_returning(worker_id: str, limit: int, now, names=None, queue=None):
+    """
+    Один UPDATE ... RETURNING с подзапросом.
+
+    В PostgreSQL подзапрос берёт строки FOR UPDATE SKIP LOCKED — чужие
+    залоченные строки просто пропускаются, воркеры не ждут друг друга.
+    В SQLite один оператор сразу берёт write-lock, поэтому конкурирующие
+    воркеры не упираются в "database is locked" при апгрейде блокировки.
+    """
+    sql, params = claim_statement(worker_id, limit, now, names, queue)
+    with transaction.atomic():
+        return list(IronTask.objects.raw(sql, params))
+
+
+def claim_candidates(now, names=None, queue=None):
+    """
+    Готовые к запуску задачи в порядке очереди (для бэкендов без RETURNING).
+    Фильтр и сортировка совпадают с индексом iron_task_claim_idx
+    (с очередью — iron_task_queue_claim_idx).
+    """
+    qs = IronTask.objects.filter(
+        status=IronTask.STATUS_PENDING,
+        scheduled_at__lte=now,
+    ).order_by("claim_rank")
+
+    if queue is not None:
+        qs = qs.filter(queue=queue)
+    if names:
+        qs = qs.filter(name__in=names)
+    return qs
+
+
+def _claim_generic(worker_id: str, limit: int, now, names=None, queue=None):
+    """
+    Остальные бэкенды (MySQL и т.п.): SELECT (с SKIP LOCKED, если он есть)
+    + UPDATE в одной транзакции. Условие status=pending в UPDATE защищает
+    от двойного захвата там, где блокировок строк нет.
+    """
+    with transaction.atomic():
+        qs = claim_candidates(now, names, queue)
+
+        if connection.features.has_select_for_update_skip_locked:
+            qs = qs.select_for_update(skip_locked=True)
+
+        ids = list(qs.values_list("id", flat=True)[:limit])
+        if not ids:
+            return []
+
+        IronTask.objects.filter(
+            id__in=ids,
+            status=IronTask.STATUS_PENDING,
+        ).update(
+            status=IronTask.STATUS_RUNNING,
+            locked_at=now,
+            locked_by=worker_id,
+            updated_at=now,
+        )
+
+        return list(
+            IronTask.objects.filter(
+                id__in=ids,
+                status=IronTask.STATUS_RUNNING,
+                locked_by=worker_id,
+                locked_at=now,
+            )
+        )
+
+
+def claim_tasks(worker_id: str, limit: int = DEFAULT_CLAIM_BATCH, names=None, queue=None):
+    """
+    Атомарно забирает до `limit` готовых к запуску задач и помечает их
+    как running за воркером `worker_id`.
+    `names` — если задан, берём только задачи с этими именами.
+    `queue` — если задана, берём только задачи этой очереди.
+
+    Возвращает список IronTask в порядке очереди (claim_rank).
+    """
+    if limit <= 0:
+        return []
+
+    now = timezone.now()
+
+    if supports_update_returning():
+        tasks = _claim_returning(worker_id, limit, now, names, queue)
+    else:
+        tasks = _claim_generic(worker_id, limit, now, names, queue)
+
+    tasks.sort(key=lambda t: t.claim_rank)
+    return tasks
+
+
+def parse_queues(spec: str) -> dict:
+    """
+    "a:5,b:1,c" -> {"a": 5, "b": 1, "c": 1}. Бросает ValueError.
+    """
+    weights = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, weight = item.partition(":")
+        name = name.strip()
+        weight = int(weight) if weight.strip() else 1
+        if not name or weight < 1:
+            raise ValueError(f"Invalid queue spec: {item!r}")
+        weights[name] = weight
+    if not weights:
+        raise ValueError("No queues given")
+    return weights
+
+
+class WeightedQueues:
+    """
+    Взвешенный выбор очереди для каждого claim-а (smooth weighted
+    round-robin, как в nginx): при весах 5:1 и работе в обеих очередях
+    на шесть пачек приходится пять из первой и одна из второй, без
+    "пачек подряд" по пять.
+
+    Очередь, в которой не нашлось готовых задач, теряет накопленный счёт
+    (обнуляется), а с обслуженной списывается вес только непустых очередей:
+    простой не копит кредит, и очередь, долго стоявшая пустой, получив
+    работу, сразу идёт в своей доле, а не забирает все claim-ы подряд.
+    """
+
+    def __init__(self, weights: dict):
+        self.weights = dict(weights)
+        self.total = sum(self.weights.values())
+        self.current = {name: 0 for name in self.weights}
+
+    def candidates(self) -> list:
+        """
+        Ход: прибавляет каждой очереди её вес и возвращает очереди
+        по убыванию накопленного счёта.
+        """
+        for name, weight in self.weights.items():
+            self.current[name] += weight
+        return sorted(self.current, key=lambda name: -self.current[name])
+
+    def charge(self, name, empty=()):
+        """
+        Итог хода: name — очередь, из которой взяли задачи (None — ни из
+        какой), empty — очереди, оказавшиеся пустыми.
+        """
+        for queue in empty:
+            self.current[queue] = 0
+        if name is not None:
+            self.current[name] -= self.total - sum(self.weights[queue] for queue in empty)
+
+    def claim(self, worker_id: str, limit: int = DEFAULT_CLAIM_BATCH):
+        empty = []
+        for name in self.candidates():
+            tasks = claim_tasks(worker_id, limit=limit, queue=name)
+            if tasks:
+                self.charge(name, empty)
+                return tasks
+            empty.append(name)
+        self.charge(None, empty)
+        return []
+
+
+def extend_leases(worker_id: str, since=None) -> int:
+    """
+    Heartbeat: одним UPDATE продлевает аренду всех running-задач воркера.
+    since — время старта процесса: задачи, взятые до него прошлым процессом
+    с тем же worker_id (перезапуск с фиксированным --worker-id, prefork-слот),
+    не продлеваются — иначе они числились бы running вечно.
+    """
+    qs = IronTask.objects.filter(
+        status=IronTask.STATUS_RUNNING,
+        locked_by=worker_id,
+    )
+    if since is not None:
+        qs = qs.filter(locked_at__gte=since)
+    return qs.update(locked_at=timezone.now())
+
+
+def _reaped_failed(tasks, error: str):
+    """
+    Задачи, которые reaper окончательно перевёл в failed, идут тем же путём,
+    что и упавшие в воркере: ожидающим результат — ошибка, счётчик chord-а
+    уменьшается, остаток chain-а обрывается.
+    """
+    from .workflows import finished
+
+    finished([(task, None, error) for task in tasks])
+
+
+def reap_expired_leases(lease: int = None) -> int:
+    """
+    Возвращает в очередь running-задачи с просроченной арендой
+    (воркер умер или завис). Попытка засчитывается — задача, которая
+    каждый раз роняет воркер, в итоге уйдёт в failed, а не будет крутиться
+    вечно.
+
+    Возвращает количество обработанных задач.
+    """
+    now = timezone.now()
+    cutoff = now - timezone.timedelta(seconds=lease or lease_seconds())
+
+    expired = IronTask.objects.filter(
+        Q(locked_at__lt=cutoff) | Q(locked_at__isnull=True, updated_at__lt=cutoff),
+        status=IronTask.STATUS_RUNNING,
+    )
+    return _reap(expired, now, "Lease expired: worker stopped sending heartbeats")
+
+
+def reap_worker_tasks(worker_id: str, before) -> int:
+    """
+    При старте воркера: его running-задачи, взятые до `before`, остались от
+    умершего прошлого процесса с тем же worker_id — их не нужно ждать до
+    истечения аренды. Как и reaper, засчитывает попытку.
+    """
+    now = timezone.now()
+    orphaned = IronTask.objects.filter(
+        Q(locked_at__lt=before) | Q(locked_at__isnull=True),
+        status=IronTask.STATUS_RUNNING,
+        locked_by=worker_id,
+    )
+    return _reap(orphaned, now, "Worker restarted: task was left running by its previous process")
+
+
+def _reap(expired, now, error: str) -> int:
+    """
+    Исчерпавшие попытки — в failed (с результатом и продолжением workflow),
+    остальные — обратно в очередь.
+    """
+    with transaction.atomic():
+        exhausted = expired.filter(attempts__gte=F("max_attempts") - 1)
+        candidates = list(exhausted.values_list("id", flat=True))
+        failed = exhausted.filter(id__in=candidates).update(
+            status=IronTask.STATUS_FAILED,
+            attempts=F("attempts") + 1,
+            last_error=error,
+            locked_by="",
+            locked_at=None,
+            updated_at=now,
+        )
+        if failed:
+            # те, кого перевёл в failed именно этот UPDATE
+            _reaped_failed(
+                IronTask.objects.filter(
+                    id__in=candidates,
+                    status=IronTask.STATUS_FAILED,
+                    updated_at=now,
+                ),
+                error,
+            )
+        requeued = expired.update(
+            status=IronTask.STATUS_PENDING,
+            attempts=F("attempts") + 1,
+            last_error=error,
+            scheduled_at=now,
+            claim_rank=claim_rank_expression(now),
+            locked_by="",
+            locked_at=None,
+            updated_at=now,
+        )
+
+    return failed + requeued
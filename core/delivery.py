@@ -0,0 +1,502 @@
+# core/delivery.py
+#
+# Движок доставки исходящих вебхуков IronRelay:
+# - пул keep-alive соединений на каждый хост (requests + urllib3)
+# - потоковое чтение ответа: читаем только те 2000 байт, что храним в БД
+# - пачечная параллельная отправка многих IronWebhookDelivery сразу
+
+import datetime
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+from .blobs import load
+from .broker import claim_rank_expression, claim_tasks
+from .hosts import HostUnavailable, get_guard
+from .models import IronTask, IronWebhookDelivery
+from .wakeup import notify
+from .worker import Worker
+
+
+# Сколько байт ответа сохраняем в last_response_body
+RESPONSE_BODY_LIMIT = 2000
+
+# Если ответ небольшой — дочитываем его до конца, чтобы вернуть соединение
+# в пул. Большие ответы дешевле оборвать вместе с соединением.
+DRAIN_LIMIT = 64 * 1024
+
+# Ответ на пакетный POST может содержать статус каждого события —
+# его читаем целиком, но не больше этого
+BATCH_RESPONSE_LIMIT = 256 * 1024
+
+
+class WebhookDeliveryError(Exception):
+    """
+    Получатель ответил кодом >= 400.
+    retry_after — сколько секунд просил подождать (заголовок Retry-After),
+    его учитывает RetryPolicy.
+    """
+
+    def __init__(self, message: str, response_code: int, retry_after=None):
+        super().__init__(message)
+        self.response_code = response_code
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    """
+    Retry-After: либо число секунд, либо HTTP-дата. None — если не разобрать.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    if timezone.is_naive(when):
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max((when - timezone.now()).total_seconds(), 0)
+
+
+def delivery_body(delivery: IronWebhookDelivery) -> bytes:
+    """
+    Тело POST-а. Вынесенный payload — это уже готовый JSON: отправляем
+    байты блоба как есть, без разбора и повторной сериализации.
+    """
+    if delivery.payload_blob_id is not None:
+        return load(delivery.payload_blob_id)
+    return json.dumps(delivery.payload).encode("utf-8")
+
+
+def target_host(url: str) -> str:
+    """
+    "host[:port]" получателя — метка метрик (без логина/пароля из URL).
+    """
+    return urlsplit(url).netloc.rpartition("@")[2] or "unknown"
+
+
+def parse_batch_results(body: str) -> dict:
+    """
+    Статусы событий из ответа на пакетный POST: {"id": код}.
+    Непонятный ответ — пустой словарь (действует код всего ответа).
+    """
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return {}
+
+    if isinstance(data, dict):
+        data = data.get("results", [])
+    if not isinstance(data, list):
+        return {}
+
+    codes = {}
+    for item in data:
+        if not isinstance(item, dict) or "id" not in item:
+            continue
+        try:
+            codes[str(item["id"])] = int(item.get("status", 200))
+        except (TypeError, ValueError):
+            continue
+    return codes
+
+
+class DeliveryEngine:
+    """
+    Отправщик вебхуков с пулом соединений.
+
+    Один экземпляр на процесс: соединения к одним и тем же получателям
+    переиспользуются между задачами (keep-alive), а не открываются заново
+    на каждую доставку.
+    """
+
+    def __init__(self, pool_connections=None, pool_maxsize=None, timeout=None):
+        self.pool_connections = pool_connections or getattr(
+            settings, "IRONRELAY_WEBHOOK_POOL_HOSTS", 100
+        )
+        self.pool_maxsize = pool_maxsize or getattr(
+            settings, "IRONRELAY_WEBHOOK_POOL_SIZE", 50
+        )
+        # (connect, read) — быстро отваливаемся на недоступных хостах
+        self.timeout = timeout or getattr(
+            settings, "IRONRELAY_WEBHOOK_TIMEOUT", (3.05, 10)
+        )
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=0,  # ретраи делает очередь IronTask
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {
+                "Content-Type": "application/json",
+                "User-Agent": "IronRelayWebhook/1.0",
+            }
+        )
+
+    def _read_body(self, resp, limit: int = RESPONSE_BODY_LIMIT) -> str:
+        """
+        Читает первые `limit` байт ответа и отпускает соединение.
+        """
+        try:
+            raw = resp.raw.read(limit, decode_content=True) or b""
+
+            length = resp.headers.get("Content-Length")
+            if length is not None and length.isdigit() and int(length) <= DRAIN_LIMIT:
+                # дочитываем хвост — соединение вернётся в пул
+                resp.raw.drain_conn()
+        finally:
+            resp.close()
+
+        return raw.decode("utf-8", errors="replace")
+
+    def send(self, delivery: IronWebhookDelivery):
+        """
+        Отправляет один вебхук и заполняет поля доставки
+        (attempts, status, last_response_*, last_error). В БД не пишет.
+
+        Бросает исключение, если доставка не удалась — чтобы сработали
+        ретраи IronTask. Если хост сейчас трогать нельзя (core/hosts.py) —
+        HostUnavailable до всякой попытки соединения.
+        """
+        host = target_host(delivery.target_url)
+        with get_guard().slot(host):
+            self._send(delivery, host)
+
+    def _send(self, delivery: IronWebhookDelivery, host: str):
+        # отмечаем ещё одну попытку
+        delivery.attempts += 1
+        delivery.updated_at = timezone.now()
+
+        data = delivery_body(delivery)
+        started = time.monotonic()
+
+        try:
+            resp = self.session.post(
+                delivery.target_url,
+                data=data,
+                headers={"X-IronRelay-Event": delivery.event},
+                timeout=self.timeout,
+                stream=True,
+            )
+            body = self._read_body(resp)
+        except Exception as e:
+            self._observe(host, started, "error")
+            delivery.last_error = str(e)
+            delivery.status = IronWebhookDelivery.STATUS_FAILED
+            raise
+
+        self._observe(host, started, resp.status_code)
+        delivery.last_response_code = resp.status_code
+        delivery.last_response_body = body
+
+        if resp.status_code >= 400:
+            error = WebhookDeliveryError(
+                f"HTTP Error {resp.status_code}: {resp.reason}",
+                response_code=resp.status_code,
+                retry_after=parse_retry_after(resp.headers.get("Retry-After")),
+            )
+            delivery.status = IronWebhookDelivery.STATUS_FAILED
+            delivery.last_error = f"HTTPError: {error}"
+            raise error
+
+        delivery.status = IronWebhookDelivery.STATUS_SUCCESS
+        delivery.last_error = ""
+
+    def send_batch(self, target_url: str, deliveries) -> dict:
+        """
+        Отправляет пачку доставок на один target_url одним POST-ом
+        с JSON-массивом [{"id", "event", "payload"}, ...] и заполняет
+        поля каждой доставки. В БД не пишет.
+
+        Получатель может вернуть статус каждого события:
+            {"results": [{"id": "...", "status": 200}, ...]}
+        Событие без статуса в ответе получает код всего ответа.
+
+        Возвращает {delivery.id: исключение или None}. Если хост сейчас
+        трогать нельзя — HostUnavailable, поля доставок не меняются.
+        """
+        host = target_host(target_url)
+        with get_guard().slot(host):
+            return self._send_batch(target_url, deliveries, host)
+
+    def _send_batch(self, target_url: str, deliveries, host: str) -> dict:
+        now = timezone.now()
+        for delivery in deliveries:
+            delivery.attempts += 1
+            delivery.updated_at = now
+
+        data = json.dumps(
+            [
+                {"id": str(d.id), "event": d.event, "payload": d.get_payload()}
+                for d in deliveries
+            ]
+        ).encode("utf-8")
+        started = time.monotonic()
+
+        try:
+            resp = self.session.post(
+                target_url,
+                data=data,
+                headers={"X-IronRelay-Batch": str(len(deliveries))},
+                timeout=self.timeout,
+                stream=True,
+            )
+            body = self._read_body(resp, BATCH_RESPONSE_LIMIT)
+        except Exception as e:
+            self._observe(host, started, "error")
+            for delivery in deliveries:
+                delivery.last_error = str(e)
+                delivery.status = IronWebhookDelivery.STATUS_FAILED
+            return {delivery.id: e for delivery in deliveries}
+
+        self._observe(host, started, resp.status_code)
+        codes = parse_batch_results(body) if resp.status_code < 400 else {}
+        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+
+        results = {}
+        for delivery in deliveries:
+            code = codes.get(str(delivery.id), resp.status_code)
+            delivery.last_response_code = code
+            delivery.last_response_body = body[:RESPONSE_BODY_LIMIT]
+
+            if code >= 400:
+                error = WebhookDeliveryError(
+                    f"HTTP Error {code}: {resp.reason if code == resp.status_code else 'batch item'}",
+                    response_code=code,
+                    retry_after=retry_after,
+                )
+                delivery.status = IronWebhookDelivery.STATUS_FAILED
+                delivery.last_error = f"HTTPError: {error}"
+                results[delivery.id] = error
+            else:
+                delivery.status = IronWebhookDelivery.STATUS_SUCCESS
+                delivery.last_error = ""
+                results[delivery.id] = None
+
+        return results
+
+    def _observe(self, host: str, started: float, code):
+        metrics.registry.observe(
+            "ironrelay_webhook_delivery_duration_seconds",
+            time.monotonic() - started,
+            host=host,
+        )
+        metrics.registry.inc("ironrelay_webhook_deliveries_total", host=host, code=code)
+        # breaker считает только отказы самого хоста: сеть, таймауты, 5xx
+        get_guard().record(host, ok=code != "error" and code < 500)
+
+    def send_many(self, deliveries, max_workers: int = 50) -> dict:
+        """
+        Параллельно отправляет пачку доставок.
+        Возвращает {delivery.id: исключение или None}.
+        """
+        def _send(delivery):
+            try:
+                self.send(delivery)
+            except Exception as e:
+                return delivery.id, e
+            return delivery.id, None
+
+        if not deliveries:
+            return {}
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(deliveries))) as pool:
+            return dict(pool.map(_send, deliveries))
+
+
+_engine = None
+
+
+def get_engine() -> DeliveryEngine:
+    """
+    Общий для процесса движок доставки (создаётся лениво, после fork-а).
+    """
+    global _engine
+    if _engine is None:
+        _engine = DeliveryEngine()
+    return _engine
+
+
+# Поля доставки, которые меняет DeliveryEngine.send()
+DELIVERY_UPDATE_FIELDS = [
+    "attempts",
+    "status",
+    "last_response_code",
+    "last_response_body",
+    "last_error",
+    "updated_at",
+]
+
+
+class DeliveryWorker(Worker):
+    """
+    Выделенный воркер доставки: забирает из очереди только задачи
+    отправки вебхуков и шлёт их пачками параллельно через DeliveryEngine,
+    не занимая обычные воркеры на время HTTP-запроса.
+    """
+
+    def __init__(self, worker_id: str, concurrency: int = 50, **kwargs):
+        super().__init__(worker_id, **kwargs)
+        self.concurrency = concurrency
+        self.slots = concurrency
+
+    def run(self):
+        from .webhooks import _perform_webhook_delivery
+
+        task_name = _perform_webhook_delivery._iron_task.name
+        engine = get_engine()
+
+        self.write(
+            f"IronRelay delivery worker {self.worker_id} started (concurrency: {self.concurrency})",
+            self.style.SUCCESS,
+        )
+
+        self.setup()
+
+        try:
+            while self.running:
+                tasks = claim_tasks(self.worker_id, limit=self.batch_size, names=[task_name])
+
+                if not tasks:
+                    self.idle.wait()
+                    continue
+
+                self.idle.reset()
+                self.deliver_batch(engine, tasks)
+        finally:
+            self.teardown()
+
+        self.write(f"IronRelay delivery worker {self.worker_id} stopped")
+
+    def deliver_batch(self, engine: DeliveryEngine, tasks):
+        # несколько задач на одну доставку (дубли) — одна отправка,
+        # результат у всех её задач
+        by_delivery = {}
+        for task in tasks:
+            args = task.get_payload().get("args", [])
+            by_delivery.setdefault(str(args[0]) if args else "", []).append(task)
+
+        deliveries = list(
+            IronWebhookDelivery.objects.filter(id__in=[d for d in by_delivery if d])
+        )
+        found = {str(d.id) for d in deliveries}
+
+        for delivery_id, group in by_delivery.items():
+            if delivery_id not in found:
+                for task in group:
+                    self.record_failure(task, IronWebhookDelivery.DoesNotExist(delivery_id))
+
+        started = time.monotonic()
+        for task in tasks:
+            self.task_started(task)
+
+        results = engine.send_many(deliveries, max_workers=self.concurrency)
+        deferred = self.defer_unavailable(by_delivery, results)
+
+        elapsed = time.monotonic() - started
+        for task in tasks:
+            metrics.registry.observe("ironrelay_task_duration_seconds", elapsed, task=task.name)
+        # пачка занимала столько слотов, сколько доставок шло параллельно
+        metrics.registry.inc(
+            "ironrelay_worker_busy_seconds_total",
+            elapsed * min(len(deliveries), self.concurrency),
+            worker=self.worker_id,
+        )
+
+        # строку доставки пишем, только если её задача всё ещё наша: иначе
+        # доставкой уже занимается воркер, забравший задачу после reaper-а
+        owned = {
+            task.id
+            for task in self._still_ours(
+                [task for d in deliveries for task in by_delivery[str(d.id)]],
+                IronTask.STATUS_RUNNING,
+            )
+        }
+        IronWebhookDelivery.objects.bulk_update(
+            [
+                d for d in deliveries
+                if d.id not in deferred and any(t.id in owned for t in by_delivery[str(d.id)])
+            ],
+            DELIVERY_UPDATE_FIELDS,
+        )
+
+        done = []
+        for delivery_id, error in results.items():
+            group = by_delivery[str(delivery_id)]
+            if error is None:
+                done += group
+            elif delivery_id not in deferred:
+                for task in group:
+                    self.record_failure(task, error)
+
+        if done:
+            now = timezone.now()
+            # как record_batch: результаты и продолжение chain / chord —
+            # в той же транзакции, что и статус
+            with self.finishing(done):
+                updated = IronTask.objects.filter(
+                    id__in=[t.id for t in done],
+                    status=IronTask.STATUS_RUNNING,
+                    locked_by=self.worker_id,
+                ).update(
+                    status=IronTask.STATUS_SUCCESS,
+                    updated_at=now,
+                )
+                if updated < len(done):
+                    ours = self._still_ours(done, IronTask.STATUS_SUCCESS)
+                else:
+                    ours = done
+                self.finished([(t, None, None) for t in ours])
+            self.count_outcome(done[0], "success", updated)
+            self.write(f"Delivered {len(done)} webhooks", self.style.SUCCESS)
+
+    def defer_unavailable(self, by_delivery: dict, results: dict) -> set:
+        """
+        Доставки на недоступные хосты (HostUnavailable) возвращаются в
+        очередь одним UPDATE на хост, без траты попытки.
+        Возвращает id отложенных доставок.
+        """
+        by_host = {}
+        for delivery_id, error in results.items():
+            if isinstance(error, HostUnavailable):
+                by_host.setdefault(error.host, []).append((delivery_id, error))
+
+        deferred = set()
+        now = timezone.now()
+        for host, items in by_host.items():
+            delay = max(error.delay for _, error in items)
+            scheduled_at = now + timezone.timedelta(seconds=delay)
+            IronTask.objects.filter(
+                id__in=[task.id for delivery_id, _ in items for task in by_delivery[str(delivery_id)]],
+                status=IronTask.STATUS_RUNNING,
+                locked_by=self.worker_id,
+            ).update(
+                status=IronTask.STATUS_PENDING,
+                scheduled_at=scheduled_at,
+                claim_rank=claim_rank_expression(scheduled_at),
+                locked_by="",
+                locked_at=None,
+                updated_at=now,
+            )
+            deferred.update(delivery_id for delivery_id, _ in items)
+            notify(scheduled_at)
+            self.write(f"Host {host} unavailable: deferred {len(items)} deliveries", self.style.WARNING)
+
+        return deferred
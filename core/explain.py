@@ -0,0 +1,228 @@
+# core/explain.py
+#
+# Регрессионная проверка планов запросов IronRelay: claim-запрос воркера,
+# запросы дашборда и статуса, выборка пачки очистки истории. Используется командой ironrelay_explain —
+# её удобно гонять в CI на PostgreSQL/SQLite с миллионом строк.
+
+import random
+import re
+
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .broker import (
+    CLAIM_INDEX,
+    QUEUE_CLAIM_INDEX,
+    claim_rank,
+    claim_candidates,
+    claim_statement,
+    supports_update_returning,
+)
+from .models import IronIncomingWebhook, IronTask, IronWebhookDelivery
+from .retention import DEFAULT_CHUNK_SIZE, expired_rows
+
+
+SEED_TASK_NAME = "core.explain.seed"
+SEED_EVENT = "ironrelay.explain.seed"
+SEED_SOURCE = "ironrelay-explain-seed"
+
+SEED_CHUNK = 5000
+
+# Распределение статусов, похожее на боевую таблицу с историей
+SEED_STATUSES = (
+    [IronTask.STATUS_SUCCESS] * 90
+    + [IronTask.STATUS_FAILED] * 6
+    + [IronTask.STATUS_PENDING] * 3
+    + [IronTask.STATUS_RUNNING] * 1
+)
+
+
+# Признаки плохого плана: полный просмотр таблицы или сортировка на лету
+_BAD_PATTERNS = {
+    "postgresql": [
+        re.compile(r"^\s*(->\s*)?(Incremental )?Sort\b", re.M),
+        re.compile(r"Seq Scan on iron_"),
+    ],
+    "sqlite": [
+        re.compile(r"USE TEMP B-TREE"),
+        re.compile(r"SCAN iron_\w+\b(?!\s+USING)"),
+    ],
+}
+
+
+def explain_sql(sql: str, params) -> str:
+    prefix = "EXPLAIN QUERY PLAN " if connection.vendor == "sqlite" else "EXPLAIN "
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        rows = cursor.fetchall()
+    return "\n".join(" ".join(str(col) for col in row) for row in rows)
+
+
+def _claim_plan(queue=None) -> str:
+    now = timezone.now()
+    if supports_update_returning():
+        sql, params = claim_statement("explain", 10, now, queue=queue)
+        return explain_sql(sql, params)
+    return claim_candidates(now, queue=queue).values("id")[:10].explain()
+
+
+def get_checks():
+    """
+    Список (имя, функция плана, обязательный индекс или None, строго).
+
+    Нестрогие проверки только печатают план: счётчики по статусам
+    честно читают всю таблицу (их прячет кэш в core/stats.py).
+    """
+    return [
+        ("claim", _claim_plan, CLAIM_INDEX, True),
+        (
+            "claim.queue",
+            lambda: _claim_plan(IronTask.DEFAULT_QUEUE),
+            QUEUE_CLAIM_INDEX,
+            True,
+        ),
+        (
+            "dashboard.recent_tasks",
+            lambda: IronTask.objects.order_by("-created_at").values("id")[:10].explain(),
+            "iron_task_created_idx",
+            True,
+        ),
+        (
+            "dashboard.recent_deliveries",
+            lambda: IronWebhookDelivery.objects.order_by("-created_at").values("id")[:10].explain(),
+            "iron_delivery_created_idx",
+            True,
+        ),
+        (
+            "dashboard.recent_incoming",
+            lambda: IronIncomingWebhook.objects.order_by("-created_at").values("id")[:10].explain(),
+            "iron_incoming_created_idx",
+            True,
+        ),
+        (
+            "retention.prune_chunk",
+            lambda: expired_rows("task", IronTask.STATUS_SUCCESS, timezone.now())
+            .values("id")[:DEFAULT_CHUNK_SIZE]
+            .explain(),
+            None,
+            True,
+        ),
+        (
+            "status.task_counts",
+            lambda: IronTask.objects.order_by().values("status").annotate(n=Count("id")).explain(),
+            None,
+            False,
+        ),
+    ]
+
+
+def check_plan(plan: str, required_index=None) -> list:
+    """
+    Возвращает список проблем плана (пустой — всё хорошо).
+    Для неизвестных бэкендов проверки не делаются.
+    """
+    patterns = _BAD_PATTERNS.get(connection.vendor)
+    if patterns is None:
+        return []
+
+    problems = []
+    for pattern in patterns:
+        match = pattern.search(plan)
+        if match:
+            problems.append(f"bad plan node: {match.group(0).strip()}")
+    if required_index and required_index not in plan:
+        problems.append(f"index {required_index} not used")
+    return problems
+
+
+def run_checks() -> list:
+    """
+    [(имя, план, проблемы), ...]
+    """
+    results = []
+    for name, plan_func, required_index, strict in get_checks():
+        plan = plan_func()
+        problems = check_plan(plan, required_index) if strict else []
+        results.append((name, plan, problems))
+    return results
+
+
+def analyze():
+    """
+    Обновляет статистику планировщика по таблицам IronRelay.
+    """
+    tables = [m._meta.db_table for m in (IronTask, IronWebhookDelivery, IronIncomingWebhook)]
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("ANALYZE")
+        elif connection.vendor == "postgresql":
+            for table in tables:
+                cursor.execute(f"ANALYZE {connection.ops.quote_name(table)}")
+        elif connection.vendor == "mysql":
+            for table in tables:
+                cursor.execute(f"ANALYZE TABLE {connection.ops.quote_name(table)}")
+
+
+def seed(count: int, stdout=None):
+    """
+    Наполняет таблицы тестовыми строками: count задач и по count/10
+    доставок и входящих вебхуков.
+    """
+    now = timezone.now()
+    month = 30 * 24 * 3600
+
+    def when():
+        return now - timezone.timedelta(seconds=random.randint(-3600, month))
+
+    def seed_task():
+        scheduled_at = when()
+        priority = random.randint(0, 5)
+        return IronTask(
+            name=SEED_TASK_NAME,
+            payload={"args": [], "kwargs": {}},
+            status=random.choice(SEED_STATUSES),
+            priority=priority,
+            scheduled_at=scheduled_at,
+            claim_rank=claim_rank(scheduled_at, priority),
+        )
+
+    done = 0
+    while done < count:
+        size = min(SEED_CHUNK, count - done)
+        with transaction.atomic():
+            IronTask.objects.bulk_create([seed_task() for _ in range(size)])
+        done += size
+        if stdout is not None and done % (SEED_CHUNK * 20) == 0:
+            stdout.write(f"seeded tasks: {done}")
+
+    side = max(count // 10, 1)
+    for start in range(0, side, SEED_CHUNK):
+        size = min(SEED_CHUNK, side - start)
+        with transaction.atomic():
+            IronWebhookDelivery.objects.bulk_create(
+                [
+                    IronWebhookDelivery(
+                        event=SEED_EVENT,
+                        target_url="https://example.com/hook",
+                        payload={},
+                        status=random.choice(SEED_STATUSES[:-1]),
+                    )
+                    for _ in range(size)
+                ]
+            )
+            IronIncomingWebhook.objects.bulk_create(
+                [
+                    IronIncomingWebhook(source=SEED_SOURCE, event=SEED_EVENT, payload={})
+                    for _ in range(size)
+                ]
+            )
+
+
+def cleanup():
+    """
+    Удаляет строки, созданные seed().
+    """
+    IronIncomingWebhook.objects.filter(source=SEED_SOURCE).delete()
+    IronWebhookDelivery.objects.filter(event=SEED_EVENT).delete()
+    IronTask.objects.filter(name=SEED_TASK_NAME).delete()
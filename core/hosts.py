@@ -0,0 +1,225 @@
+# core/hosts.py
+#
+# Защита от "плохих" получателей вебхуков: ограничения на хост.
+#
+# - concurrency: сколько запросов к хосту идёт одновременно
+# - rate/burst: token bucket, запросов в секунду
+# - circuit breaker: после IRONRELAY_WEBHOOK_BREAKER_FAILURES ошибок подряд
+#   хост "открыт" IRONRELAY_WEBHOOK_BREAKER_COOLDOWN секунд — доставки к нему
+#   откладываются без попытки соединения; затем пропускаем одну пробную
+#
+# Настройки:
+#   IRONRELAY_WEBHOOK_HOST_LIMITS = {
+#       "*": {"concurrency": 10, "rate": None, "burst": None},
+#       "slow.example.com": {"concurrency": 2, "rate": 5, "burst": 10},
+#   }
+#
+# Счётчики concurrency и состояние breaker-а лежат в кэше Django: с общим
+# кэшем (Redis, Memcached, БД) они общие для всех воркеров, с LocMemCache
+# по умолчанию — свои у каждого процесса. Token bucket всегда свой у
+# процесса (лимит rate действует на каждый процесс-воркер).
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+from .retry import Reschedule
+
+
+DEFAULT_LIMITS = {"concurrency": 10, "rate": None, "burst": None}
+
+DEFAULT_BREAKER_FAILURES = 5
+DEFAULT_BREAKER_COOLDOWN = 30
+
+# Сколько ждать, если все слоты хоста заняты
+BUSY_DELAY = 1.0
+
+
+class HostUnavailable(Reschedule):
+    """
+    Хост сейчас нельзя трогать (breaker открыт, все слоты заняты или
+    исчерпан rate). Доставка откладывается без траты попытки.
+    """
+
+    def __init__(self, host: str, reason: str, delay: float):
+        super().__init__(f"{host}: {reason}, retry in {delay:.1f}s", delay=delay)
+        self.host = host
+        self.reason = reason
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> float:
+        """
+        Берёт токен. 0 — можно идти; иначе — через сколько секунд
+        появится следующий.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+
+class HostGuard:
+    """
+    Ограничения и circuit breaker для хостов получателей (host[:port]).
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def limits(self, host: str) -> dict:
+        configured = getattr(settings, "IRONRELAY_WEBHOOK_HOST_LIMITS", {})
+        result = dict(DEFAULT_LIMITS)
+        result.update(configured.get("*", {}))
+        result.update(configured.get(host, {}))
+        return result
+
+    # --- circuit breaker ---
+
+    def _breaker_key(self, host: str) -> str:
+        return f"ironrelay:breaker:{host}"
+
+    def _cooldown(self) -> float:
+        return getattr(settings, "IRONRELAY_WEBHOOK_BREAKER_COOLDOWN", DEFAULT_BREAKER_COOLDOWN)
+
+    def open_for(self, host: str) -> float:
+        """
+        Сколько секунд breaker хоста ещё открыт (0 — закрыт или пора пробовать).
+        """
+        state = cache.get(self._breaker_key(host))
+        if not state:
+            return 0.0
+        return max((state.get("open_until") or 0) - time.time(), 0.0)
+
+    def _allow_probe(self, host: str) -> bool:
+        """
+        Breaker остыл, но ошибки были: пропускаем один пробный запрос.
+        """
+        state = cache.get(self._breaker_key(host))
+        if not state or state.get("open_until") is None:
+            return True
+        return cache.add(f"ironrelay:probe:{host}", 1, timeout=self._cooldown())
+
+    def record(self, host: str, ok: bool):
+        key = self._breaker_key(host)
+        if ok:
+            if cache.get(key) is not None:
+                cache.delete_many([key, f"ironrelay:probe:{host}"])
+            return
+
+        state = cache.get(key) or {"failures": 0, "open_until": None}
+        state["failures"] += 1
+        threshold = getattr(settings, "IRONRELAY_WEBHOOK_BREAKER_FAILURES", DEFAULT_BREAKER_FAILURES)
+        if state["failures"] >= threshold:
+            state["open_until"] = time.time() + self._cooldown()
+            cache.delete(f"ironrelay:probe:{host}")
+        # состояние живёт не дольше нескольких остываний без новых ошибок
+        cache.set(key, state, timeout=self._cooldown() * 10)
+
+    # --- rate / concurrency ---
+
+    def _bucket(self, host: str, limits: dict):
+        rate = limits.get("rate")
+        if not rate:
+            return None
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(rate, limits.get("burst") or rate)
+            return bucket
+
+    def _unavailable(self, host: str, reason: str, delay: float):
+        metrics.registry.inc("ironrelay_webhook_host_deferred_total", host=host, reason=reason)
+        # разносим отложенные доставки, чтобы они не вернулись одной волной
+        return HostUnavailable(host, reason, delay + random.uniform(0, max(delay * 0.1, 0.5)))
+
+    def check(self, host: str):
+        """
+        Бросает HostUnavailable, если breaker хоста открыт.
+        """
+        wait = self.open_for(host)
+        if wait > 0 or not self._allow_probe(host):
+            raise self._unavailable(host, "circuit_open", wait or self._cooldown())
+
+    @contextmanager
+    def slot(self, host: str):
+        """
+        Место для одного запроса к хосту: breaker, rate, concurrency.
+        Бросает HostUnavailable, если запрос сейчас делать нельзя.
+        """
+        self.check(host)
+        limits = self.limits(host)
+
+        bucket = self._bucket(host, limits)
+        if bucket is not None:
+            wait = bucket.take()
+            if wait > 0:
+                raise self._unavailable(host, "rate_limited", wait)
+
+        concurrency = limits.get("concurrency")
+        if not concurrency:
+            yield
+            return
+
+        key = f"ironrelay:inflight:{host}"
+        # ключ с TTL: если процесс умрёт посреди запроса, слот освободится
+        # сам. TTL продлевается при каждом захвате — счётчик истекает только
+        # после _slot_ttl() секунд без новых запросов, когда все начатые
+        # (не дольше IRONRELAY_WEBHOOK_TIMEOUT) уже завершились, а не
+        # обнуляется посреди потока запросов
+        ttl = self._slot_ttl()
+        cache.add(key, 0, timeout=ttl)
+        try:
+            in_flight = cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, timeout=ttl)
+            in_flight = 1
+        cache.touch(key, ttl)
+
+        if in_flight > concurrency:
+            self._release(key)
+            raise self._unavailable(host, "busy", BUSY_DELAY)
+
+        try:
+            yield
+        finally:
+            self._release(key)
+
+    def _release(self, key: str):
+        try:
+            cache.decr(key)
+        except ValueError:
+            # ключ истёк — счётчик уже сброшен
+            pass
+
+    def _slot_ttl(self) -> int:
+        timeout = getattr(settings, "IRONRELAY_WEBHOOK_TIMEOUT", (3.05, 10))
+        total = sum(timeout) if isinstance(timeout, (tuple, list)) else timeout
+        return int(total) * 3 + 1
+
+
+_guard = None
+
+
+def get_guard() -> HostGuard:
+    global _guard
+    if _guard is None:
+        _guard = HostGuard()
+    return _guard
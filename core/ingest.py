@@ -0,0 +1,405 @@
+# core/ingest.py
+#
+# Приём входящих вебхуков под нагрузкой.
+#
+# Строка IronIncomingWebhook и её задача-обработчик IronTask пишутся
+# вместе (handler_task заполнен сразу), тело запроса хранится как пришло —
+# в raw_body, без повторной сериализации в JSON.
+#
+# Режимы (IRONRELAY_INGEST_MODE):
+#   "sync"     — обе строки в одной транзакции, ответ после commit-а
+#   "buffered" — write-behind: запрос кладёт строки в буфер процесса,
+#                фоновый поток вставляет их пачками (bulk INSERT) не реже
+#                раза в IRONRELAY_INGEST_FLUSH_MS. При падении процесса
+#                теряется не больше этого окна — включайте, только если
+#                провайдер повторяет вебхуки.
+#
+# Идемпотентность (IRONRELAY_IDEMPOTENCY): ключ повтора по источнику —
+# из заголовка или из тела по пути через точку:
+#   IRONRELAY_IDEMPOTENCY = {
+#       "stripe": {"json": "id"},
+#       "github": {"header": "X-GitHub-Delivery"},
+#   }
+# Повтор с уже виденным ключом подтверждается сразу, без новой строки
+# и без задачи. Гарантию даёт уникальный индекс (source, idempotency_key),
+# LRU-кэш процесса отвечает на частые повторы, не ходя в БД.
+
+import atexit
+import json
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connections, transaction
+from django.db.models import Q
+
+from .blobs import offload
+from .models import IronIncomingWebhook, IronTask
+from .tasks import BULK_CREATE_CHUNK, task
+from .wakeup import notify
+
+
+MODE_SYNC = "sync"
+MODE_BUFFERED = "buffered"
+
+DEFAULT_FLUSH_MS = 50
+DEFAULT_BUFFER_SIZE = 10000
+DEFAULT_IDEMPOTENCY_CACHE_SIZE = 10000
+
+# Результат приёма
+RECEIVED = "received"    # записан
+ACCEPTED = "accepted"    # в буфере write-behind
+DUPLICATE = "duplicate"  # повтор, ничего не записано
+
+
+class InvalidPayload(ValueError):
+    pass
+
+
+@task
+def process_incoming_webhook(webhook_id):
+    """
+    Задача-обработчик входящего вебхука: вызывает handle_incoming_webhook
+    и отмечает результат в строке лога.
+    """
+    from .handlers_core import handle_incoming_webhook
+
+    webhook = IronIncomingWebhook.objects.get(id=webhook_id)
+    try:
+        handle_incoming_webhook(webhook.event, webhook.data)
+    except Exception:
+        IronIncomingWebhook.objects.filter(id=webhook.id).update(
+            status=IronIncomingWebhook.STATUS_FAILED
+        )
+        raise
+    IronIncomingWebhook.objects.filter(id=webhook.id).update(
+        status=IronIncomingWebhook.STATUS_HANDLED
+    )
+
+
+class LRUCache:
+    """
+    Потокобезопасный LRU: (source, ключ) -> id первого вебхука.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+
+_seen = LRUCache(
+    getattr(settings, "IRONRELAY_IDEMPOTENCY_CACHE_SIZE", DEFAULT_IDEMPOTENCY_CACHE_SIZE)
+)
+
+
+def _json_path(data, path: str):
+    for part in path.split("."):
+        if isinstance(data, dict):
+            data = data.get(part)
+        elif isinstance(data, list) and part.isdigit() and int(part) < len(data):
+            data = data[int(part)]
+        else:
+            return None
+    return data
+
+
+def idempotency_key(source: str, data, headers=None) -> str:
+    """
+    Ключ повтора по правилу источника (или "*"); "" — правила/ключа нет.
+    """
+    rules = getattr(settings, "IRONRELAY_IDEMPOTENCY", {})
+    rule = rules.get(source) or rules.get("*")
+    if not rule:
+        return ""
+
+    if "header" in rule:
+        value = headers.get(rule["header"]) if headers is not None else None
+    else:
+        value = _json_path(data, rule["json"])
+
+    if value is None or isinstance(value, (dict, list)):
+        return ""
+    return str(value)[:255]
+
+
+def build(source: str, raw_body: bytes, headers=None):
+    """
+    Готовит пару (вебхук, задача) без записи в БД.
+    Тело разбирается один раз — только ради проверки, поля event
+    и ключа идемпотентности.
+    """
+    try:
+        text = raw_body.decode("utf-8") or "{}"
+        data = json.loads(text)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise InvalidPayload(str(e)) from e
+
+    event = data.get("event", "") if isinstance(data, dict) else ""
+
+    webhook_id = uuid.uuid4()
+    handler = process_incoming_webhook._iron_task._build(
+        (str(webhook_id),), {}, delay=0, priority=0, max_attempts=5
+    )
+    handler.id = uuid.uuid4()
+
+    webhook = IronIncomingWebhook(
+        id=webhook_id,
+        source=source,
+        event=event or "",
+        raw_body=text,
+        handler_task_id=handler.id,
+        idempotency_key=idempotency_key(source, data, headers),
+    )
+    return webhook, handler
+
+
+def _dedup_key(webhook: IronIncomingWebhook):
+    return (webhook.source, webhook.idempotency_key)
+
+
+def _existing(webhooks) -> dict:
+    """
+    Уже записанные вебхуки с теми же ключами: {(source, ключ): id}.
+    Один SELECT по уникальному индексу.
+    """
+    by_source = {}
+    for webhook in webhooks:
+        if webhook.idempotency_key:
+            by_source.setdefault(webhook.source, set()).add(webhook.idempotency_key)
+    if not by_source:
+        return {}
+
+    condition = Q()
+    for source, keys in by_source.items():
+        condition |= Q(source=source, idempotency_key__in=keys)
+
+    rows = IronIncomingWebhook.objects.filter(condition).values_list(
+        "source", "idempotency_key", "id"
+    )
+    return {(source, key): webhook_id for source, key, webhook_id in rows}
+
+
+def _insert(pairs):
+    with transaction.atomic():
+        offload([w for w, _ in pairs])
+        IronTask.objects.bulk_create([t for _, t in pairs], batch_size=BULK_CREATE_CHUNK)
+        IronIncomingWebhook.objects.bulk_create([w for w, _ in pairs], batch_size=BULK_CREATE_CHUNK)
+        transaction.on_commit(notify)
+
+
+def write(pairs) -> dict:
+    """
+    Вставляет пары (вебхук, задача) в одной транзакции: сначала задачи,
+    потом строки лога (внешний ключ handler_task). Повторы (ключ уже
+    есть в БД или раньше в этой же пачке) пропускаются вместе с задачей.
+
+    Возвращает {id пропущенного вебхука: id уже записанного}.
+    """
+    if not pairs:
+        return {}
+
+    known = _existing(w for w, _ in pairs)
+    duplicates = {}
+    fresh = []
+    for webhook, handler in pairs:
+        key = _dedup_key(webhook)
+        if webhook.idempotency_key:
+            if key in known:
+                duplicates[webhook.id] = known[key]
+                continue
+            known[key] = webhook.id
+        fresh.append((webhook, handler))
+
+    if not fresh:
+        return duplicates
+
+    try:
+        _insert(fresh)
+    except IntegrityError:
+        if len(fresh) == 1:
+            # тот же ключ только что записал другой процесс
+            webhook = fresh[0][0]
+            existing = _existing([webhook]).get(_dedup_key(webhook))
+            if existing is None:
+                raise
+            duplicates[webhook.id] = existing
+            fresh = []
+        else:
+            # гонка внутри пачки — пишем по одной, каждую в своей транзакции
+            for pair in fresh:
+                duplicates.update(write([pair]))
+            fresh = [pair for pair in fresh if pair[0].id not in duplicates]
+
+    for webhook, _ in fresh:
+        if webhook.idempotency_key:
+            _seen.put(_dedup_key(webhook), webhook.id)
+    for webhook, _ in pairs:
+        # в буферном режиме кэш мог запомнить id так и не записанной строки
+        if webhook.id in duplicates:
+            _seen.put(_dedup_key(webhook), duplicates[webhook.id])
+    return duplicates
+
+
+class WriteBehindBuffer:
+    """
+    Буфер процесса для режима "buffered": фоновый поток забирает всё,
+    что накопилось, и пишет одной транзакцией.
+    """
+
+    def __init__(self, flush_ms: int = DEFAULT_FLUSH_MS, max_size: int = DEFAULT_BUFFER_SIZE):
+        self.flush_interval = flush_ms / 1000
+        self.queue = queue.Queue(maxsize=max_size)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name="ironrelay-ingest", daemon=True
+                )
+                self.thread.start()
+
+    def put(self, pair) -> bool:
+        """
+        False — буфер полон, пишите синхронно (естественный backpressure).
+        """
+        self.start()
+        try:
+            self.queue.put_nowait(pair)
+        except queue.Full:
+            return False
+        return True
+
+    def drain(self) -> list:
+        pairs = []
+        try:
+            while True:
+                pairs.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return pairs
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                try:
+                    first = self.queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    continue
+                # собираем всё, что придёт за окно, и пишем одной пачкой
+                self.stopped.wait(self.flush_interval)
+                self.flush([first] + self.drain())
+        finally:
+            self.flush(self.drain())
+            connections.close_all()
+
+    def flush(self, pairs):
+        if not pairs:
+            return
+        try:
+            write(pairs)
+        except Exception:
+            # соединение могло умереть — одна повторная попытка с новым
+            close_old_connections()
+            connections.close_all()
+            write(pairs)
+
+    def stop(self, timeout: float = 5.0):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer() -> WriteBehindBuffer:
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = WriteBehindBuffer(
+                flush_ms=getattr(settings, "IRONRELAY_INGEST_FLUSH_MS", DEFAULT_FLUSH_MS),
+                max_size=getattr(settings, "IRONRELAY_INGEST_BUFFER", DEFAULT_BUFFER_SIZE),
+            )
+            atexit.register(_buffer.stop)
+        return _buffer
+
+
+def _accept(pair):
+    """
+    Общая часть ingest()/aingest() без записи в БД.
+    Возвращает (id, результат) или None, если пару надо писать сейчас.
+    """
+    webhook = pair[0]
+    if webhook.idempotency_key:
+        known = _seen.get(_dedup_key(webhook))
+        if known is not None:
+            return known, DUPLICATE
+
+    mode = getattr(settings, "IRONRELAY_INGEST_MODE", MODE_SYNC)
+    if mode == MODE_BUFFERED and get_buffer().put(pair):
+        if webhook.idempotency_key:
+            # повтор, пришедший до сброса буфера, тоже узнаем сразу
+            _seen.put(_dedup_key(webhook), webhook.id)
+        return webhook.id, ACCEPTED
+    return None
+
+
+def _written(pair, duplicates: dict):
+    webhook = pair[0]
+    if webhook.id in duplicates:
+        return duplicates[webhook.id], DUPLICATE
+    return webhook.id, RECEIVED
+
+
+def ingest(source: str, raw_body: bytes, headers=None):
+    """
+    Принимает входящий вебхук: строка лога + задача обработки.
+    Бросает InvalidPayload, если тело — не JSON.
+
+    Возвращает (id вебхука, результат): RECEIVED — записан; ACCEPTED —
+    в буфере write-behind, будет записан в течение IRONRELAY_INGEST_FLUSH_MS;
+    DUPLICATE — повтор, id — первого вебхука с этим ключом.
+    """
+    pair = build(source, raw_body, headers)
+    accepted = _accept(pair)
+    if accepted is not None:
+        return accepted
+    return _written(pair, write([pair]))
+
+
+async def aingest(source: str, raw_body: bytes, headers=None):
+    """
+    ingest() для async-представлений.
+
+    Буфер write-behind не блокирует event loop. Синхронная запись уходит
+    в поток: у async ORM Django нет транзакций, а пара (вебхук, задача)
+    должна вставляться атомарно.
+    """
+    pair = build(source, raw_body, headers)
+    accepted = _accept(pair)
+    if accepted is not None:
+        return accepted
+    duplicates = await sync_to_async(write, thread_sensitive=False)([pair])
+    return _written(pair, duplicates)
@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.bench import parse_target, run_load
+
+
+class Command(BaseCommand):
+    help = (
+        "IronRelay – нагрузочный замер endpoint-ов (запросов в секунду, p50/p95/p99). "
+        "Серверы запускаются отдельно, например: "
+        "WSGI — gunicorn playground.wsgi -w 4 --threads 8 -b :8000; "
+        "ASGI — uvicorn playground.asgi:application --workers 4 --port 8001. "
+        "Затем: ironrelay_bench --target wsgi=http://127.0.0.1:8000/ironrelay/incoming/bench/ "
+        "--target asgi=http://127.0.0.1:8001/ironrelay/async/incoming/bench/"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target",
+            action="append",
+            required=True,
+            help="Что мерить: [имя=]URL. Можно указать несколько раз",
+        )
+        parser.add_argument(
+            "--method",
+            default="POST",
+            help="HTTP-метод (POST для incoming, GET для status)",
+        )
+        parser.add_argument(
+            "--body",
+            default='{"event": "bench.ping", "data": {"n": 1}}',
+            help="Тело запроса",
+        )
+        parser.add_argument(
+            "--duration",
+            type=float,
+            default=10.0,
+            help="Сколько секунд мерить каждую цель",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=50,
+            help="Сколько клиентов шлют запросы одновременно",
+        )
+        parser.add_argument(
+            "--warmup",
+            type=float,
+            default=2.0,
+            help="Прогрев перед замером, секунд (не учитывается)",
+        )
+
+    def handle(self, *args, **options):
+        if options["concurrency"] < 1 or options["duration"] <= 0:
+            raise CommandError("--concurrency and --duration must be positive")
+
+        results = []
+        for target in options["target"]:
+            name, url = parse_target(target)
+
+            self.stdout.write(
+                f"{name}: {options['method']} {url} "
+                f"({options['concurrency']} clients, {options['duration']:.0f}s)..."
+            )
+            result = run_load(
+                url,
+                method=options["method"].upper(),
+                body=options["body"].encode("utf-8"),
+                duration=options["duration"],
+                concurrency=options["concurrency"],
+                warmup=options["warmup"],
+            )
+            results.append((name, result))
+
+        self.stdout.write("")
+        self.stdout.write(f"{'target':<12} {'rps':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for name, r in results:
+            line = (
+                f"{name:<12} {r['rps']:>9.1f} {r['p50']:>8.1f} "
+                f"{r['p95']:>8.1f} {r['p99']:>8.1f} {r['errors']:>7}"
+            )
+            self.stdout.write(self.style.ERROR(line) if r["errors"] else line)
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.delivery import DeliveryWorker
+from core.worker import default_worker_id
+
+
+class Command(BaseCommand):
+    help = "IronRelay delivery worker – параллельно отправляет исходящие вебхуки"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=50,
+            help="Сколько HTTP-запросов держать одновременно",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=0,
+            help="Сколько доставок забирать из БД за раз (по умолчанию = concurrency)",
+        )
+        parser.add_argument(
+            "--worker-id",
+            default="",
+            help="Имя воркера для locked_by (по умолчанию host:pid)",
+        )
+
+    def handle(self, *args, **options):
+        concurrency = options["concurrency"]
+        if concurrency < 1:
+            raise CommandError("--concurrency must be >= 1")
+
+        worker = DeliveryWorker(
+            options["worker_id"] or default_worker_id(),
+            concurrency=concurrency,
+            batch_size=options["batch_size"] or concurrency,
+            stdout=self.stdout,
+            style=self.style,
+        )
+        worker.install_signal_handlers()
+        worker.run()
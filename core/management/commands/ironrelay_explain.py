@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.explain import analyze, cleanup, run_checks, seed
+
+
+class Command(BaseCommand):
+    help = (
+        "IronRelay – проверка планов запросов (claim, дашборд, статус). "
+        "Падает, если запрос ушёл в полный просмотр таблицы или сортировку."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Сначала создать столько тестовых задач (например 1000000). "
+            "Только для отдельной тестовой БД!",
+        )
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help="Не удалять тестовые строки после проверки",
+        )
+
+    def handle(self, *args, **options):
+        count = options["seed"]
+        if count:
+            self.stdout.write(f"Seeding {count} tasks...")
+            seed(count, stdout=self.stdout)
+
+        try:
+            analyze()
+            results = run_checks()
+        finally:
+            if count and not options["keep"]:
+                self.stdout.write("Removing seeded rows...")
+                cleanup()
+
+        failed = 0
+        for name, plan, problems in results:
+            if problems:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f"FAIL {name}: {'; '.join(problems)}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"ok   {name}"))
+            for line in plan.splitlines():
+                self.stdout.write(f"       {line}")
+
+        if failed:
+            raise CommandError(f"{failed} query plan(s) regressed")
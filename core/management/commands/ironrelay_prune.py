@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.retention import KINDS, MODE_ARCHIVE, MODE_DELETE, prune
+
+
+class Command(BaseCommand):
+    help = "IronRelay – перенести в архив (или удалить) завершённые задачи и вебхуки"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--mode",
+            choices=[MODE_ARCHIVE, MODE_DELETE],
+            default=None,
+            help="archive — перенести в архивные таблицы, delete — удалить "
+            "(по умолчанию IRONRELAY_RETENTION_MODE)",
+        )
+        parser.add_argument(
+            "--kind",
+            action="append",
+            choices=list(KINDS),
+            help="Что чистить: task, delivery, incoming (можно несколько раз)",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=None,
+            help="Сколько строк переносить за одну транзакцию",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            result = prune(
+                kinds=options["kind"],
+                mode=options["mode"],
+                chunk_size=options["chunk_size"],
+                stdout=self.stdout,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        total = sum(result.values())
+        self.stdout.write(self.style.SUCCESS(f"Pruned rows: {total}"))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from core.broker import lease_seconds, reap_expired_leases
+from core.wakeup import notify
+
+
+class Command(BaseCommand):
+    help = "IronRelay – вернуть в очередь задачи с просроченной арендой (умершие воркеры)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lease",
+            type=int,
+            default=0,
+            help="Срок аренды в секундах (по умолчанию IRONRELAY_LEASE_SECONDS)",
+        )
+
+    def handle(self, *args, **options):
+        lease = options["lease"] or lease_seconds()
+        reaped = reap_expired_leases(lease)
+        if reaped:
+            notify()
+        self.stdout.write(self.style.SUCCESS(f"Reaped tasks: {reaped}"))
@@ -1,68 +1,116 @@
-import time
-from django.core.management.base import BaseCommand
-from django.utils import timezone
-from django.db import transaction
+from django.core.management.base import BaseCommand, CommandError
 
-from core.models import IronTask
-from core.tasks import IronTaskWrapper
+from core.broker import DEFAULT_CLAIM_BATCH, parse_queues
+from core.tasks import autodiscover_tasks
+from core.worker import (
+    AsyncWorker,
+    PreforkSupervisor,
+    ThreadPoolWorker,
+    Worker,
+    default_worker_id,
+)
 
 
 class Command(BaseCommand):
     help = "IronRelay worker – выполняет фоновые задачи"
 
-    def handle(self, *args, **options):
-        self.stdout.write(self.style.SUCCESS("IronRelay worker started"))
-
-        while True:
-            now = timezone.now()
-
-            task = (
-                IronTask.objects
-                .filter(
-                    status=IronTask.STATUS_PENDING,
-                    scheduled_at__lte=now
-                )
-                .order_by("-priority", "scheduled_at")
-                .first()
-            )
-
-            if not task:
-                time.sleep(1)
-                continue
-
-            # Лочим задачу
-            with transaction.atomic():
-                task = IronTask.objects.select_for_update().get(id=task.id)
-                if task.status != IronTask.STATUS_PENDING:
-                    continue
-
-                task.status = IronTask.STATUS_RUNNING
-                task.locked_at = now
-                task.locked_by = "local-worker"
-                task.save()
-
-            self.stdout.write(f"Running task {task.id} ({task.name})")
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=DEFAULT_CLAIM_BATCH,
+            help="Сколько задач забирать из БД за один запрос",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="Количество дочерних процессов (prefork). 1 — без супервизора",
+        )
+        parser.add_argument(
+            "--pool",
+            choices=["sync", "threads", "asyncio"],
+            default="sync",
+            help=(
+                "Режим выполнения внутри процесса: sync — по одной задаче, "
+                "threads — пул потоков, asyncio — event loop для async def задач"
+            ),
+        )
+        parser.add_argument(
+            "--pool-size",
+            type=int,
+            default=10,
+            help="Потоков (threads) или одновременных задач (asyncio) на процесс",
+        )
+        parser.add_argument(
+            "--preload",
+            action="store_true",
+            help="Заранее импортировать все модули задач (в prefork-режиме всегда)",
+        )
+        parser.add_argument(
+            "--queues",
+            default="",
+            help=(
+                "Очереди с весами, например bulk:1,webhooks:5 "
+                "(по умолчанию — все очереди по приоритету)"
+            ),
+        )
+        parser.add_argument(
+            "--worker-id",
+            default="",
+            help="Имя воркера для locked_by (по умолчанию host:pid)",
+        )
 
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        concurrency = options["concurrency"]
+        pool = options["pool"]
+        pool_size = options["pool_size"]
+        worker_id = options["worker_id"] or default_worker_id()
+
+        if concurrency < 1:
+            raise CommandError("--concurrency must be >= 1")
+        if pool_size < 1:
+            raise CommandError("--pool-size must be >= 1")
+
+        queues = None
+        if options["queues"]:
             try:
-                IronTaskWrapper.run_task(task)
-                task.status = IronTask.STATUS_SUCCESS
-                task.save()
-                self.stdout.write(self.style.SUCCESS(f"Task {task.id} done"))
-
-            except Exception as e:
-                task.attempts += 1
-                task.last_error = str(e)
-
-                if task.attempts >= task.max_attempts:
-                    task.status = IronTask.STATUS_FAILED
-                    self.stdout.write(self.style.ERROR(f"Task {task.id} FAILED"))
-
-                else:
-                    # retry через 3 сек
-                    task.scheduled_at = timezone.now() + timezone.timedelta(seconds=3)
-                    task.status = IronTask.STATUS_PENDING
-                    self.stdout.write(self.style.WARNING(f"Retry task {task.id}"))
-
-                task.save()
-
-            time.sleep(0.2)
+                queues = parse_queues(options["queues"])
+            except ValueError as e:
+                raise CommandError(f"--queues: {e}")
+
+        def make_worker(child_id):
+            common = {
+                "batch_size": batch_size,
+                "stdout": self.stdout,
+                "style": self.style,
+                "queues": queues,
+            }
+            if pool == "threads":
+                return ThreadPoolWorker(child_id, pool_size=pool_size, **common)
+            if pool == "asyncio":
+                return AsyncWorker(child_id, max_in_flight=pool_size, **common)
+            return Worker(child_id, **common)
+
+        if options["preload"]:
+            count = autodiscover_tasks()
+            self.stdout.write(f"Preloaded {count} tasks")
+
+        if concurrency == 1:
+            worker = make_worker(worker_id)
+            worker.install_signal_handlers()
+            worker.run()
+            return
+
+        supervisor = PreforkSupervisor(
+            concurrency,
+            make_worker,
+            base_id=worker_id,
+            stdout=self.stdout,
+            style=self.style,
+        )
+        try:
+            supervisor.run()
+        except RuntimeError as e:
+            raise CommandError(str(e))
@@ -0,0 +1,336 @@
+# core/metrics.py
+#
+# Метрики IronRelay в формате Prometheus (text exposition 0.0.4).
+#
+# Каждый процесс-воркер копит счётчики и гистограммы у себя в памяти
+# (без записи в БД на каждое наблюдение). Heartbeat раз в
+# IRONRELAY_METRICS_FLUSH_INTERVAL секунд пишет снимок целиком — одна
+# строка IronWorkerMetrics на воркер, один UPDATE. /ironrelay/metrics/
+# складывает снимки всех воркеров.
+#
+# Перезапущенный воркер (prefork-ребёнок с тем же "<base>-<slot>")
+# начинает со счётчиков своего прошлого снимка (restore()), иначе его
+# первый сброс уменьшил бы _total-серии.
+
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import IronWorkerMetrics
+
+
+# Границы бакетов (секунды): от миллисекунд до "висело в очереди минуты"
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0,
+)
+
+DEFAULT_FLUSH_INTERVAL = 15
+
+# Снимки воркеров, не обновлявшиеся дольше этого, удаляются
+DEFAULT_STALE_SECONDS = 24 * 3600
+
+# (тип, описание) — для строк # HELP / # TYPE
+METRICS = {
+    "ironrelay_task_queue_latency_seconds": (
+        "histogram", "Time from scheduled_at until a worker started the task",
+    ),
+    "ironrelay_task_duration_seconds": (
+        "histogram", "Task execution time",
+    ),
+    "ironrelay_tasks_total": (
+        "counter", "Finished task attempts by outcome (success, retry, failed, rescheduled)",
+    ),
+    "ironrelay_webhook_delivery_duration_seconds": (
+        "histogram", "Outgoing webhook HTTP request time per target host",
+    ),
+    "ironrelay_webhook_deliveries_total": (
+        "counter", "Outgoing webhook attempts by target host and status code",
+    ),
+    "ironrelay_webhook_host_deferred_total": (
+        "counter", "Deliveries deferred by per-host limits (circuit_open, busy, rate_limited)",
+    ),
+    "ironrelay_worker_busy_seconds_total": (
+        "counter", "Slot-seconds spent executing tasks",
+    ),
+    "ironrelay_worker_slots": (
+        "gauge", "Tasks a worker can run at the same time",
+    ),
+    "ironrelay_worker_utilization": (
+        "gauge", "Share of worker slots busy during the last flush interval",
+    ),
+}
+
+
+def _key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        # накопительные бакеты считаем при выводе, здесь — обычные
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Метрики одного процесса. Потокобезопасно: в ThreadPoolWorker
+    наблюдения идут из нескольких потоков.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}  # (имя, labels) -> число
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = (name, _key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels):
+        with self.lock:
+            self.gauges[(name, _key(labels))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _key(labels))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(value)
+
+    def absorb(self, data: dict):
+        """
+        Добавляет счётчики и гистограммы снимка к метрикам процесса
+        (gauge-и не переносятся — они про текущий процесс).
+        """
+        with self.lock:
+            for name, labels, value in data.get("counters", []):
+                key = (name, _key(labels))
+                self.counters[key] = self.counters.get(key, 0) + value
+
+            for name, labels, buckets, counts, total, count in data.get("histograms", []):
+                key = (name, _key(labels))
+                hist = self.histograms.get(key)
+                if hist is None:
+                    hist = self.histograms[key] = Histogram(tuple(buckets))
+                elif list(hist.buckets) != list(buckets):
+                    continue
+                hist.counts = [a + b for a, b in zip(hist.counts, counts)]
+                hist.sum += total
+                hist.count += count
+
+    def value(self, name: str, **labels) -> float:
+        with self.lock:
+            return self.counters.get((name, _key(labels)), 0)
+
+    def snapshot(self) -> dict:
+        """
+        JSON-совместимый снимок всех метрик процесса.
+        """
+        with self.lock:
+            return {
+                "counters": [
+                    [name, dict(labels), value]
+                    for (name, labels), value in self.counters.items()
+                ],
+                "gauges": [
+                    [name, dict(labels), value]
+                    for (name, labels), value in self.gauges.items()
+                ],
+                "histograms": [
+                    [name, dict(labels), list(h.buckets), list(h.counts), h.sum, h.count]
+                    for (name, labels), h in self.histograms.items()
+                ],
+            }
+
+
+registry = MetricsRegistry()
+
+# worker_id, чей прошлый снимок уже перенесён в registry этого процесса
+_restored = set()
+
+
+def flush_interval() -> float:
+    return getattr(settings, "IRONRELAY_METRICS_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL)
+
+
+def flush(worker_id: str):
+    """
+    Пишет снимок метрик процесса в его строку IronWorkerMetrics.
+    """
+    IronWorkerMetrics.objects.update_or_create(
+        worker_id=worker_id,
+        defaults={"data": registry.snapshot(), "updated_at": timezone.now()},
+    )
+
+
+def restore(worker_id: str):
+    """
+    Продолжает счётчики с прошлого снимка этого worker_id (воркер
+    перезапущен). Вызывается при старте воркера, до первого сброса;
+    в одном процессе — один раз на worker_id.
+    """
+    if worker_id in _restored:
+        return
+    _restored.add(worker_id)
+    data = (
+        IronWorkerMetrics.objects.filter(worker_id=worker_id)
+        .values_list("data", flat=True)
+        .first()
+    )
+    if data:
+        registry.absorb(data)
+
+
+def delete_stale() -> int:
+    cutoff = timezone.now() - timezone.timedelta(
+        seconds=getattr(settings, "IRONRELAY_METRICS_STALE_SECONDS", DEFAULT_STALE_SECONDS)
+    )
+    deleted, _ = IronWorkerMetrics.objects.filter(updated_at__lt=cutoff).delete()
+    return deleted
+
+
+class UtilizationTracker:
+    """
+    Загрузка воркера за интервал между сбросами метрик:
+    прирост busy-секунд / (длина интервала * число слотов).
+    """
+
+    def __init__(self, worker_id: str, slots: int):
+        self.worker_id = worker_id
+        self.slots = max(slots, 1)
+        self.last_busy = 0.0
+        self.last_time = time.monotonic()
+        registry.set("ironrelay_worker_slots", self.slots, worker=worker_id)
+
+    def update(self):
+        now = time.monotonic()
+        busy = registry.value("ironrelay_worker_busy_seconds_total", worker=self.worker_id)
+        elapsed = now - self.last_time
+        if elapsed > 0:
+            share = (busy - self.last_busy) / (elapsed * self.slots)
+            registry.set(
+                "ironrelay_worker_utilization",
+                round(min(max(share, 0.0), 1.0), 4),
+                worker=self.worker_id,
+            )
+        self.last_busy = busy
+        self.last_time = now
+
+
+# --- Вывод ---
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels, extra=()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in items) + "}"
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def merge(snapshots, live_workers=None) -> dict:
+    """
+    Складывает снимки воркеров: счётчики и гистограммы суммируются,
+    gauge-и (у них всегда есть метка worker) берутся только у живых
+    воркеров, если передан live_workers.
+    """
+    counters, gauges, histograms = {}, {}, {}
+
+    for worker_id, data in snapshots:
+        for name, labels, value in data.get("counters", []):
+            key = (name, _key(labels))
+            counters[key] = counters.get(key, 0) + value
+
+        if live_workers is None or worker_id in live_workers:
+            for name, labels, value in data.get("gauges", []):
+                gauges[(name, _key(labels))] = value
+
+        for name, labels, buckets, counts, total, count in data.get("histograms", []):
+            key = (name, _key(labels))
+            merged = histograms.get(key)
+            if merged is None or list(merged.buckets) != list(buckets):
+                if merged is not None:
+                    # другие границы бакетов (старая версия воркера) — пропускаем
+                    continue
+                merged = histograms[key] = Histogram(tuple(buckets))
+            merged.counts = [a + b for a, b in zip(merged.counts, counts)]
+            merged.sum += total
+            merged.count += count
+
+    return {"counters": counters, "gauges": gauges, "histograms": histograms}
+
+
+def render(merged: dict) -> str:
+    """
+    Текст в формате Prometheus exposition.
+    """
+    by_name = {}
+    for kind in ("counters", "gauges", "histograms"):
+        for (name, labels), value in merged[kind].items():
+            by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name in sorted(by_name):
+        kind, help_text = METRICS.get(name, ("untyped", ""))
+        if help_text:
+            lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+        for labels, value in sorted(by_name[name], key=lambda item: item[0]):
+            if isinstance(value, Histogram):
+                cumulative = 0
+                for bound, count in zip(value.buckets, value.counts):
+                    cumulative += count
+                    lines.append(
+                        f"{name}_bucket{_labels(labels, [('le', _number(bound))])} {cumulative}"
+                    )
+                lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {value.count}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(value.sum)}")
+                lines.append(f"{name}_count{_labels(labels)} {value.count}")
+            else:
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+    return "\n".join(lines) + "\n"
+
+
+def collect() -> str:
+    """
+    Метрики всех воркеров из БД — для /ironrelay/metrics/.
+    """
+    rows = list(IronWorkerMetrics.objects.values_list("worker_id", "data", "updated_at"))
+
+    # воркер "жив", если сбрасывал метрики в последние три интервала
+    live_cutoff = timezone.now() - timezone.timedelta(seconds=3 * flush_interval())
+    live = {worker_id for worker_id, _, updated_at in rows if updated_at >= live_cutoff}
+
+    return render(merge([(worker_id, data) for worker_id, data, _ in rows], live))
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IronWebhookDeliveryArchive',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('event', models.CharField(db_index=True, max_length=255)),
+                ('target_url', models.URLField()),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(db_index=True, max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_response_code', models.IntegerField(blank=True, null=True)),
+                ('last_response_body', models.TextField(blank=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'iron_webhook_delivery_archive',
+                'ordering': ['-finished_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='IronIncomingWebhookArchive',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('source', models.CharField(max_length=100)),
+                ('event', models.CharField(blank=True, max_length=255)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(db_index=True, max_length=20)),
+                ('handler_task_id', models.UUIDField(blank=True, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'iron_incoming_webhook_archive',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['source', 'created_at'], name='iron_incomi_source_45bcf5_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='IronTaskArchive',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(db_index=True, max_length=20)),
+                ('priority', models.IntegerField(default=0)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=5)),
+                ('last_error', models.TextField(blank=True)),
+                ('scheduled_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'iron_task_archive',
+                'ordering': ['-finished_at'],
+                'indexes': [models.Index(fields=['name', 'finished_at'], name='iron_task_a_name_cecd92_idx')],
+            },
+        ),
+    ]
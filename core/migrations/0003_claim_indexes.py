@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_retention_archives'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ironincomingwebhook',
+            index=models.Index(fields=['-created_at'], name='iron_incoming_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='irontask',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['-priority', 'scheduled_at'], name='iron_task_claim_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='irontask',
+            index=models.Index(fields=['-created_at'], name='iron_task_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ironwebhookdelivery',
+            index=models.Index(fields=['-created_at'], name='iron_delivery_created_idx'),
+        ),
+    ]
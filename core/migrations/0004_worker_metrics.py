@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_claim_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IronWorkerMetrics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('worker_id', models.CharField(max_length=255, unique=True)),
+                ('data', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'db_table': 'iron_worker_metrics',
+                'ordering': ['worker_id'],
+            },
+        ),
+    ]
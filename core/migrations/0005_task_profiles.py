@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_worker_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IronTaskProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.UUIDField(db_index=True)),
+                ('name', models.CharField(max_length=255)),
+                ('worker_id', models.CharField(blank=True, max_length=255)),
+                ('duration', models.FloatField()),
+                ('functions', models.TextField(blank=True)),
+                ('allocations', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'db_table': 'iron_task_profile',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['name', '-duration'], name='iron_task_p_name_5ca88a_idx')],
+            },
+        ),
+    ]
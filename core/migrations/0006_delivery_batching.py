@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:19
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_task_profiles'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ironwebhookdelivery',
+            name='batched',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='ironwebhookdelivery',
+            name='next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='ironwebhookdelivery',
+            index=models.Index(condition=models.Q(('batched', True)), fields=['target_url', 'status', 'next_attempt_at'], name='iron_delivery_batch_idx'),
+        ),
+    ]
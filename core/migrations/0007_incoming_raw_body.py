@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_delivery_batching'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ironincomingwebhook',
+            name='raw_body',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='ironincomingwebhook',
+            name='payload',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
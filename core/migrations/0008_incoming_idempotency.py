@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_incoming_raw_body'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ironincomingwebhook',
+            name='idempotency_key',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddConstraint(
+            model_name='ironincomingwebhook',
+            constraint=models.UniqueConstraint(condition=models.Q(('idempotency_key', ''), _negated=True), fields=('source', 'idempotency_key'), name='iron_incoming_idempotency_uniq'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:29
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_incoming_idempotency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IronPayloadBlob',
+            fields=[
+                ('hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('codec', models.CharField(max_length=10)),
+                ('size', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'iron_payload_blob',
+            },
+        ),
+        migrations.AlterField(
+            model_name='ironincomingwebhookarchive',
+            name='payload',
+            field=models.JSONField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='irontask',
+            name='payload',
+            field=models.JSONField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='irontaskarchive',
+            name='payload',
+            field=models.JSONField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='ironwebhookdelivery',
+            name='payload',
+            field=models.JSONField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='ironwebhookdeliveryarchive',
+            name='payload',
+            field=models.JSONField(null=True),
+        ),
+        migrations.AddField(
+            model_name='ironincomingwebhook',
+            name='payload_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.ironpayloadblob'),
+        ),
+        migrations.AddField(
+            model_name='ironincomingwebhookarchive',
+            name='payload_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.ironpayloadblob'),
+        ),
+        migrations.AddField(
+            model_name='irontask',
+            name='payload_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.ironpayloadblob'),
+        ),
+        migrations.AddField(
+            model_name='irontaskarchive',
+            name='payload_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.ironpayloadblob'),
+        ),
+        migrations.AddField(
+            model_name='ironwebhookdelivery',
+            name='payload_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.ironpayloadblob'),
+        ),
+        migrations.AddField(
+            model_name='ironwebhookdeliveryarchive',
+            name='payload_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='core.ironpayloadblob'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_payload_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='irontask',
+            name='queue',
+            field=models.CharField(default='default', max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='irontask',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['queue', '-priority', 'scheduled_at'], name='iron_task_queue_claim_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:32
+
+from django.db import migrations, models
+
+
+def fill_claim_rank(apps, schema_editor):
+    """
+    claim_rank для строк, которые ещё будут выбираться (pending).
+    """
+    from core.broker import claim_rank
+
+    IronTask = apps.get_model("core", "IronTask")
+    pending = IronTask.objects.filter(status="pending").only("id", "priority", "scheduled_at")
+    batch = []
+    for task in pending.iterator(chunk_size=1000):
+        task.claim_rank = claim_rank(task.scheduled_at, task.priority)
+        batch.append(task)
+        if len(batch) >= 1000:
+            IronTask.objects.bulk_update(batch, ["claim_rank"])
+            batch = []
+    if batch:
+        IronTask.objects.bulk_update(batch, ["claim_rank"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_task_queues'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='irontask',
+            name='iron_task_claim_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='irontask',
+            name='iron_task_queue_claim_idx',
+        ),
+        migrations.AddField(
+            model_name='irontask',
+            name='claim_rank',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(fill_claim_rank, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='irontask',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['claim_rank', 'scheduled_at'], name='iron_task_claim_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='irontask',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['queue', 'claim_rank', 'scheduled_at'], name='iron_task_queue_claim_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:39
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_task_results'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IronChord',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('callback', models.JSONField()),
+                ('size', models.PositiveIntegerField()),
+                ('remaining', models.IntegerField()),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'db_table': 'iron_chord',
+            },
+        ),
+    ]
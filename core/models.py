@@ -1,9 +1,31 @@
+import json
 import uuid
 from django.db import models
 from django.utils import timezone
 
 
-class IronTask(models.Model):
+class PayloadBlobMixin:
+    """
+    Доступ к payload, который мог уйти в IronPayloadBlob.
+    """
+
+    def get_payload(self):
+        """
+        payload строки; вынесенный — читается из блоба (отдельный запрос).
+        """
+        if self.payload_blob_id is None:
+            return self.payload
+        # блоб читаем один раз на объект: воркер обращается к payload
+        # и при выполнении, и при записи результата
+        loaded = self.__dict__.get("_blob_payload")
+        if loaded is None:
+            from .blobs import load
+
+            loaded = self.__dict__["_blob_payload"] = json.loads(load(self.payload_blob_id))
+        return loaded
+
+
+class IronTask(PayloadBlobMixin, models.Model):
     """
     Фоновые задачи IronRelay.
 
@@ -25,6 +47,8 @@ class IronTask(models.Model):
         (STATUS_CANCELLED, "Cancelled"),
     ]
 
+    DEFAULT_QUEUE = "default"
+
     id = models.UUIDField(
         primary_key=True,
         default=uuid.uuid4,
@@ -34,8 +58,21 @@ class IronTask(models.Model):
     # Полное имя функции задачи, например: "app.tasks.send_welcome_email"
     name = models.CharField(max_length=255)
 
+    # Именованная очередь (@task(queue=...)); воркер с --queues берёт
+    # задачи только из своих очередей
+    queue = models.CharField(max_length=100, default=DEFAULT_QUEUE)
+
     # Аргументы задачи: {"args": [...], "kwargs": {...}}
-    payload = models.JSONField()
+    payload = models.JSONField(null=True)
+    # Большой payload лежит сжатым в IronPayloadBlob (core/blobs.py),
+    # тогда payload = NULL
+    payload_blob = models.ForeignKey(
+        "IronPayloadBlob",
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
 
     status = models.CharField(
         max_length=20,
@@ -50,6 +87,11 @@ class IronTask(models.Model):
     # Когда задачу можно забирать в работу
     scheduled_at = models.DateTimeField(default=timezone.now, db_index=True)
 
+    # Порядок выборки с "старением" приоритета (core/broker.py, claim_rank):
+    # scheduled_at в секундах минус priority * IRONRELAY_PRIORITY_AGING_SECONDS.
+    # Меньше — раньше. Пересчитывается при каждом изменении scheduled_at.
+    claim_rank = models.FloatField(default=0)
+
     attempts = models.PositiveIntegerField(default=0)
     max_attempts = models.PositiveIntegerField(default=5)
 
@@ -67,13 +109,48 @@ class IronTask(models.Model):
         indexes = [
             models.Index(fields=["status", "scheduled_at"]),
             models.Index(fields=["status", "priority"]),
+            # Индекс под claim-запрос воркера: только pending-строки, сразу
+            # в порядке выборки (claim_rank) — без сортировки; scheduled_at
+            # в индексе, чтобы отложенные строки отсеивались без чтения таблицы.
+            # Частичные индексы есть в PostgreSQL и SQLite, остальные БД
+            # его пропускают.
+            models.Index(
+                fields=["claim_rank", "scheduled_at"],
+                condition=models.Q(status="pending"),
+                name="iron_task_claim_idx",
+            ),
+            # то же внутри одной очереди: claim воркера с --queues
+            models.Index(
+                fields=["queue", "claim_rank", "scheduled_at"],
+                condition=models.Q(status="pending"),
+                name="iron_task_queue_claim_idx",
+            ),
+            # "последние задачи" на дашборде
+            models.Index(fields=["-created_at"], name="iron_task_created_idx"),
         ]
 
     def __str__(self) -> str:
         return f"{self.name} [{self.status}]"
 
+    def refresh_claim_rank(self):
+        """
+        claim_rank из scheduled_at и priority (core/broker.py).
+        """
+        from .broker import claim_rank
+
+        self.claim_rank = claim_rank(self.scheduled_at, self.priority)
+
+    def save(self, *args, **kwargs):
+        # задача, созданная не через defer() (objects.create, админка, свой
+        # код), встаёт в очередь по тем же правилам, а не с рангом 0
+        self.refresh_claim_rank()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"scheduled_at", "priority"} & set(update_fields):
+            kwargs["update_fields"] = set(update_fields) | {"claim_rank"}
+        super().save(*args, **kwargs)
 
-class IronWebhookDelivery(models.Model):
+
+class IronWebhookDelivery(PayloadBlobMixin, models.Model):
     """
     Исходящие вебхуки, которые IronRelay отправляет по HTTP.
     """
@@ -99,7 +176,16 @@ class IronWebhookDelivery(models.Model):
     event = models.CharField(max_length=255, db_index=True)
     target_url = models.URLField()
 
-    payload = models.JSONField()
+    payload = models.JSONField(null=True)
+    # Большой payload лежит сжатым в IronPayloadBlob (core/blobs.py),
+    # тогда payload = NULL
+    payload_blob = models.ForeignKey(
+        "IronPayloadBlob",
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
 
     status = models.CharField(
         max_length=20,
@@ -115,6 +201,12 @@ class IronWebhookDelivery(models.Model):
     last_response_body = models.TextField(blank=True)
     last_error = models.TextField(blank=True)
 
+    # Пакетная доставка: строка ждёт общего POST-а на target_url
+    # (send_webhook(..., batch=True)), своей IronTask у неё нет
+    batched = models.BooleanField(default=False)
+    # когда пакетную строку можно отправлять (повтор после ошибки — позже)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -123,6 +215,13 @@ class IronWebhookDelivery(models.Model):
         ordering = ["-created_at"]
         indexes = [
             models.Index(fields=["event", "status"]),
+            models.Index(fields=["-created_at"], name="iron_delivery_created_idx"),
+            # выборка буфера одного получателя для пакетной отправки
+            models.Index(
+                fields=["target_url", "status", "next_attempt_at"],
+                condition=models.Q(batched=True),
+                name="iron_delivery_batch_idx",
+            ),
         ]
 
     def __str__(self) -> str:
@@ -157,7 +256,21 @@ class IronIncomingWebhook(models.Model):
 
     event = models.CharField(max_length=255, blank=True)
 
-    payload = models.JSONField()
+    # Разобранное тело. Новые вебхуки (core/ingest.py) его не заполняют:
+    # тело лежит в raw_body как пришло, без повторной сериализации
+    payload = models.JSONField(null=True, blank=True)
+    raw_body = models.TextField(blank=True)
+    # большое тело — в IronPayloadBlob (как пришло), raw_body тогда пуст
+    payload_blob = models.ForeignKey(
+        "IronPayloadBlob",
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+
+    # Ключ повтора от провайдера (IRONRELAY_IDEMPOTENCY), "" — нет ключа
+    idempotency_key = models.CharField(max_length=255, blank=True, default="")
 
     status = models.CharField(
         max_length=20,
@@ -166,7 +279,7 @@ class IronIncomingWebhook(models.Model):
         db_index=True,
     )
 
-    # Сюда потом можно будет привязать задачу обработки
+    # Задача обработки (создаётся в одной транзакции с вебхуком)
     handler_task = models.ForeignKey(
         IronTask,
         on_delete=models.SET_NULL,
@@ -182,7 +295,258 @@ class IronIncomingWebhook(models.Model):
         ordering = ["-created_at"]
         indexes = [
             models.Index(fields=["source", "status"]),
+            models.Index(fields=["-created_at"], name="iron_incoming_created_idx"),
+        ]
+        constraints = [
+            # один вебхук на ключ повтора в пределах источника
+            models.UniqueConstraint(
+                fields=["source", "idempotency_key"],
+                condition=~models.Q(idempotency_key=""),
+                name="iron_incoming_idempotency_uniq",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.source} [{self.event or 'no event'}]"
+
+    @property
+    def data(self):
+        """
+        Тело вебхука: payload, а для новых строк — разобранный raw_body
+        (или тело из IronPayloadBlob).
+        """
+        if self.payload is not None:
+            return self.payload
+        if self.raw_body:
+            return json.loads(self.raw_body)
+        if self.payload_blob_id is not None:
+            from .blobs import load
+
+            return json.loads(load(self.payload_blob_id))
+        return {}
+
+
+# --- Архив ---
+#
+# Завершённые строки переносятся сюда подсистемой хранения (core/retention.py),
+# чтобы в "горячих" таблицах оставалась только живая работа.
+
+
+class IronTaskArchive(PayloadBlobMixin, models.Model):
+    """
+    Архив завершённых задач (success / failed / cancelled).
+    """
+
+    id = models.UUIDField(primary_key=True, editable=False)
+    name = models.CharField(max_length=255)
+    payload = models.JSONField(null=True)
+    payload_blob = models.ForeignKey(
+        "IronPayloadBlob", on_delete=models.PROTECT, null=True, blank=True, related_name="+"
+    )
+    status = models.CharField(max_length=20, db_index=True)
+    priority = models.IntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    last_error = models.TextField(blank=True)
+    scheduled_at = models.DateTimeField()
+    created_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "iron_task_archive"
+        ordering = ["-finished_at"]
+        indexes = [
+            models.Index(fields=["name", "finished_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.name} [{self.status}]"
+
+
+class IronWebhookDeliveryArchive(PayloadBlobMixin, models.Model):
+    """
+    Архив завершённых исходящих вебхуков.
+    """
+
+    id = models.UUIDField(primary_key=True, editable=False)
+    event = models.CharField(max_length=255, db_index=True)
+    target_url = models.URLField()
+    payload = models.JSONField(null=True)
+    payload_blob = models.ForeignKey(
+        "IronPayloadBlob", on_delete=models.PROTECT, null=True, blank=True, related_name="+"
+    )
+    status = models.CharField(max_length=20, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_response_code = models.IntegerField(null=True, blank=True)
+    last_response_body = models.TextField(blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "iron_webhook_delivery_archive"
+        ordering = ["-finished_at"]
+
+    def __str__(self) -> str:
+        return f"{self.event} -> {self.target_url} [{self.status}]"
+
+
+class IronIncomingWebhookArchive(PayloadBlobMixin, models.Model):
+    """
+    Архив входящих вебхуков.
+    """
+
+    id = models.UUIDField(primary_key=True, editable=False)
+    source = models.CharField(max_length=100)
+    event = models.CharField(max_length=255, blank=True)
+    payload = models.JSONField(null=True)
+    payload_blob = models.ForeignKey(
+        "IronPayloadBlob", on_delete=models.PROTECT, null=True, blank=True, related_name="+"
+    )
+    status = models.CharField(max_length=20, db_index=True)
+    # без FK: задача-обработчик к этому моменту тоже может быть в архиве
+    handler_task_id = models.UUIDField(null=True, blank=True)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "iron_incoming_webhook_archive"
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["source", "created_at"]),
         ]
 
     def __str__(self) -> str:
         return f"{self.source} [{self.event or 'no event'}]"
+
+
+# --- Результаты ---
+
+
+class IronTaskResult(models.Model):
+    """
+    Результат задачи @task(store_result=True) (core/results.py).
+    Живёт IRONRELAY_RESULT_TTL, потом удаляется prune_finished.
+    """
+
+    STATUS_SUCCESS = "success"
+    STATUS_FAILED = "failed"
+
+    STATUS_CHOICES = [
+        (STATUS_SUCCESS, "Success"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    # без FK: задача может уйти в архив раньше, чем истечёт результат
+    task_id = models.UUIDField(primary_key=True)
+    name = models.CharField(max_length=255)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES)
+    value = models.JSONField(null=True, blank=True)
+    # текст ошибки (failed) или почему значение не сохранено (success)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = "iron_task_result"
+
+    def __str__(self) -> str:
+        return f"{self.name} [{self.status}]"
+
+
+class IronChord(models.Model):
+    """
+    Счётчик незавершённых задач chord-а (core/workflows.py). Каждая
+    завершившаяся задача группы уменьшает remaining одним UPDATE; та,
+    что довела его до нуля, ставит callback и удаляет строку.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # сигнатура callback-а: {"id", "name", "args", "kwargs", ...}
+    callback = models.JSONField()
+    size = models.PositiveIntegerField()
+    remaining = models.IntegerField()
+    failed = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = "iron_chord"
+
+    def __str__(self) -> str:
+        return f"{self.callback.get('name')} [{self.remaining}/{self.size}]"
+
+
+# --- Метрики ---
+
+
+class IronWorkerMetrics(models.Model):
+    """
+    Последний снимок метрик воркера (core/metrics.py).
+    Одна строка на воркер, перезаписывается раз в интервал сброса.
+    """
+
+    worker_id = models.CharField(max_length=255, unique=True)
+    data = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = "iron_worker_metrics"
+        ordering = ["worker_id"]
+
+    def __str__(self) -> str:
+        return self.worker_id
+
+
+class IronTaskProfile(models.Model):
+    """
+    Профиль медленного выполнения задачи (core/profiling.py):
+    топ функций cProfile и, если включено, мест аллокаций tracemalloc.
+    """
+
+    # без FK: задача могла уже уйти в архив
+    task_id = models.UUIDField(db_index=True)
+    name = models.CharField(max_length=255)
+    worker_id = models.CharField(max_length=255, blank=True)
+    duration = models.FloatField()
+    functions = models.TextField(blank=True)
+    allocations = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = "iron_task_profile"
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["name", "-duration"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.name} ({self.duration:.2f}s)"
+
+
+# --- Большие тела ---
+
+
+class IronPayloadBlob(models.Model):
+    """
+    Сжатое большое тело (аргументы задачи, payload вебхука), вынесенное
+    из горячих таблиц (core/blobs.py). Ключ — sha256 несжатых байт:
+    одинаковые тела хранятся один раз.
+    """
+
+    CODEC_ZLIB = "zlib"
+    CODEC_ZSTD = "zstd"
+
+    hash = models.CharField(max_length=64, primary_key=True)
+    codec = models.CharField(max_length=10)
+    # несжатый размер, байт
+    size = models.PositiveIntegerField()
+    data = models.BinaryField()
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        db_table = "iron_payload_blob"
+
+    def __str__(self) -> str:
+        return f"{self.hash[:12]} ({self.codec}, {self.size} B)"
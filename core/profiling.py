@@ -0,0 +1,152 @@
+# core/profiling.py
+#
+# Профилирование медленных выполнений задач (по желанию, выключено
+# по умолчанию).
+#
+# Настройки:
+#   IRONRELAY_PROFILE_TASKS = {"app.tasks.build_report": 1.0, "*": 0.01}
+#       доля выполнений, которые профилируем, по имени задачи;
+#       "*" — для всех остальных задач
+#   IRONRELAY_PROFILE_THRESHOLD = 1.0
+#       сохраняем профиль, только если выполнение заняло дольше (секунды)
+#   IRONRELAY_PROFILE_MEMORY = False
+#       дополнительно снимать tracemalloc (заметно замедляет задачу)
+#   IRONRELAY_PROFILE_TOP = 30
+#       сколько функций / мест аллокаций сохранять
+#
+# Профили видны в админке (IronTaskProfile).
+
+import cProfile
+import io
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import IronTask, IronTaskProfile
+
+
+DEFAULT_THRESHOLD = 1.0
+DEFAULT_TOP = 30
+DEFAULT_RETENTION = timedelta(days=7)
+
+# tracemalloc один на процесс: одновременно снимаем память только
+# для одной задачи, остальные профилируются без неё
+_memory_lock = threading.Lock()
+
+
+def sample_rate(name: str) -> float:
+    rates = getattr(settings, "IRONRELAY_PROFILE_TASKS", None) or {}
+    return float(rates.get(name, rates.get("*", 0)))
+
+
+def should_profile(name: str) -> bool:
+    rate = sample_rate(name)
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def _format_functions(profiler: cProfile.Profile, top: int) -> str:
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+    return out.getvalue()
+
+
+def _format_allocations(snapshot, top: int) -> str:
+    snapshot = snapshot.filter_traces(
+        [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+    )
+    lines = []
+    for stat in snapshot.statistics("lineno")[:top]:
+        frame = stat.traceback[0]
+        lines.append(
+            f"{stat.size / 1024:10.1f} KiB  {stat.count:8d} blocks  {frame.filename}:{frame.lineno}"
+        )
+    return "\n".join(lines)
+
+
+@contextmanager
+def profile_task(task: IronTask):
+    """
+    Оборачивает выполнение задачи. Если задача попала в выборку и
+    выполнялась дольше порога — сохраняет IronTaskProfile.
+
+    cProfile видит только текущий поток: в пуле потоков каждый поток
+    профилирует свою задачу независимо.
+    """
+    if not should_profile(task.name):
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    memory = getattr(settings, "IRONRELAY_PROFILE_MEMORY", False) and _memory_lock.acquire(
+        blocking=False
+    )
+    started_tracing = False
+
+    try:
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracing = True
+
+        started = time.perf_counter()
+        try:
+            profiler.enable()
+        except ValueError:
+            # профилировщик уже активен (запущен снаружи) — без cProfile
+            profiler = None
+
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            elapsed = time.perf_counter() - started
+            snapshot = tracemalloc.take_snapshot() if memory else None
+
+            threshold = getattr(settings, "IRONRELAY_PROFILE_THRESHOLD", DEFAULT_THRESHOLD)
+            if elapsed >= threshold:
+                _save(task, elapsed, profiler, snapshot)
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        if memory:
+            _memory_lock.release()
+
+
+def _save(task: IronTask, elapsed: float, profiler, snapshot):
+    top = getattr(settings, "IRONRELAY_PROFILE_TOP", DEFAULT_TOP)
+    try:
+        IronTaskProfile.objects.create(
+            task_id=task.id,
+            name=task.name,
+            worker_id=task.locked_by,
+            duration=elapsed,
+            functions=_format_functions(profiler, top) if profiler is not None else "",
+            allocations=_format_allocations(snapshot, top) if snapshot is not None else "",
+        )
+    except Exception:
+        # профиль — диагностика, он не должен ронять задачу
+        pass
+
+
+def delete_old_profiles() -> int:
+    """
+    Удаляет профили старше IRONRELAY_PROFILE_RETENTION (timedelta или секунды).
+    """
+    ttl = getattr(settings, "IRONRELAY_PROFILE_RETENTION", DEFAULT_RETENTION)
+    if ttl is None:
+        return 0
+    if not isinstance(ttl, timedelta):
+        ttl = timedelta(seconds=ttl)
+    deleted, _ = IronTaskProfile.objects.filter(created_at__lt=timezone.now() - ttl).delete()
+    return deleted
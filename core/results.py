@@ -0,0 +1,246 @@
+# core/results.py
+#
+# Результаты задач.
+#
+# defer() возвращает TaskHandle. Задача с @task(store_result=True) после
+# выполнения пишет возвращённое значение (JSON) или текст ошибки в
+# IronTaskResult, и handle.wait() / gather() его получают:
+#
+#   handle = build_report.defer(42)
+#   report = handle.wait(timeout=30)
+#
+#   values = gather([resize.defer(i) for i in ids], timeout=60)
+#
+# Ожидание не крутит SELECT в цикле: воркер после записи результата шлёт
+# уведомление по каналу пробуждения (RESULTS_CHANNEL в core/wakeup.py),
+# а между уведомлениями — экспоненциальный backoff. Каждое пробуждение —
+# один SELECT на все ещё не готовые задачи.
+#
+# Внутри transaction.atomic() задача появится в очереди только после
+# commit-а — ждать её результат в той же транзакции бессмысленно.
+#
+# Настройки:
+#   IRONRELAY_RESULT_TTL = 86400          (секунды или timedelta)
+#   IRONRELAY_RESULT_MAX_BYTES = 65536    (больше — значение не сохраняется)
+#   IRONRELAY_RESULT_POLL_MAX = 1.0       (максимальная пауза опроса, с)
+
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import IronTaskResult
+from .wakeup import RESULTS_CHANNEL, IdleBackoff, get_waiter, notify
+
+
+DEFAULT_TTL = timedelta(days=1)
+DEFAULT_MAX_BYTES = 64 * 1024
+DEFAULT_POLL_MAX = 1.0
+
+
+class TaskFailed(Exception):
+    """
+    Задача завершилась ошибкой (все попытки исчерпаны).
+    """
+
+    def __init__(self, task_id, error: str):
+        super().__init__(f"Task {task_id} failed: {error}")
+        self.task_id = task_id
+        self.error = error
+
+
+class ResultUnavailable(LookupError):
+    """
+    Задача выполнена, но значения нет: задача не хранит результаты,
+    значение слишком большое или не сериализуется в JSON.
+    """
+
+
+class ResultTimeout(TimeoutError):
+    pass
+
+
+def _ttl() -> timedelta:
+    ttl = getattr(settings, "IRONRELAY_RESULT_TTL", DEFAULT_TTL)
+    if not isinstance(ttl, timedelta):
+        ttl = timedelta(seconds=ttl)
+    return ttl
+
+
+def _encode(value):
+    """
+    (значение, причина) — причина непустая, если значение не сохраняем.
+    """
+    try:
+        size = len(json.dumps(value))
+    except (TypeError, ValueError) as e:
+        return None, f"Result is not JSON serializable: {e}"
+
+    limit = getattr(settings, "IRONRELAY_RESULT_MAX_BYTES", DEFAULT_MAX_BYTES)
+    if limit and size > limit:
+        return None, f"Result too large: {size} bytes (IRONRELAY_RESULT_MAX_BYTES={limit})"
+    return value, ""
+
+
+def success(task, value) -> IronTaskResult:
+    value, error = _encode(value)
+    return IronTaskResult(
+        task_id=task.id,
+        name=task.name,
+        status=IronTaskResult.STATUS_SUCCESS,
+        value=value,
+        error=error,
+        expires_at=timezone.now() + _ttl(),
+    )
+
+
+def failure(task, error: str) -> IronTaskResult:
+    return IronTaskResult(
+        task_id=task.id,
+        name=task.name,
+        status=IronTaskResult.STATUS_FAILED,
+        error=error,
+        expires_at=timezone.now() + _ttl(),
+    )
+
+
+def save(results):
+    """
+    Записывает результаты (одним INSERT) и будит ожидающих.
+    Повторное выполнение той же задачи перезаписывает результат.
+    """
+    if not results:
+        return
+    IronTaskResult.objects.bulk_create(
+        results,
+        update_conflicts=True,
+        unique_fields=["task_id"],
+        update_fields=["status", "value", "error", "expires_at"],
+    )
+    # внутри транзакции будим только после commit-а, иначе ожидающий
+    # проснётся раньше, чем увидит строку
+    transaction.on_commit(lambda: notify(channel=RESULTS_CHANNEL))
+
+
+def stores_result(name: str) -> bool:
+    """
+    Хранит ли задача с таким именем результаты (@task(store_result=True)).
+    """
+    from .tasks import TaskNotRegistered, get_task
+
+    try:
+        return get_task(name).store_result
+    except TaskNotRegistered:
+        return False
+
+
+def _unwrap(result: IronTaskResult):
+    if result.status == IronTaskResult.STATUS_FAILED:
+        raise TaskFailed(result.task_id, result.error)
+    if result.error:
+        raise ResultUnavailable(result.error)
+    return result.value
+
+
+def _wait_for(handles, timeout=None) -> dict:
+    """
+    Ждёт результаты задач: {task_id: IronTaskResult} — всё, что успело
+    появиться за timeout (None — ждать без ограничения).
+    """
+    for handle in handles:
+        if not handle.stores_result():
+            raise ResultUnavailable(
+                f"{handle.name} does not store results; use @task(store_result=True)"
+            )
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    pending = {handle.id for handle in handles}
+    found = {}
+
+    # подписываемся до первого SELECT-а: уведомление не потеряется
+    waiter = get_waiter(channel=RESULTS_CHANNEL)
+    backoff = IdleBackoff(
+        initial=0.01,
+        maximum=getattr(settings, "IRONRELAY_RESULT_POLL_MAX", DEFAULT_POLL_MAX),
+    )
+    try:
+        while True:
+            for result in IronTaskResult.objects.filter(task_id__in=pending):
+                found[result.task_id] = result
+                pending.discard(result.task_id)
+            if not pending:
+                break
+
+            delay = backoff.next()
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                delay = min(delay, left)
+            waiter.wait(delay)
+    finally:
+        waiter.close()
+    return found
+
+
+class TaskHandle:
+    """
+    Ссылка на поставленную задачу (возвращается из defer()).
+    """
+
+    def __init__(self, task_id, name: str):
+        self.id = task_id
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"<TaskHandle {self.name} {self.id}>"
+
+    def stores_result(self) -> bool:
+        return stores_result(self.name)
+
+    def ready(self) -> bool:
+        return IronTaskResult.objects.filter(task_id=self.id).exists()
+
+    def wait(self, timeout=None):
+        """
+        Значение, которое вернула задача. TaskFailed — задача упала,
+        ResultTimeout — не успела за timeout секунд.
+        """
+        result = _wait_for([self], timeout).get(self.id)
+        if result is None:
+            raise ResultTimeout(f"Task {self.id} not finished in {timeout}s")
+        return _unwrap(result)
+
+    def forget(self):
+        IronTaskResult.objects.filter(task_id=self.id).delete()
+
+
+def gather(handles, timeout=None, return_exceptions=False) -> list:
+    """
+    Результаты многих задач в порядке handles: один SELECT на пробуждение
+    для всех ещё не готовых. return_exceptions=True — ошибки (TaskFailed,
+    ResultTimeout, ...) возвращаются на месте значений, а не бросаются.
+    """
+    handles = list(handles)
+    found = _wait_for(handles, timeout)
+
+    values = []
+    for handle in handles:
+        try:
+            result = found.get(handle.id)
+            if result is None:
+                raise ResultTimeout(f"Task {handle.id} not finished in {timeout}s")
+            values.append(_unwrap(result))
+        except (TaskFailed, ResultUnavailable, ResultTimeout) as e:
+            if not return_exceptions:
+                raise
+            values.append(e)
+    return values
+
+
+def delete_expired_results() -> int:
+    deleted, _ = IronTaskResult.objects.filter(expires_at__lt=timezone.now()).delete()
+    return deleted
@@ -0,0 +1,238 @@
+# core/retention.py
+#
+# Хранение истории IronRelay: завершённые задачи, доставки и входящие
+# вебхуки старше заданного срока переносятся в архивные таблицы
+# (или удаляются) небольшими пачками. В горячих таблицах остаётся только
+# pending / running работа, и запросы воркера и дашборда не деградируют
+# с ростом истории.
+#
+# Настройки:
+#   IRONRELAY_RETENTION_MODE = "archive" | "delete"
+#   IRONRELAY_RETENTION = {
+#       "task":     {"success": 7 дней, "failed": 30 дней, ...},
+#       "delivery": {...},
+#       "incoming": {...},
+#   }
+# Срок — timedelta или число секунд; None — хранить вечно.
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import (
+    IronIncomingWebhook,
+    IronIncomingWebhookArchive,
+    IronTask,
+    IronTaskArchive,
+    IronWebhookDelivery,
+    IronWebhookDeliveryArchive,
+)
+from .tasks import task
+
+
+MODE_ARCHIVE = "archive"
+MODE_DELETE = "delete"
+
+DEFAULT_CHUNK_SIZE = 1000
+
+DEFAULT_RETENTION = {
+    "task": {
+        IronTask.STATUS_SUCCESS: timedelta(days=7),
+        IronTask.STATUS_CANCELLED: timedelta(days=7),
+        IronTask.STATUS_FAILED: timedelta(days=30),
+    },
+    "delivery": {
+        IronWebhookDelivery.STATUS_SUCCESS: timedelta(days=7),
+        IronWebhookDelivery.STATUS_FAILED: timedelta(days=30),
+    },
+    "incoming": {
+        IronIncomingWebhook.STATUS_HANDLED: timedelta(days=7),
+        IronIncomingWebhook.STATUS_FAILED: timedelta(days=30),
+        # received — не финальный статус: его задача обработки может ещё
+        # ждать в очереди или повторяться, такие строки не трогаем
+    },
+}
+
+
+def _task_to_archive(t: IronTask) -> IronTaskArchive:
+    return IronTaskArchive(
+        id=t.id,
+        name=t.name,
+        payload=t.payload,
+        payload_blob_id=t.payload_blob_id,
+        status=t.status,
+        priority=t.priority,
+        attempts=t.attempts,
+        max_attempts=t.max_attempts,
+        last_error=t.last_error,
+        scheduled_at=t.scheduled_at,
+        created_at=t.created_at,
+        finished_at=t.updated_at,
+    )
+
+
+def _delivery_to_archive(d: IronWebhookDelivery) -> IronWebhookDeliveryArchive:
+    return IronWebhookDeliveryArchive(
+        id=d.id,
+        event=d.event,
+        target_url=d.target_url,
+        payload=d.payload,
+        payload_blob_id=d.payload_blob_id,
+        status=d.status,
+        attempts=d.attempts,
+        last_response_code=d.last_response_code,
+        last_response_body=d.last_response_body,
+        last_error=d.last_error,
+        created_at=d.created_at,
+        finished_at=d.updated_at,
+    )
+
+
+def _incoming_to_archive(w: IronIncomingWebhook) -> IronIncomingWebhookArchive:
+    return IronIncomingWebhookArchive(
+        id=w.id,
+        source=w.source,
+        event=w.event,
+        # вынесенное тело остаётся в блобе, архив хранит ссылку
+        payload=w.data if w.payload_blob_id is None else None,
+        payload_blob_id=w.payload_blob_id,
+        status=w.status,
+        handler_task_id=w.handler_task_id,
+        created_at=w.created_at,
+    )
+
+
+# вид -> (модель, поле времени завершения, архивная модель, конвертер)
+# Входящие вебхуки идут первыми: удаление задачи обнуляет их handler_task.
+KINDS = {
+    "incoming": (IronIncomingWebhook, "created_at", IronIncomingWebhookArchive, _incoming_to_archive),
+    "delivery": (IronWebhookDelivery, "updated_at", IronWebhookDeliveryArchive, _delivery_to_archive),
+    "task": (IronTask, "updated_at", IronTaskArchive, _task_to_archive),
+}
+
+
+def get_retention() -> dict:
+    """
+    Сроки хранения: настройки проекта поверх значений по умолчанию.
+    """
+    configured = getattr(settings, "IRONRELAY_RETENTION", {})
+    result = {}
+    for kind, defaults in DEFAULT_RETENTION.items():
+        ttls = dict(defaults)
+        ttls.update(configured.get(kind, {}))
+        result[kind] = ttls
+    return result
+
+
+def _as_timedelta(ttl):
+    if ttl is None or isinstance(ttl, timedelta):
+        return ttl
+    return timedelta(seconds=ttl)
+
+
+def expired_rows(kind: str, status: str, cutoff):
+    """
+    Строки со статусом `status`, завершённые раньше `cutoff`
+    (план запроса проверяет ironrelay_explain).
+    """
+    model, time_field, _, _ = KINDS[kind]
+    return model.objects.filter(status=status, **{f"{time_field}__lt": cutoff}).order_by()
+
+
+def prune_chunk(kind: str, status: str, cutoff, mode: str, chunk_size: int) -> int:
+    """
+    Одна пачка: до chunk_size строк со статусом `status`, завершённых
+    раньше `cutoff`. Копирование в архив и удаление — в одной транзакции.
+    """
+    model, _, archive_model, convert = KINDS[kind]
+
+    with transaction.atomic():
+        rows = list(expired_rows(kind, status, cutoff)[:chunk_size])
+        if not rows:
+            return 0
+
+        if mode == MODE_ARCHIVE:
+            archive_model.objects.bulk_create(
+                [convert(row) for row in rows],
+                ignore_conflicts=True,
+            )
+
+        model.objects.filter(id__in=[row.id for row in rows]).delete()
+
+    return len(rows)
+
+
+def prune(kinds=None, mode=None, chunk_size=None, max_chunks=None, stdout=None) -> dict:
+    """
+    Переносит/удаляет устаревшие завершённые строки пачками.
+
+    max_chunks ограничивает количество пачек на один статус за вызов —
+    чтобы периодическая задача не занимала воркер надолго.
+
+    Возвращает {(kind, status): количество}.
+    """
+    mode = mode or getattr(settings, "IRONRELAY_RETENTION_MODE", MODE_ARCHIVE)
+    if mode not in (MODE_ARCHIVE, MODE_DELETE):
+        raise ValueError(f"Unknown retention mode: {mode}")
+    chunk_size = chunk_size or getattr(settings, "IRONRELAY_RETENTION_CHUNK", DEFAULT_CHUNK_SIZE)
+
+    now = timezone.now()
+    retention = get_retention()
+    result = {}
+
+    for kind in [k for k in KINDS if not kinds or k in kinds]:
+        for status, ttl in retention[kind].items():
+            ttl = _as_timedelta(ttl)
+            if ttl is None:
+                continue
+
+            cutoff = now - ttl
+            total = 0
+            chunks = 0
+            while max_chunks is None or chunks < max_chunks:
+                moved = prune_chunk(kind, status, cutoff, mode, chunk_size)
+                total += moved
+                chunks += 1
+                if moved < chunk_size:
+                    break
+
+            if total:
+                result[(kind, status)] = total
+                if stdout is not None:
+                    stdout.write(f"{kind}/{status}: {total} ({mode})")
+
+    return result
+
+
+@task
+def prune_finished():
+    """
+    Периодическая задача хранения; её ставит heartbeat воркера раз в
+    IRONRELAY_RETENTION_INTERVAL секунд.
+    """
+    from .blobs import delete_orphan_blobs
+    from .profiling import delete_old_profiles
+    from .results import delete_expired_results
+    from .workflows import delete_stale_chords
+
+    prune(max_chunks=getattr(settings, "IRONRELAY_RETENTION_MAX_CHUNKS", 100))
+    delete_old_profiles()
+    delete_orphan_blobs()
+    delete_expired_results()
+    delete_stale_chords()
+
+
+def schedule_prune():
+    """
+    Ставит prune_finished, если такой задачи ещё нет в очереди
+    (много воркеров — одна задача).
+    """
+    name = prune_finished._iron_task.name
+    queued = IronTask.objects.filter(
+        name=name,
+        status__in=[IronTask.STATUS_PENDING, IronTask.STATUS_RUNNING],
+    ).exists()
+    if not queued:
+        prune_finished.defer()
@@ -0,0 +1,88 @@
+# core/retry.py
+#
+# Политики повторов задач IronRelay: экспоненциальная пауза с потолком
+# и jitter-ом, фильтр по типам исключений, учёт Retry-After.
+
+import random
+
+
+class RetryPolicy:
+    """
+    Как и когда повторять упавшую задачу.
+
+    Пауза перед попыткой N (N = 1, 2, ...):
+        base * factor ** (N - 1), но не больше max_delay;
+    jitter:
+        "full"  — случайно в [0, пауза] (по умолчанию, лучше всего
+                  разносит одновременные ретраи);
+        "equal" — пауза/2 + случайно в [0, пауза/2];
+        "none"  — ровно пауза.
+
+    retry_on / dont_retry_on — какие исключения повторять. Остальные
+    сразу переводят задачу в failed, не занимая воркер новыми попытками.
+
+    Если у исключения есть атрибут `retry_after` (секунды, например из
+    заголовка Retry-After), пауза берётся из него.
+    """
+
+    JITTER_FULL = "full"
+    JITTER_EQUAL = "equal"
+    JITTER_NONE = "none"
+
+    def __init__(
+        self,
+        base: float = 3.0,
+        factor: float = 2.0,
+        max_delay: float = 600.0,
+        jitter: str = JITTER_FULL,
+        retry_on=(Exception,),
+        dont_retry_on=(),
+    ):
+        if jitter not in (self.JITTER_FULL, self.JITTER_EQUAL, self.JITTER_NONE):
+            raise ValueError(f"Unknown jitter mode: {jitter}")
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.retry_on = tuple(retry_on)
+        self.dont_retry_on = tuple(dont_retry_on)
+
+    def should_retry(self, exc: BaseException) -> bool:
+        if self.dont_retry_on and isinstance(exc, self.dont_retry_on):
+            return False
+        return isinstance(exc, self.retry_on)
+
+    def delay(self, attempt: int, exc: BaseException = None) -> float:
+        """
+        Пауза в секундах перед следующей попыткой; attempt — номер
+        только что упавшей попытки (1 — первая).
+        """
+        retry_after = getattr(exc, "retry_after", None)
+        if retry_after is not None:
+            # получатель сам сказал, когда приходить; добавляем до 10%,
+            # чтобы все ретраи не пришли в одну и ту же секунду
+            delay = min(max(float(retry_after), 0.0), self.max_delay)
+            return delay + random.uniform(0, delay * 0.1)
+
+        delay = min(self.base * self.factor ** max(attempt - 1, 0), self.max_delay)
+
+        if self.jitter == self.JITTER_FULL:
+            return random.uniform(0, delay)
+        if self.jitter == self.JITTER_EQUAL:
+            return delay / 2 + random.uniform(0, delay / 2)
+        return delay
+
+
+# Политика по умолчанию для @task без параметров
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+class Reschedule(Exception):
+    """
+    Задача не может выполняться сейчас, но и не упала: воркер вернёт её
+    в очередь через `delay` секунд, не засчитывая попытку.
+    """
+
+    def __init__(self, message: str = "", delay: float = 1.0):
+        super().__init__(message)
+        self.delay = max(float(delay), 0.0)
@@ -0,0 +1,92 @@
+# core/stats.py
+#
+# Счётчики очереди для дашборда и /ironrelay/status/.
+#
+# Вместо отдельного COUNT(*) на каждую карточку — один сгруппированный
+# запрос по статусам на таблицу, результат живёт в кэше Django
+# IRONRELAY_STATS_CACHE_SECONDS секунд. Частый опрос статуса балансировщиком
+# стоит один поход в кэш, сколько бы строк ни было в таблицах.
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from .models import IronIncomingWebhook, IronTask, IronWebhookDelivery
+
+
+CACHE_KEY = "ironrelay:stats"
+DEFAULT_CACHE_SECONDS = 5
+
+
+def _status_counts(model):
+    return model.objects.order_by().values("status").annotate(n=Count("id"))
+
+
+def _count_by_status(model) -> dict:
+    return {row["status"]: row["n"] for row in _status_counts(model)}
+
+
+async def _acount_by_status(model) -> dict:
+    return {row["status"]: row["n"] async for row in _status_counts(model)}
+
+
+def compute_stats() -> dict:
+    """
+    Три запроса (по одному на таблицу) вместо семи.
+    """
+    return _build_stats(
+        _count_by_status(IronTask),
+        _count_by_status(IronWebhookDelivery),
+        _count_by_status(IronIncomingWebhook),
+    )
+
+
+async def acompute_stats() -> dict:
+    return _build_stats(
+        await _acount_by_status(IronTask),
+        await _acount_by_status(IronWebhookDelivery),
+        await _acount_by_status(IronIncomingWebhook),
+    )
+
+
+def _build_stats(tasks: dict, deliveries: dict, incoming: dict) -> dict:
+    return {
+        "pending_tasks": tasks.get(IronTask.STATUS_PENDING, 0),
+        "running_tasks": tasks.get(IronTask.STATUS_RUNNING, 0),
+        "failed_tasks": tasks.get(IronTask.STATUS_FAILED, 0),
+        "success_webhooks": deliveries.get(IronWebhookDelivery.STATUS_SUCCESS, 0),
+        "total_incoming": sum(incoming.values()),
+        "total_tasks": sum(tasks.values()),
+        "total_deliveries": sum(deliveries.values()),
+    }
+
+
+def get_stats() -> dict:
+    """
+    Счётчики из кэша; пересчитываются не чаще раза в TTL.
+    IRONRELAY_STATS_CACHE_SECONDS = 0 — всегда считать заново.
+    """
+    ttl = getattr(settings, "IRONRELAY_STATS_CACHE_SECONDS", DEFAULT_CACHE_SECONDS)
+    if not ttl:
+        return compute_stats()
+
+    stats = cache.get(CACHE_KEY)
+    if stats is None:
+        stats = compute_stats()
+        cache.set(CACHE_KEY, stats, ttl)
+    return stats
+
+
+async def aget_stats() -> dict:
+    """
+    get_stats() для async-представлений: async-кэш и async ORM.
+    """
+    ttl = getattr(settings, "IRONRELAY_STATS_CACHE_SECONDS", DEFAULT_CACHE_SECONDS)
+    if not ttl:
+        return await acompute_stats()
+
+    stats = await cache.aget(CACHE_KEY)
+    if stats is None:
+        stats = await acompute_stats()
+        await cache.aset(CACHE_KEY, stats, ttl)
+    return stats
@@ -1,10 +1,38 @@
 import importlib
+import inspect
+from collections import namedtuple
 from functools import wraps
 
-from django.db import transaction
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
 from django.utils import timezone
 
 from .models import IronTask
+from .retry import DEFAULT_RETRY_POLICY
+from .wakeup import notify
+
+
+class TaskNotRegistered(LookupError):
+    """
+    Задачи с таким именем нет в реестре (и импортировать её не удалось).
+    """
+
+
+# Реестр задач: полное имя -> IronTaskWrapper. Заполняется декоратором @task.
+registry = {}
+
+# Элемент пачки для @task(batch_size=N): id строки IronTask и её аргументы
+BatchItem = namedtuple("BatchItem", ["id", "args", "kwargs"])
+
+# Модули с задачами самого IronRelay (они лежат не в tasks.py)
+BUILTIN_TASK_MODULES = [
+    "core.webhooks",
+    "core.handlers_core",
+    "core.ingest",
+    "core.retention",
+]
 
 
 def _import_string(path: str):
@@ -17,65 +45,369 @@ def _import_string(path: str):
     return getattr(module, func_name)
 
 
+def autodiscover_tasks() -> int:
+    """
+    Импортирует tasks.py всех установленных приложений, встроенные модули
+    IronRelay и модули из IRONRELAY_TASK_MODULES — декораторы @task
+    заполняют реестр. Возвращает количество зарегистрированных задач.
+    """
+    modules = [f"{app_config.name}.tasks" for app_config in apps.get_app_configs()]
+    modules += BUILTIN_TASK_MODULES
+    modules += list(getattr(settings, "IRONRELAY_TASK_MODULES", []))
+
+    for module_name in modules:
+        try:
+            importlib.import_module(module_name)
+        except ModuleNotFoundError as e:
+            # нет tasks.py у приложения — это нормально
+            if e.name != module_name:
+                raise
+
+    return len(registry)
+
+
+def get_task(name: str) -> "IronTaskWrapper":
+    """
+    Задача по имени: обычный поиск в словаре.
+    Если модуль задачи ещё не импортирован — импортируем один раз
+    (после этого задача сама попадёт в реестр).
+    """
+    wrapper = registry.get(name)
+    if wrapper is not None:
+        return wrapper
+
+    try:
+        func = _import_string(name)
+    except (ImportError, AttributeError, ValueError):
+        raise TaskNotRegistered(name)
+
+    wrapper = getattr(func, "_iron_task", None)
+    if wrapper is None:
+        raise TaskNotRegistered(name)
+    return wrapper
+
+
+# Размер пачки для bulk_create при вставке задач
+BULK_CREATE_CHUNK = 1000
+
+
+class _DeferBuffer:
+    """
+    Задачи, отложенные внутри одной транзакции (одного набора savepoint-ов).
+    На commit вставляются пачками через bulk_create.
+    """
+
+    def __init__(self, using):
+        self.using = using
+        self.tasks = []
+
+    def flush(self):
+        tasks, self.tasks = self.tasks, []
+        _bulk_insert(tasks, using=self.using)
+
+
+def _arguments(task: IronTask):
+    """
+    (args, kwargs) вызова. Callback chord-а первым аргументом получает
+    результаты группы (core/workflows.py).
+    """
+    payload = task.get_payload()
+    args = payload.get("args", [])
+    header = payload.get("header")
+    if header:
+        from .workflows import header_results
+
+        args = [header_results(header["id"], header["size"])] + list(args)
+    return args, payload.get("kwargs", {})
+
+
+def _bulk_insert(tasks, using=None):
+    from .blobs import offload
+
+    offload(tasks, using=using)
+    # bulk_create не вызывает save(): ранг считаем так же, как он
+    for task in tasks:
+        task.refresh_claim_rank()
+    chunk = getattr(settings, "IRONRELAY_BULK_CREATE_CHUNK", BULK_CREATE_CHUNK)
+    IronTask.objects.using(using).bulk_create(tasks, batch_size=chunk)
+
+    # будим спящих воркеров (одно уведомление на пачку)
+    notify(min(t.scheduled_at for t in tasks), using=using or DEFAULT_DB_ALIAS)
+
+
+def _is_pending(connection, callback) -> bool:
+    """
+    Висит ли ещё наш on_commit колбэк (его нет, если savepoint откатили).
+    """
+    return any(entry[1] == callback for entry in connection.run_on_commit)
+
+
+def enqueue(tasks, using=None):
+    """
+    Ставит несохранённые IronTask в очередь после успешного commit-а.
+
+    Все вызовы внутри одной транзакции склеиваются: регистрируется один
+    on_commit колбэк, который вставит всё накопленное через bulk_create.
+    Буфер привязан к текущему набору savepoint-ов, поэтому откат
+    savepoint-а выбрасывает его задачи вместе с колбэком — как и раньше.
+    Вне транзакции задачи вставляются сразу.
+    """
+    if not tasks:
+        return
+
+    # неизвестное имя — ошибка сразу при постановке, а не в воркере
+    for name in {t.name for t in tasks}:
+        if name not in registry:
+            raise TaskNotRegistered(name)
+
+    connection = transaction.get_connection(using)
+
+    if not connection.in_atomic_block:
+        _bulk_insert(tasks, using=using)
+        return
+
+    buffers = connection.__dict__.setdefault("_ironrelay_defer_buffers", {})
+
+    # чистим буферы откаченных транзакций/savepoint-ов
+    for key, buffer in list(buffers.items()):
+        if not _is_pending(connection, buffer.flush):
+            del buffers[key]
+
+    key = tuple(connection.savepoint_ids)
+    buffer = buffers.get(key)
+    if buffer is None:
+        buffer = _DeferBuffer(using)
+        buffers[key] = buffer
+        transaction.on_commit(buffer.flush, using=using)
+
+    buffer.tasks.extend(tasks)
+
+
 class IronTaskWrapper:
     """
     Обёртка над функцией, которую помечаем @task.
     """
 
-    def __init__(self, func):
+    def __init__(self, func, retry=None, queue=None, batch_size=None, store_result=False):
         self.func = func
         self.name = f"{func.__module__}.{func.__name__}"
+        self.retry_policy = retry or DEFAULT_RETRY_POLICY
+        self._queue = queue or IronTask.DEFAULT_QUEUE
+        # >1 — пакетная задача: функция получает список BatchItem
+        self.batch_size = batch_size or 1
+        # сохранять возвращённое значение в IronTaskResult (core/results.py)
+        self.store_result = store_result
+
+    @property
+    def queue(self) -> str:
+        """
+        Очередь задачи: IRONRELAY_TASK_QUEUES (имя задачи -> очередь)
+        перекрывает @task(queue=...) — так можно развести и встроенные задачи.
+        """
+        return getattr(settings, "IRONRELAY_TASK_QUEUES", {}).get(self.name, self._queue)
 
     def __call__(self, *args, **kwargs):
         # обычный вызов функции — если кто-то вызовет напрямую
         return self.func(*args, **kwargs)
 
+    def _build(self, args, kwargs, delay: int, priority: int, max_attempts: int) -> IronTask:
+        task = IronTask(
+            name=self.name,
+            queue=self.queue,
+            payload={
+                "args": args,
+                "kwargs": kwargs,
+            },
+            priority=priority,
+            max_attempts=max_attempts,
+            scheduled_at=timezone.now() + timezone.timedelta(seconds=delay),
+        )
+        task.refresh_claim_rank()
+        return task
+
     def defer(self, *args, delay: int = 0, priority: int = 0, max_attempts=5, **kwargs):
         """
         Создаёт запись задачи в БД (но только после успешного commit-а).
+        Возвращает TaskHandle: с @task(store_result=True) по нему можно
+        дождаться результата (handle.wait()).
         """
-        payload = {
-            "args": args,
-            "kwargs": kwargs,
-        }
-
-        def _create():
-            IronTask.objects.create(
-                name=self.name,
-                payload=payload,
-                priority=priority,
-                max_attempts=max_attempts,
-                scheduled_at=timezone.now() + timezone.timedelta(seconds=delay),
-            )
+        from .results import TaskHandle
 
         # Важный момент: задача создаётся только ПОСЛЕ commit
-        transaction.on_commit(_create)
+        task = self._build(args, kwargs, delay, priority, max_attempts)
+        enqueue([task])
+        return TaskHandle(task.id, self.name)
+
+    def s(self, *args, **kwargs):
+        """
+        Сигнатура вызова для chain / group / chord (core/workflows.py).
+        """
+        from .workflows import Signature
+
+        return Signature(self.name, args, kwargs)
+
+    def si(self, *args, **kwargs):
+        """
+        Сигнатура, которой chain не передаёт результат предыдущей задачи.
+        """
+        from .workflows import Signature
+
+        return Signature(self.name, args, kwargs, immutable=True)
+
+    def defer_many(self, items, delay: int = 0, priority: int = 0, max_attempts=5) -> int:
+        """
+        Массовая постановка задач: один bulk INSERT вместо тысяч.
+
+        Каждый элемент `items`:
+          - tuple/list — позиционные аргументы,
+          - dict — именованные аргументы,
+          - что-то другое — единственный позиционный аргумент.
+
+        Возвращает количество поставленных задач.
+        """
+        tasks = []
+        for item in items:
+            if isinstance(item, dict):
+                args, kwargs = (), item
+            elif isinstance(item, (tuple, list)):
+                args, kwargs = tuple(item), {}
+            else:
+                args, kwargs = (item,), {}
+            tasks.append(self._build(args, kwargs, delay, priority, max_attempts))
+
+        enqueue(tasks)
+        return len(tasks)
+
+    @property
+    def is_async(self) -> bool:
+        return inspect.iscoroutinefunction(self.func)
 
     @staticmethod
     def run_task(task: IronTask):
         """
         Выполняет задачу (используется воркером).
+        `async def` задачи в синхронном воркере прогоняются через async_to_sync.
+        Выполнения, попавшие в выборку IRONRELAY_PROFILE_TASKS,
+        профилируются (core/profiling.py).
+        """
+        from .profiling import profile_task
+
+        func = get_task(task.name).func
+        args, kwargs = _arguments(task)
+        with profile_task(task):
+            result = func(*args, **kwargs)
+            if inspect.isawaitable(result):
+                async def _await():
+                    return await result
+
+                result = async_to_sync(_await)()
+        return result
+
+    @staticmethod
+    def run_batch(tasks) -> dict:
         """
-        func = _import_string(task.name)
-        args = task.payload.get("args", [])
-        kwargs = task.payload.get("kwargs", {})
-        return func(*args, **kwargs)
+        Выполняет пачку задач @task(batch_size=N) одним вызовом функции
+        со списком BatchItem.
+
+        Функция может вернуть {id: исключение} для элементов, которые
+        не удались (id — как в BatchItem или строкой), остальные считаются
+        выполненными. Исключение из самой функции — ошибка всех элементов.
+
+        Возвращает {task.id: исключение или None}.
+        """
+        from .profiling import profile_task
+
+        func = get_task(tasks[0].name).func
+        items = []
+        for task in tasks:
+            args, kwargs = _arguments(task)
+            items.append(BatchItem(task.id, args, kwargs))
+
+        with profile_task(tasks[0]):
+            result = func(items)
+            if inspect.isawaitable(result):
+                async def _await():
+                    return await result
 
+                result = async_to_sync(_await)()
+
+        failed = {}
+        if isinstance(result, dict):
+            failed = {str(key): exc for key, exc in result.items()}
+        return {task.id: failed.get(str(task.id)) for task in tasks}
+
+    @staticmethod
+    async def run_task_async(task: IronTask):
+        """
+        Выполняет задачу внутри event loop (asyncio-воркер).
+        `async def` задачи await-ятся напрямую, sync-задачи уходят в поток.
+
+        Профилируются только sync-задачи: в event loop cProfile смешал бы
+        все корутины, выполняющиеся параллельно.
+        """
+        wrapper = get_task(task.name)
 
-def task(func):
+        if wrapper.is_async:
+            args, kwargs = await sync_to_async(_arguments, thread_sensitive=False)(task)
+            return await wrapper.func(*args, **kwargs)
+
+        return await sync_to_async(
+            IronTaskWrapper.run_task,
+            thread_sensitive=False,
+        )(task)
+
+
+def defer_by_name(name: str, *args, delay: int = 0, priority: int = 0, max_attempts=5, **kwargs):
+    """
+    Ставит задачу по строковому имени ("app.tasks.send_email").
+    Неизвестное имя — сразу TaskNotRegistered.
+    """
+    return get_task(name).defer(*args, delay=delay, priority=priority, max_attempts=max_attempts, **kwargs)
+
+
+def task(func=None, *, retry=None, queue=None, batch_size=None, store_result=False):
     """
     Декоратор: превращает любую функцию в задачу IronRelay.
+
+    Можно с параметрами:
+        @task(retry=RetryPolicy(base=1, max_delay=60, retry_on=[IOError]))
+        @task(queue="bulk")
+
+    Пакетная задача: defer() по-прежнему ставит по строке на вызов, но
+    воркер забирает до batch_size таких строк и вызывает функцию один раз:
+        @task(batch_size=100)
+        def index_rows(items):            # items: список BatchItem
+            ids = [item.args[0] for item in items]
+            ...
+            return {item.id: error, ...}  # необязательно: неудачные элементы
+
+    Результат, который можно дождаться (core/results.py):
+        @task(store_result=True)
+        def build_report(report_id): ...
+
+        build_report.defer(42).wait(timeout=30)
     """
-    wrapper = IronTaskWrapper(func)
+    def decorate(func):
+        wrapper = IronTaskWrapper(
+            func, retry=retry, queue=queue, batch_size=batch_size, store_result=store_result
+        )
+        registry[wrapper.name] = wrapper
+
+        @wraps(func)
+        def inner(*args, **kwargs):
+            return func(*args, **kwargs)
 
-    @wraps(func)
-    def inner(*args, **kwargs):
-        return func(*args, **kwargs)
+        inner.defer = wrapper.defer
+        inner.defer_many = wrapper.defer_many
+        inner.s = wrapper.s
+        inner.si = wrapper.si
+        inner._iron_task = wrapper
 
-    inner.defer = wrapper.defer
-    inner._iron_task = wrapper
+        return inner
 
-    return inner
+    if func is None:
+        return decorate
+    return decorate(func)
 
 
 @task
@@ -0,0 +1,517 @@
+import io
+import json
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+from django.core.management.base import OutputWrapper
+from django.db import DatabaseError, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import explain
+from .broker import (
+    WeightedQueues,
+    claim_tasks,
+    extend_leases,
+    reap_expired_leases,
+    reap_worker_tasks,
+)
+from .ingest import (
+    DUPLICATE,
+    MODE_SYNC,
+    RECEIVED,
+    InvalidPayload,
+    build,
+    ingest,
+    process_incoming_webhook,
+    write,
+)
+from .models import (
+    IronChord,
+    IronIncomingWebhook,
+    IronPayloadBlob,
+    IronTask,
+    IronTaskArchive,
+    IronTaskResult,
+)
+from .results import ResultTimeout, ResultUnavailable, TaskFailed, gather
+from .retention import MODE_ARCHIVE, MODE_DELETE, prune
+from .retry import RetryPolicy
+from .tasks import task
+from .worker import Worker
+from .workflows import chain, chord, group
+
+
+class WeightedQueuesTests(SimpleTestCase):
+    """
+    Выбор очереди без БД: claim_tasks подменён, очередь "занята",
+    если она в self.busy.
+    """
+
+    def setUp(self):
+        self.busy = set()
+        patcher = mock.patch(
+            "core.broker.claim_tasks",
+            side_effect=lambda worker_id, limit, queue: [queue] if queue in self.busy else [],
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def served(self, queues, rounds):
+        counts = {name: 0 for name in queues.weights}
+        for _ in range(rounds):
+            for name in queues.claim("w", limit=1):
+                counts[name] += 1
+        return counts
+
+    def test_share_follows_weights(self):
+        queues = WeightedQueues({"a": 5, "b": 1})
+        self.busy = {"a", "b"}
+        self.assertEqual(self.served(queues, 600), {"a": 500, "b": 100})
+
+    def test_idle_queue_does_not_bank_credit(self):
+        queues = WeightedQueues({"a": 5, "b": 1})
+
+        self.busy = {"b"}
+        self.assertEqual(self.served(queues, 1000), {"a": 0, "b": 1000})
+        for credit in queues.current.values():
+            self.assertLessEqual(abs(credit), queues.total)
+
+        # a получила работу: сразу доля 5:1, а не все claim-ы подряд
+        self.busy = {"a", "b"}
+        self.assertEqual(self.served(queues, 6), {"a": 5, "b": 1})
+        self.assertEqual(self.served(queues, 3000), {"a": 2500, "b": 500})
+
+    def test_all_empty_rounds_leave_no_credit(self):
+        queues = WeightedQueues({"a": 5, "b": 1})
+        self.assertEqual(self.served(queues, 100), {"a": 0, "b": 0})
+        self.assertEqual(queues.current, {"a": 0, "b": 0})
+
+
+class QueryPlanTests(TestCase):
+    """
+    Планы запросов из ironrelay_explain на небольшой таблице: индексы
+    выбираются и без миллиона строк.
+    """
+
+    def test_plans_have_no_problems(self):
+        explain.seed(2000)
+        explain.analyze()
+        results = explain.run_checks()
+
+        names = {name for name, _, _ in results}
+        for name in ("claim", "claim.queue", "status.task_counts", "retention.prune_chunk"):
+            self.assertIn(name, names)
+        for name, plan, problems in results:
+            with self.subTest(name):
+                self.assertEqual(problems, [], plan)
+
+
+# --- Задачи для тестов ниже ---
+
+# мгновенные повторы: тестам не нужно ждать backoff
+NO_DELAY = RetryPolicy(base=0, jitter=RetryPolicy.JITTER_NONE)
+
+
+@task(store_result=True, retry=NO_DELAY)
+def add(x, y):
+    return x + y
+
+
+@task(store_result=True)
+def total(values):
+    return sum(values)
+
+
+@task(store_result=True, retry=NO_DELAY)
+def fail(message):
+    raise ValueError(message)
+
+
+@task
+def noop():
+    pass
+
+
+# вызовы collect: callback chord-а должен выполниться ровно один раз
+collected = []
+
+
+@task(store_result=True)
+def collect(values):
+    collected.append(values)
+    return values
+
+
+@task(batch_size=10, retry=NO_DELAY)
+def reject_odd(items):
+    return {item.id: ValueError(f"odd: {item.args[0]}") for item in items if item.args[0] % 2}
+
+
+def make_worker(worker_id="test-worker"):
+    return Worker(worker_id, stdout=OutputWrapper(io.StringIO()))
+
+
+def drain(worker, rounds=50):
+    """
+    Выполняет всё, что готово к запуску, без heartbeat-а и ожидания.
+    """
+    for _ in range(rounds):
+        tasks = worker.claim(worker.batch_size)
+        if not tasks:
+            return
+        for job in worker.jobs(tasks):
+            worker.run_job(job)
+    raise AssertionError("queue did not drain")
+
+
+class ClaimTests(TransactionTestCase):
+    def test_workers_never_claim_the_same_task(self):
+        noop.defer_many(range(25))
+
+        claimed = {"a": [], "b": []}
+        while True:
+            batches = {worker_id: claim_tasks(worker_id, limit=10) for worker_id in claimed}
+            if not any(batches.values()):
+                break
+            for worker_id, tasks in batches.items():
+                claimed[worker_id] += [task.id for task in tasks]
+
+        ids = claimed["a"] + claimed["b"]
+        self.assertEqual(len(ids), 25)
+        self.assertEqual(len(set(ids)), 25)
+        for worker_id, task_ids in claimed.items():
+            self.assertEqual(
+                IronTask.objects.filter(
+                    id__in=task_ids, status=IronTask.STATUS_RUNNING, locked_by=worker_id
+                ).count(),
+                len(task_ids),
+            )
+
+    def test_priority_ages_into_claim_order(self):
+        now = timezone.now()
+        with override_settings(IRONRELAY_PRIORITY_AGING_SECONDS=60):
+            # 10 минут ожидания дороже 5 единиц приоритета (5 минут)
+            old = IronTask.objects.create(
+                name=noop._iron_task.name, payload={}, priority=0,
+                scheduled_at=now - timedelta(minutes=10),
+            )
+            urgent = IronTask.objects.create(
+                name=noop._iron_task.name, payload={}, priority=5, scheduled_at=now,
+            )
+            recent = IronTask.objects.create(
+                name=noop._iron_task.name, payload={}, priority=0,
+                scheduled_at=now - timedelta(minutes=2),
+            )
+            order = [claim_tasks("w", limit=1)[0].id for _ in range(3)]
+        self.assertEqual(order, [old.id, urgent.id, recent.id])
+
+
+class EnqueueTests(TransactionTestCase):
+    def test_defers_in_transaction_are_one_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                for i in range(5):
+                    add.defer(i, i)
+                self.assertEqual(IronTask.objects.count(), 0)
+
+        inserts = [q for q in queries.captured_queries if q["sql"].startswith('INSERT INTO "iron_task"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(IronTask.objects.count(), 5)
+
+    def test_rolled_back_savepoint_drops_its_tasks(self):
+        with transaction.atomic():
+            kept = add.defer(1, 1)
+            try:
+                with transaction.atomic():
+                    add.defer(2, 2)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            also_kept = add.defer(3, 3)
+
+        self.assertEqual(
+            set(IronTask.objects.values_list("id", flat=True)), {kept.id, also_kept.id}
+        )
+
+
+class LeaseTests(TransactionTestCase):
+    def claim_and_expire(self):
+        claimed = claim_tasks("dead", limit=10)
+        IronTask.objects.filter(id__in=[task.id for task in claimed]).update(
+            locked_at=timezone.now() - timedelta(seconds=120)
+        )
+        return claimed
+
+    def test_heartbeat_keeps_lease(self):
+        noop.defer()
+        self.claim_and_expire()
+        self.assertEqual(extend_leases("dead"), 1)
+        self.assertEqual(reap_expired_leases(lease=60), 0)
+
+    def test_reaper_requeues_then_fails(self):
+        noop.defer(max_attempts=2)
+
+        self.claim_and_expire()
+        self.assertEqual(reap_expired_leases(lease=60), 1)
+        task = IronTask.objects.get()
+        self.assertEqual((task.status, task.attempts, task.locked_by), (IronTask.STATUS_PENDING, 1, ""))
+
+        self.claim_and_expire()
+        self.assertEqual(reap_expired_leases(lease=60), 1)
+        task = IronTask.objects.get()
+        self.assertEqual((task.status, task.attempts), (IronTask.STATUS_FAILED, 2))
+
+    def test_restarted_worker_releases_previous_tasks(self):
+        noop.defer()
+        claim_tasks("w1", limit=1)
+        started = timezone.now()
+        self.assertEqual(extend_leases("w1", since=started), 0)
+        self.assertEqual(reap_worker_tasks("w1", before=started), 1)
+        self.assertEqual(IronTask.objects.get().status, IronTask.STATUS_PENDING)
+
+
+class RetryPolicyTests(SimpleTestCase):
+    def test_exponential_delay_is_capped(self):
+        policy = RetryPolicy(base=2, factor=3, max_delay=100, jitter=RetryPolicy.JITTER_NONE)
+        self.assertEqual([policy.delay(n) for n in range(1, 6)], [2, 6, 18, 54, 100])
+
+    def test_jitter_stays_within_delay(self):
+        policy = RetryPolicy(base=8, factor=1, jitter=RetryPolicy.JITTER_EQUAL)
+        for _ in range(100):
+            self.assertTrue(4 <= policy.delay(1) <= 8)
+
+    def test_retry_after_wins(self):
+        exc = Exception("throttled")
+        exc.retry_after = 30
+        policy = RetryPolicy(base=1, max_delay=60)
+        for _ in range(100):
+            self.assertTrue(30 <= policy.delay(1, exc) <= 33)
+
+        exc.retry_after = 3600
+        self.assertLessEqual(policy.delay(1, exc), 66)
+
+    def test_exception_filters(self):
+        policy = RetryPolicy(retry_on=[OSError], dont_retry_on=[FileNotFoundError])
+        self.assertTrue(policy.should_retry(ConnectionError()))
+        self.assertFalse(policy.should_retry(FileNotFoundError()))
+        self.assertFalse(policy.should_retry(ValueError()))
+
+
+class RetentionTests(TestCase):
+    def test_prune_archives_in_chunks(self):
+        IronTask.objects.bulk_create(
+            [IronTask(name="core.tests.old", payload={}, status=IronTask.STATUS_SUCCESS) for _ in range(25)]
+            + [IronTask(name="core.tests.old", payload={}, status=IronTask.STATUS_PENDING) for _ in range(5)]
+        )
+        IronTask.objects.update(updated_at=timezone.now() - timedelta(days=60))
+
+        moved = prune(kinds=["task"], mode=MODE_ARCHIVE, chunk_size=10, max_chunks=2)
+        self.assertEqual(moved, {("task", IronTask.STATUS_SUCCESS): 20})
+        self.assertEqual(IronTaskArchive.objects.count(), 20)
+
+        prune(kinds=["task"], mode=MODE_ARCHIVE, chunk_size=10)
+        self.assertEqual(IronTaskArchive.objects.count(), 25)
+        self.assertEqual(set(IronTask.objects.values_list("status", flat=True)), {IronTask.STATUS_PENDING})
+
+    def test_fresh_rows_stay(self):
+        IronTask.objects.create(name="core.tests.new", payload={}, status=IronTask.STATUS_SUCCESS)
+        self.assertEqual(prune(kinds=["task"], mode=MODE_DELETE), {})
+        self.assertEqual(IronTask.objects.count(), 1)
+
+
+@override_settings(IRONRELAY_INGEST_MODE=MODE_SYNC)
+class IngestTests(TestCase):
+    def test_webhook_and_handler_task_are_written_together(self):
+        webhook_id, outcome = ingest("test", b'{"event": "ping", "n": 1}')
+        self.assertEqual(outcome, RECEIVED)
+
+        webhook = IronIncomingWebhook.objects.get(id=webhook_id)
+        self.assertEqual(webhook.data, {"event": "ping", "n": 1})
+        handler = IronTask.objects.get(id=webhook.handler_task_id)
+        self.assertEqual(handler.name, process_incoming_webhook._iron_task.name)
+        self.assertEqual(handler.get_payload()["args"], [str(webhook_id)])
+
+    def test_failed_webhook_insert_drops_its_task(self):
+        with mock.patch.object(IronIncomingWebhook.objects, "bulk_create", side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                ingest("test", b'{"event": "ping"}')
+        self.assertFalse(IronTask.objects.exists())
+
+    def test_invalid_body(self):
+        with self.assertRaises(InvalidPayload):
+            ingest("test", b"not json")
+
+    def test_repeated_key_is_a_duplicate(self):
+        key = str(uuid.uuid4())
+        body = json.dumps({"id": key, "event": "invoice.paid"}).encode()
+        with override_settings(IRONRELAY_IDEMPOTENCY={"stripe": {"json": "id"}}):
+            first_id, first = ingest("stripe", body)
+            second_id, second = ingest("stripe", body)
+            # повтор внутри одной пачки write-behind
+            duplicates = write([build("stripe", body), build("stripe", body)])
+
+        self.assertEqual((first, second), (RECEIVED, DUPLICATE))
+        self.assertEqual(second_id, first_id)
+        self.assertEqual(set(duplicates.values()), {first_id})
+        self.assertEqual(IronIncomingWebhook.objects.count(), 1)
+        self.assertEqual(IronTask.objects.count(), 1)
+
+
+@override_settings(IRONRELAY_PAYLOAD_OFFLOAD_BYTES=1024, IRONRELAY_INGEST_MODE=MODE_SYNC)
+class BlobTests(TransactionTestCase):
+    def test_large_task_payload_round_trip(self):
+        text = "x" * 5000
+        handle = add.defer(text, "!")
+
+        task = IronTask.objects.get(id=handle.id)
+        self.assertIsNone(task.payload)
+        self.assertIsNotNone(task.payload_blob_id)
+        self.assertLess(len(IronPayloadBlob.objects.get().data), 1024)
+        self.assertEqual(task.get_payload()["args"], [text, "!"])
+
+        drain(make_worker())
+        self.assertEqual(handle.wait(timeout=1), text + "!")
+
+    def test_large_incoming_body_round_trip(self):
+        body = {"event": "bulk", "rows": list(range(1000))}
+        webhook_id, _ = ingest("test", json.dumps(body).encode())
+
+        webhook = IronIncomingWebhook.objects.get(id=webhook_id)
+        self.assertEqual(webhook.raw_body, "")
+        self.assertEqual(webhook.data, body)
+
+    def test_same_body_is_stored_once(self):
+        add.defer_many([("y" * 5000, "")] * 3)
+        self.assertEqual(IronPayloadBlob.objects.count(), 1)
+
+
+class BatchTests(TransactionTestCase):
+    def test_per_item_failures(self):
+        reject_odd.defer_many(range(6), max_attempts=1)
+        drain(make_worker())
+
+        tasks = IronTask.objects.all()
+        by_arg = {task.get_payload()["args"][0]: task for task in tasks}
+        self.assertEqual(
+            {arg: task.status for arg, task in by_arg.items()},
+            {0: "success", 1: "failed", 2: "success", 3: "failed", 4: "success", 5: "failed"},
+        )
+        self.assertEqual(by_arg[3].last_error, "odd: 3")
+
+    def test_failed_items_are_retried(self):
+        reject_odd.defer_many([1, 2], max_attempts=3)
+        drain(make_worker())
+        odd = IronTask.objects.get(payload__args__0=1)
+        self.assertEqual((odd.status, odd.attempts), (IronTask.STATUS_FAILED, 3))
+
+
+class ResultTests(TransactionTestCase):
+    def test_wait_and_gather(self):
+        handles = [add.defer(i, 1) for i in range(3)]
+        failing = fail.defer("boom", max_attempts=1)
+        drain(make_worker())
+
+        self.assertEqual(handles[0].wait(timeout=1), 1)
+        self.assertEqual(gather(handles, timeout=1), [1, 2, 3])
+
+        with self.assertRaises(TaskFailed):
+            failing.wait(timeout=1)
+        values = gather(handles + [failing], timeout=1, return_exceptions=True)
+        self.assertEqual(values[:3], [1, 2, 3])
+        self.assertIsInstance(values[3], TaskFailed)
+
+    def test_wait_times_out(self):
+        handle = add.defer(1, 1)
+        with self.assertRaises(ResultTimeout):
+            handle.wait(timeout=0.05)
+
+    def test_result_needs_store_result(self):
+        with self.assertRaises(ResultUnavailable):
+            noop.defer().wait(timeout=0.05)
+
+
+class WorkflowTests(TransactionTestCase):
+    def test_chain_passes_results(self):
+        handle = chain(add.s(1, 2), add.s(10), add.si(100, 0)).defer()
+        drain(make_worker())
+        self.assertEqual(handle.wait(timeout=1), 100)
+        self.assertEqual(
+            sorted(IronTaskResult.objects.values_list("value", flat=True)), [3, 13, 100]
+        )
+
+    def test_failed_link_aborts_chain(self):
+        handle = chain(fail.s("boom").set(max_attempts=1), add.s(1)).defer()
+        drain(make_worker())
+        with self.assertRaisesMessage(TaskFailed, "Chain aborted"):
+            handle.wait(timeout=1)
+        self.assertEqual(IronTask.objects.count(), 1)
+
+    def test_chord_counts_down_once(self):
+        handle = chord(group(add.s(i, i) for i in range(4)), total.s()).defer()
+        self.assertEqual(IronChord.objects.get().remaining, 4)
+
+        drain(make_worker())
+        self.assertEqual(handle.wait(timeout=1), 12)
+        self.assertFalse(IronChord.objects.exists())
+        self.assertEqual(IronTask.objects.filter(name=total._iron_task.name).count(), 1)
+
+    def test_failed_member_aborts_chord(self):
+        handle = chord([add.s(1, 1), fail.s("boom").set(max_attempts=1)], total.s()).defer()
+        drain(make_worker())
+        with self.assertRaisesMessage(TaskFailed, "1 of 2 tasks failed"):
+            handle.wait(timeout=1)
+        self.assertFalse(IronTask.objects.filter(name=total._iron_task.name).exists())
+
+    def expire(self, task):
+        IronTask.objects.filter(id=task.id).update(locked_at=timezone.now() - timedelta(seconds=120))
+        reap_expired_leases(lease=60)
+
+    def test_chord_callback_fires_once_across_worker_paths(self):
+        collected.clear()
+        handle = chord(
+            [reject_odd.s(0), reject_odd.s(2), add.s(1, 1), add.s(2, 2)],
+            collect.s(),
+        ).defer()
+
+        # воркер взял задачу группы и пропал: reaper вернёт её в очередь
+        stale = make_worker("dead")
+        lost = claim_tasks(stale.worker_id, limit=1, names=[add._iron_task.name])[0]
+        self.expire(lost)
+
+        # пакет — record_batch, add — record_success
+        drain(make_worker())
+        # пропавший воркер всё же доделал задачу: аренды уже нет, счётчик
+        # chord-а второй раз не уменьшается
+        stale.run_one(lost)
+        drain(make_worker())
+
+        self.assertEqual(handle.wait(timeout=1), [None, None, 2, 4])
+        self.assertEqual(len(collected), 1)
+        self.assertEqual(IronTask.objects.filter(name=collect._iron_task.name).count(), 1)
+        self.assertFalse(IronChord.objects.exists())
+
+    def test_chord_counts_failures_from_every_path(self):
+        collected.clear()
+        handle = chord(
+            [
+                reject_odd.s(0),
+                reject_odd.s(1).set(max_attempts=1),   # record_batch_failures
+                fail.s("boom").set(max_attempts=1),    # record_failure
+                add.s(1, 1).set(max_attempts=1),       # reaper
+            ],
+            collect.s(),
+        ).defer()
+
+        lost = claim_tasks("dead", limit=1, names=[add._iron_task.name])[0]
+        self.expire(lost)
+        self.assertEqual(IronTask.objects.get(id=lost.id).status, IronTask.STATUS_FAILED)
+        drain(make_worker())
+
+        with self.assertRaisesMessage(TaskFailed, "3 of 4 tasks failed"):
+            handle.wait(timeout=1)
+        self.assertEqual(collected, [])
+        self.assertFalse(IronTask.objects.filter(name=collect._iron_task.name).exists())
+        self.assertFalse(IronChord.objects.exists())
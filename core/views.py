@@ -4,8 +4,9 @@
 # - дашборд
 # - входящие вебхуки
 # - JSON-статус
+# - метрики Prometheus
+# - async-версии приёма вебхуков и статуса (для ASGI: uvicorn и т.п.)
 
-import json
 import django
 
 from django.http import JsonResponse, HttpRequest, HttpResponse
@@ -18,7 +19,9 @@ from core.models import (
     IronWebhookDelivery,
     IronIncomingWebhook,
 )
-from core.handlers_core import handle_incoming_webhook
+from core.ingest import ACCEPTED, DUPLICATE, InvalidPayload, aingest, ingest
+from core.metrics import collect as collect_metrics
+from core.stats import aget_stats, get_stats
 
 
 
@@ -33,24 +36,15 @@ def ironrelay_dashboard(request: HttpRequest) -> HttpResponse:
       - входящие вебхуки
       - общую статистику для карточек
     """
-    recent_tasks = IronTask.objects.order_by("-created_at")[:10]
-    outgoing_webhooks = IronWebhookDelivery.objects.order_by("-created_at")[:10]
-    incoming_webhooks = IronIncomingWebhook.objects.order_by("-created_at")[:10]
-
-    stats = {
-        "pending_tasks": IronTask.objects.filter(
-            status=IronTask.STATUS_PENDING
-        ).count(),
-        "running_tasks": IronTask.objects.filter(
-            status=IronTask.STATUS_RUNNING
-        ).count(),
-        "failed_tasks": IronTask.objects.filter(
-            status=IronTask.STATUS_FAILED
-        ).count(),
-        "success_webhooks": IronWebhookDelivery.objects.filter(
-            status=IronWebhookDelivery.STATUS_SUCCESS
-        ).count(),
-    }
+    # тела (payload, raw_body) на дашборде не нужны — не читаем их
+    recent_tasks = IronTask.objects.defer("payload").order_by("-created_at")[:10]
+    outgoing_webhooks = IronWebhookDelivery.objects.defer("payload").order_by("-created_at")[:10]
+    incoming_webhooks = IronIncomingWebhook.objects.defer("payload", "raw_body").order_by(
+        "-created_at"
+    )[:10]
+
+    # счётчики из кэша: один сгруппированный запрос на таблицу раз в TTL
+    stats = get_stats()
 
     context = {
         "recent_tasks": recent_tasks,
@@ -80,31 +74,43 @@ def ironrelay_incoming(request: HttpRequest, source: str) -> JsonResponse:
     if request.method != "POST":
         return JsonResponse({"detail": "Method not allowed"}, status=405)
 
+    # вебхук и задача-обработчик пишутся вместе, тело хранится как пришло
+    # (режим записи — IRONRELAY_INGEST_MODE, см. core/ingest.py)
     try:
-        raw_body = request.body.decode("utf-8") or "{}"
-        data = json.loads(raw_body)
-    except json.JSONDecodeError:
+        webhook_id, result = ingest(source, request.body, request.headers)
+    except InvalidPayload:
         return JsonResponse({"detail": "Invalid JSON"}, status=400)
 
-    event = data.get("event", "") or ""
+    return _ingest_response(webhook_id, result)
 
-    # сохраняем входящий вебхук
-    webhook = IronIncomingWebhook.objects.create(
-        source=source,
-        event=event,
-        payload=data,
-    )
 
-    # ставим задачу на обработку в очередь IronRelay
-    handle_incoming_webhook.defer(event, data)
+def _ingest_response(webhook_id, result: str) -> JsonResponse:
+    """
+    201 — записан, 202 — принят в буфер, 200 — повтор (id первого вебхука).
+    """
+    status = {ACCEPTED: 202, DUPLICATE: 200}.get(result, 201)
+    return JsonResponse({"id": str(webhook_id), "status": result}, status=status)
 
-    return JsonResponse(
-        {
-            "id": str(webhook.id),
-            "status": "received",
-        },
-        status=201,
-    )
+
+@csrf_exempt
+async def ironrelay_incoming_async(request: HttpRequest, source: str) -> JsonResponse:
+    """
+    Async-версия ironrelay_incoming для ASGI.
+
+    URL: /ironrelay/async/incoming/<source>/
+
+    Под ASGI не держит поток на время ожидания БД (в режиме "buffered"
+    не ходит в БД вовсе). Под WSGI работает, но выигрыша не даёт.
+    """
+    if request.method != "POST":
+        return JsonResponse({"detail": "Method not allowed"}, status=405)
+
+    try:
+        webhook_id, result = await aingest(source, request.body, request.headers)
+    except InvalidPayload:
+        return JsonResponse({"detail": "Invalid JSON"}, status=400)
+
+    return _ingest_response(webhook_id, result)
 
 
 def ironrelay_status(request: HttpRequest) -> JsonResponse:
@@ -118,23 +124,26 @@ def ironrelay_status(request: HttpRequest) -> JsonResponse:
       - версию Django
       - статистику задач и вебхуков
     """
-    stats = {
-        "pending_tasks": IronTask.objects.filter(
-            status=IronTask.STATUS_PENDING
-        ).count(),
-        "running_tasks": IronTask.objects.filter(
-            status=IronTask.STATUS_RUNNING
-        ).count(),
-        "failed_tasks": IronTask.objects.filter(
-            status=IronTask.STATUS_FAILED
-        ).count(),
-        "success_webhooks": IronWebhookDelivery.objects.filter(
-            status=IronWebhookDelivery.STATUS_SUCCESS
-        ).count(),
-        "total_incoming": IronIncomingWebhook.objects.count(),
-        "total_tasks": IronTask.objects.count(),
-        "total_deliveries": IronWebhookDelivery.objects.count(),
-    }
+    stats = get_stats()
+
+    return JsonResponse(
+        {
+            "ok": True,
+            "timestamp": timezone.now().isoformat(),
+            "django_version": django.get_version(),
+            "app": "ironrelay",
+            "stats": stats,
+        }
+    )
+
+
+async def ironrelay_status_async(request: HttpRequest) -> JsonResponse:
+    """
+    Async-версия ironrelay_status для ASGI (async ORM и async-кэш).
+
+    URL: /ironrelay/async/status/
+    """
+    stats = await aget_stats()
 
     return JsonResponse(
         {
@@ -144,4 +153,19 @@ def ironrelay_status(request: HttpRequest) -> JsonResponse:
             "app": "ironrelay",
             "stats": stats,
         }
-    )
\ No newline at end of file
+    )
+
+
+def ironrelay_metrics(request: HttpRequest) -> HttpResponse:
+    """
+    Метрики воркеров в текстовом формате Prometheus.
+
+    URL: /ironrelay/metrics/
+
+    Воркеры копят метрики в памяти и раз в IRONRELAY_METRICS_FLUSH_INTERVAL
+    сбрасывают снимок в БД; здесь снимки всех воркеров складываются.
+    """
+    return HttpResponse(
+        collect_metrics(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -0,0 +1,353 @@
+# core/wakeup.py
+#
+# Пробуждение воркеров IronRelay без постоянного опроса БД.
+#
+# Каналы:
+#   - postgres: LISTEN/NOTIFY (отдельное соединение у каждого воркера)
+#   - unix:     локальные Unix-сокеты (SQLite, все воркеры на одной машине)
+#   - poll:     без канала, только экспоненциальный idle backoff
+#
+# defer() после вставки задач шлёт notify(); спящие воркеры просыпаются
+# за миллисекунды. Backoff остаётся страховкой: задачи с delay, потерянные
+# уведомления и т.п. всё равно будут подобраны.
+#
+# Тот же механизм на отдельном канале (RESULTS_CHANNEL) будит тех, кто
+# ждёт результатов задач (core/results.py).
+
+import hashlib
+import os
+import select
+import socket
+import tempfile
+import time
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+
+CHANNEL = "ironrelay"
+RESULTS_CHANNEL = "ironrelay_results"
+
+WAKEUP_POSTGRES = "postgres"
+WAKEUP_UNIX = "unix"
+WAKEUP_POLL = "poll"
+
+
+def get_backend(using=DEFAULT_DB_ALIAS) -> str:
+    """
+    Канал пробуждения: IRONRELAY_WAKEUP = "auto" | "postgres" | "unix" | "poll".
+    """
+    backend = getattr(settings, "IRONRELAY_WAKEUP", "auto")
+    if backend != "auto":
+        return backend
+
+    vendor = connections[using].vendor
+    if vendor == "postgresql":
+        return WAKEUP_POSTGRES
+    if vendor == "sqlite" and hasattr(socket, "AF_UNIX"):
+        return WAKEUP_UNIX
+    return WAKEUP_POLL
+
+
+def _socket_dir(using=DEFAULT_DB_ALIAS, channel=CHANNEL) -> str:
+    """
+    Каталог сокетов воркеров. По умолчанию свой для каждой БД,
+    чтобы разные проекты на одной машине не будили друг друга.
+    Другие каналы — в подкаталогах.
+    """
+    path = getattr(settings, "IRONRELAY_WAKEUP_SOCKET_DIR", None)
+    if not path:
+        db_name = str(connections[using].settings_dict.get("NAME", ""))
+        digest = hashlib.md5(db_name.encode("utf-8")).hexdigest()[:12]
+        path = os.path.join(tempfile.gettempdir(), f"ironrelay-{digest}")
+    if channel != CHANNEL:
+        path = os.path.join(str(path), channel)
+    return str(path)
+
+
+def _encode_due(due) -> str:
+    """
+    Когда задача станет готовой (unix time) — чтобы воркер с задачей
+    на будущее не просыпался зря. Пустая строка — "прямо сейчас".
+    """
+    if due is None:
+        return ""
+    return f"{due.timestamp():.3f}"
+
+
+def _decode_due(payload: str) -> float:
+    try:
+        return float(payload) if payload else 0.0
+    except ValueError:
+        return 0.0
+
+
+def notify(due=None, using=DEFAULT_DB_ALIAS, channel=CHANNEL):
+    """
+    Будит спящих воркеров: появились задачи, готовые к `due` (datetime)
+    или прямо сейчас (None). Ошибки канала не ломают defer().
+    """
+    backend = get_backend(using)
+    payload = _encode_due(due)
+
+    try:
+        if backend == WAKEUP_POSTGRES:
+            with connections[using].cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, %s)", [channel, payload])
+        elif backend == WAKEUP_UNIX:
+            _notify_unix(payload.encode("ascii"), using, channel)
+    except Exception:
+        # уведомление — оптимизация, воркер всё равно подберёт задачу по backoff
+        pass
+
+
+def _notify_unix(data: bytes, using=DEFAULT_DB_ALIAS, channel=CHANNEL):
+    directory = _socket_dir(using, channel)
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    try:
+        for entry in entries:
+            if not entry.name.endswith(".sock"):
+                continue
+            try:
+                sock.sendto(data, entry.path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # воркер умер и не убрал за собой сокет
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+            except BlockingIOError:
+                # очередь сокета полна — воркер и так проснётся
+                pass
+    finally:
+        sock.close()
+
+
+class IdleBackoff:
+    """
+    Экспоненциальная пауза простоя: initial, initial*2, ... до maximum.
+    Сбрасывается, как только воркер нашёл работу.
+    """
+
+    def __init__(self, initial: float = 0.05, maximum: float = 5.0, factor: float = 2.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.current = initial
+
+    def next(self) -> float:
+        delay = self.current
+        self.current = min(self.current * self.factor, self.maximum)
+        return delay
+
+    def reset(self):
+        self.current = self.initial
+
+
+class Waiter:
+    """
+    Ожидание уведомления с таймаутом (канал poll — просто пауза).
+
+    wait() возвращает список "due"-меток из уведомлений (unix time,
+    0.0 — "готово сейчас"); пустой список — таймаут или interrupt().
+    interrupt() можно вызывать из обработчика сигнала.
+    """
+
+    backend = WAKEUP_POLL
+
+    def __init__(self):
+        self._pipe_r, self._pipe_w = os.pipe()
+        os.set_blocking(self._pipe_r, False)
+        os.set_blocking(self._pipe_w, False)
+
+    def fileno(self):
+        return None
+
+    def interrupt(self):
+        try:
+            os.write(self._pipe_w, b"\0")
+        except OSError:
+            pass
+
+    def _drain_pipe(self):
+        try:
+            while os.read(self._pipe_r, 1024):
+                pass
+        except OSError:
+            pass
+
+    def _receive(self) -> list:
+        return []
+
+    def wait(self, timeout: float) -> list:
+        fds = [self._pipe_r]
+        if self.fileno() is not None:
+            fds.append(self.fileno())
+
+        # уведомления могли прийти, пока воркер был занят
+        pending = self._receive()
+        if pending:
+            return pending
+
+        readable, _, _ = select.select(fds, [], [], max(timeout, 0))
+        if self._pipe_r in readable:
+            self._drain_pipe()
+        return self._receive() if readable else []
+
+    def close(self):
+        for fd in (self._pipe_r, self._pipe_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+class UnixSocketWaiter(Waiter):
+    """
+    Datagram Unix-сокет воркера в общем каталоге; notify() шлёт
+    датаграмму в каждый сокет каталога.
+    """
+
+    backend = WAKEUP_UNIX
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, channel=CHANNEL):
+        super().__init__()
+        directory = _socket_dir(using, channel)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self.path = os.path.join(directory, f"{os.getpid()}-{id(self)}.sock")
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.setblocking(False)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def _receive(self) -> list:
+        due = []
+        while True:
+            try:
+                data = self.sock.recv(64)
+            except (BlockingIOError, InterruptedError):
+                break
+            due.append(_decode_due(data.decode("ascii", errors="ignore")))
+        return due
+
+    def close(self):
+        self.sock.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        super().close()
+
+
+class PostgresWaiter(Waiter):
+    """
+    LISTEN на отдельном (не Django) соединении в autocommit.
+    Поддерживает psycopg2 и psycopg 3.
+    """
+
+    backend = WAKEUP_POSTGRES
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, channel=CHANNEL):
+        super().__init__()
+        wrapper = connections[using]
+        self.conn = wrapper.get_new_connection(wrapper.get_connection_params())
+        self.conn.autocommit = True
+        self._notifies = []
+
+        # psycopg 3: уведомления приходят в обработчик при любом обмене с сервером
+        if hasattr(self.conn, "add_notify_handler"):
+            self.conn.add_notify_handler(lambda n: self._notifies.append(n.payload))
+
+        cursor = self.conn.cursor()
+        cursor.execute(f"LISTEN {channel}")
+        cursor.close()
+
+    def fileno(self):
+        return self.conn.fileno()
+
+    def _receive(self) -> list:
+        if hasattr(self.conn, "poll"):
+            # psycopg2
+            self.conn.poll()
+            payloads = [n.payload for n in self.conn.notifies]
+            self.conn.notifies.clear()
+        else:
+            # psycopg 3: прокачиваем входящие данные пустым запросом
+            readable, _, _ = select.select([self.fileno()], [], [], 0)
+            if readable:
+                self.conn.execute("SELECT 1")
+            payloads, self._notifies = self._notifies, []
+        return [_decode_due(p) for p in payloads]
+
+    def close(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        super().close()
+
+
+def get_waiter(using=DEFAULT_DB_ALIAS, channel=CHANNEL) -> Waiter:
+    """
+    Создаёт ожидатель для текущего процесса (вызывать после fork-а).
+    Если канал не поднялся — откатываемся на обычный backoff.
+    """
+    backend = get_backend(using)
+    try:
+        if backend == WAKEUP_POSTGRES:
+            return PostgresWaiter(using, channel)
+        if backend == WAKEUP_UNIX:
+            return UnixSocketWaiter(using, channel)
+    except Exception:
+        pass
+    return Waiter()
+
+
+class IdleWait:
+    """
+    Логика простоя воркера: ждём уведомления, но не дольше текущего шага
+    backoff-а и не дольше, чем до ближайшей известной задачи "на будущее".
+    """
+
+    def __init__(self, waiter: Waiter):
+        self.waiter = waiter
+        if waiter.backend == WAKEUP_POLL:
+            maximum = getattr(settings, "IRONRELAY_IDLE_MAX_SLEEP", 5.0)
+        else:
+            # с каналом опрос нужен только как страховка
+            maximum = getattr(settings, "IRONRELAY_WAKEUP_SAFETY_POLL", 30.0)
+        self.backoff = IdleBackoff(maximum=maximum)
+        self.next_due = None
+
+    def reset(self):
+        self.backoff.reset()
+
+    def wait(self):
+        timeout = self.backoff.next()
+        if self.next_due is not None:
+            timeout = min(timeout, max(self.next_due - time.time(), 0))
+
+        dues = self.waiter.wait(timeout)
+
+        now = time.time()
+        if self.next_due is not None and self.next_due <= now:
+            # дождались отложенной задачи — она уже должна быть готова
+            self.next_due = None
+            self.backoff.reset()
+
+        for due in dues:
+            if due <= now:
+                # готовая задача — сразу идём за ней
+                self.backoff.reset()
+            elif self.next_due is None or due < self.next_due:
+                self.next_due = due
@@ -1,74 +1,321 @@
-import json
-import urllib.request
-import urllib.error
-
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
 from django.utils import timezone
 
-from .models import IronWebhookDelivery
-from .tasks import task
+from .blobs import offload
+from .broker import lease_seconds
+from .delivery import DELIVERY_UPDATE_FIELDS, get_engine, target_host
+from .hosts import HostUnavailable, get_guard
+from .models import IronTask, IronWebhookDelivery
+from .retry import RetryPolicy
+from .tasks import BULK_CREATE_CHUNK, task
+
+
+# Получатели вебхуков часто "моргают": растягиваем ретраи до часа,
+# а если они прислали Retry-After — ждём ровно столько, сколько просили.
+WEBHOOK_RETRY_POLICY = RetryPolicy(base=5.0, factor=3.0, max_delay=3600.0)
 
 
-@task
+@task(retry=WEBHOOK_RETRY_POLICY)
 def _perform_webhook_delivery(delivery_id):
     """
     Внутренняя задача: отправляет один вебхук по HTTP.
     Вызывается воркером через очередь IronTask.
+
+    Соединения берутся из пула DeliveryEngine (keep-alive на хост),
+    ответ читается потоково — только первые 2000 байт.
     """
     delivery = IronWebhookDelivery.objects.get(id=delivery_id)
 
-    # отмечаем ещё одну попытку
-    delivery.attempts += 1
+    try:
+        # при ошибке send() бросает исключение — чтобы сработали ретраи IronTask
+        get_engine().send(delivery)
+    finally:
+        delivery.updated_at = timezone.now()
+        delivery.save()
+
+
+# --- Пакетная доставка ---
+#
+# send_webhook(..., batch=True) не ставит задачу на каждое событие:
+# строка доставки ждёт в "буфере" (pending + batched) своего target_url.
+# Если для буфера ещё нет ожидающей _perform_webhook_batch, событие ставит
+# её с задержкой IRONRELAY_WEBHOOK_BATCH_WINDOW_MS; N-е
+# (IRONRELAY_WEBHOOK_BATCH_SIZE) — без задержки. Задача шлёт буфер
+# пачками по N одним POST-ом с JSON-массивом, статус пишется в каждую
+# строку отдельно. За один запуск — не больше
+# IRONRELAY_WEBHOOK_BATCHES_PER_RUN пачек, остаток — следующей задачей.
+
+
+def batch_size() -> int:
+    return getattr(settings, "IRONRELAY_WEBHOOK_BATCH_SIZE", 100)
+
+
+def batch_window() -> float:
+    return getattr(settings, "IRONRELAY_WEBHOOK_BATCH_WINDOW_MS", 200) / 1000
+
+
+def batches_per_run() -> int:
+    return max(getattr(settings, "IRONRELAY_WEBHOOK_BATCHES_PER_RUN", 10), 1)
+
+
+def _buffer(target_url: str):
+    return IronWebhookDelivery.objects.filter(
+        batched=True,
+        target_url=target_url,
+        status=IronWebhookDelivery.STATUS_PENDING,
+    )
+
+
+def _batch_pending(target_url: str, within: float) -> bool:
+    """
+    Есть ли ещё не забранная _perform_webhook_batch для target_url,
+    которая запустится в ближайшие `within` секунд.
+    """
+    return IronTask.objects.filter(
+        name=_perform_webhook_batch._iron_task.name,
+        status=IronTask.STATUS_PENDING,
+        scheduled_at__lte=timezone.now() + timezone.timedelta(seconds=within),
+        payload__args__0=target_url,
+    ).exists()
+
 
-    data = json.dumps(delivery.payload).encode("utf-8")
+def _schedule_batch(target_url: str, max_attempts: int, added: int = 1):
+    """
+    Ставит отправку буфера: сразу, если буфер только что набрал полную
+    пачку, иначе — с окном, если ожидающей задачи для буфера нет.
+
+    Решение принимается после commit-а, по закоммиченным строкам: счётчик
+    буфера у двух параллельных отправителей может совпасть, а задача,
+    которая ещё pending, гарантированно увидит наши строки. Лишняя
+    задача (двое не нашли ожидающую одновременно) просто найдёт буфер пустым.
+    """
+    def schedule():
+        size = batch_size()
+        # считаем не дальше size + added строк — не сканируем длинный хвост;
+        # строки, ждущие повтора после ошибки, не в счёт
+        buffered = _buffer(target_url).filter(next_attempt_at__lte=timezone.now())[: size + added].count()
 
-    req = urllib.request.Request(
-        delivery.target_url,
-        data=data,
-        headers={
-            "Content-Type": "application/json",
-            "User-Agent": "IronRelayWebhook/1.0",
-            "X-IronRelay-Event": delivery.event,
-        },
-        method="POST",
+        if buffered >= size and buffered - added < size:
+            _perform_webhook_batch.defer(target_url, max_attempts=max_attempts)
+        elif buffered and not _batch_pending(target_url, batch_window()):
+            _perform_webhook_batch.defer(target_url, delay=batch_window(), max_attempts=max_attempts)
+
+    transaction.on_commit(schedule)
+
+
+def _claim_batch(target_url: str, limit: int):
+    """
+    Забирает до `limit` готовых строк буфера (pending -> sending).
+    Строки, зависшие в sending дольше аренды (воркер умер посреди
+    отправки), забираются повторно.
+    """
+    now = timezone.now()
+    stale = now - timezone.timedelta(seconds=lease_seconds())
+    ready = Q(status=IronWebhookDelivery.STATUS_PENDING, next_attempt_at__lte=now) | Q(
+        status=IronWebhookDelivery.STATUS_SENDING, updated_at__lt=stale
     )
 
+    with transaction.atomic():
+        qs = IronWebhookDelivery.objects.filter(
+            ready, batched=True, target_url=target_url
+        ).order_by("next_attempt_at")
+
+        if connection.features.has_select_for_update_skip_locked:
+            qs = qs.select_for_update(skip_locked=True)
+
+        ids = list(qs.values_list("id", flat=True)[:limit])
+        if not ids:
+            return []
+
+        # условие повторяем в UPDATE: без блокировок строк (SQLite)
+        # вторая задача не заберёт те же строки
+        now = timezone.now()
+        IronWebhookDelivery.objects.filter(ready, id__in=ids).update(
+            status=IronWebhookDelivery.STATUS_SENDING,
+            updated_at=now,
+        )
+        return list(
+            IronWebhookDelivery.objects.filter(
+                id__in=ids,
+                status=IronWebhookDelivery.STATUS_SENDING,
+                updated_at=now,
+            ).order_by("next_attempt_at")
+        )
+
+
+def _hold_buffer(target_url: str, delay: float, claimed=()) -> int:
+    """
+    Хост недоступен (core/hosts.py): возвращаем забранные строки и
+    откладываем весь готовый буфер одним UPDATE, отправку — к концу паузы.
+    """
+    now = timezone.now()
+    next_attempt_at = now + timezone.timedelta(seconds=delay)
+
+    if claimed:
+        IronWebhookDelivery.objects.filter(
+            id__in=[d.id for d in claimed],
+            status=IronWebhookDelivery.STATUS_SENDING,
+        ).update(
+            status=IronWebhookDelivery.STATUS_PENDING,
+            next_attempt_at=next_attempt_at,
+            updated_at=now,
+        )
+
+    held = _buffer(target_url).filter(next_attempt_at__lte=now).update(
+        next_attempt_at=next_attempt_at,
+    )
+    # дубль задачи найдёт буфер уже отложенным и не заведёт вторую цепочку
+    if held or claimed:
+        _perform_webhook_batch.defer(target_url, delay=delay)
+    return held + len(claimed)
+
+
+@task(retry=WEBHOOK_RETRY_POLICY)
+def _perform_webhook_batch(target_url, continued=False):
+    """
+    Внутренняя задача: отправляет буфер пакетных доставок одного
+    target_url пачками по IRONRELAY_WEBHOOK_BATCH_SIZE.
+
+    Не больше batches_per_run() пачек за запуск: если буфер не иссяк
+    (производители пополняют его быстрее, чем мы шлём), остаток отправит
+    следующая задача (continued=True), а воркер тем временем возьмёт
+    другие.
+
+    Неудачные события возвращаются в буфер с next_attempt_at по
+    WEBHOOK_RETRY_POLICY; задача, которая что-то отправила, ставит
+    следующую — к ближайшему такому повтору.
+
+    Если breaker хоста открыт или его лимиты исчерпаны, буфер
+    откладывается целиком, без попытки соединения.
+    """
+    engine = get_engine()
+    size = batch_size()
+    sent = 0
+
     try:
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            body = resp.read().decode("utf-8", errors="replace")
-            delivery.last_response_code = resp.status
-            delivery.last_response_body = body[:2000]  # режем чтобы не раздувать БД
-            delivery.status = IronWebhookDelivery.STATUS_SUCCESS
-            delivery.last_error = ""
-    except urllib.error.HTTPError as e:
-        body = e.read().decode("utf-8", errors="replace")
-        delivery.last_response_code = e.code
-        delivery.last_response_body = body[:2000]
-        delivery.status = IronWebhookDelivery.STATUS_FAILED
-        delivery.last_error = f"HTTPError: {e}"
-        raise  # даём задаче упасть, чтобы сработали ретраи IronTask
-    except Exception as e:
-        delivery.last_error = str(e)
-        delivery.status = IronWebhookDelivery.STATUS_FAILED
-        raise
-    finally:
-        delivery.updated_at = timezone.now()
-        delivery.save()
+        get_guard().check(target_host(target_url))
+    except HostUnavailable as e:
+        _hold_buffer(target_url, e.delay)
+        return
+
+    full = False
+    for _ in range(batches_per_run()):
+        deliveries = _claim_batch(target_url, size)
+        if not deliveries:
+            break
+        sent += len(deliveries)
+
+        try:
+            results = engine.send_batch(target_url, deliveries)
+        except HostUnavailable as e:
+            _hold_buffer(target_url, e.delay, deliveries)
+            return
 
+        for delivery in deliveries:
+            error = results[delivery.id]
+            if (
+                error is not None
+                and delivery.attempts < delivery.max_attempts
+                and WEBHOOK_RETRY_POLICY.should_retry(error)
+            ):
+                delivery.status = IronWebhookDelivery.STATUS_PENDING
+                delivery.next_attempt_at = timezone.now() + timezone.timedelta(
+                    seconds=WEBHOOK_RETRY_POLICY.delay(delivery.attempts, error)
+                )
 
-def send_webhook(event: str, target_url: str, payload: dict, max_attempts: int = 5):
+        IronWebhookDelivery.objects.bulk_update(
+            deliveries, DELIVERY_UPDATE_FIELDS + ["next_attempt_at"]
+        )
+
+        full = len(deliveries) == size
+        if not full:
+            break
+
+    if full:
+        # последняя пачка полная — в буфере, скорее всего, есть ещё
+        _perform_webhook_batch.defer(target_url, continued=True)
+        return
+
+    if not sent and not continued:
+        # пустой проход (дубль задачи) — цепочку повторов ведёт другая
+        return
+
+    upcoming = (
+        _buffer(target_url)
+        .order_by("next_attempt_at")
+        .values_list("next_attempt_at", flat=True)
+        .first()
+    )
+    if upcoming is not None:
+        delay = max((upcoming - timezone.now()).total_seconds(), 0)
+        _perform_webhook_batch.defer(target_url, delay=delay)
+
+
+def send_webhook(event: str, target_url: str, payload: dict, max_attempts: int = 5, batch: bool = False):
     """
     Публичная функция: создаёт запись вебхука и ставит его в очередь.
     Её будет вызывать разработчик в своём проекте.
+
+    batch=True — событие уйдёт получателю в общем POST-е вместе с другими
+    событиями на тот же target_url (см. "Пакетная доставка" выше).
     """
-    delivery = IronWebhookDelivery.objects.create(
+    delivery = IronWebhookDelivery(
         event=event,
         target_url=target_url,
         payload=payload,
         status=IronWebhookDelivery.STATUS_PENDING,
         max_attempts=max_attempts,
         attempts=0,
+        batched=batch,
     )
+    offload([delivery])
+    delivery.save(force_insert=True)
+
+    if batch:
+        _schedule_batch(target_url, max_attempts)
+        return delivery
 
     # ставим задачу в очередь: отправить этот вебхук
     _perform_webhook_delivery.defer(str(delivery.id), max_attempts=max_attempts)
     return delivery
+
+
+def send_webhook_many(items, max_attempts: int = 5, batch: bool = False):
+    """
+    Массовая версия send_webhook.
+
+    `items` — итерируемое из (event, target_url, payload).
+    Записи доставок вставляются пачками через bulk_create,
+    задачи отправки — одним defer_many (при batch=True — по одной
+    задаче пакетной отправки на target_url).
+    """
+    deliveries = [
+        IronWebhookDelivery(
+            event=event,
+            target_url=target_url,
+            payload=payload,
+            status=IronWebhookDelivery.STATUS_PENDING,
+            max_attempts=max_attempts,
+            attempts=0,
+            batched=batch,
+        )
+        for event, target_url, payload in items
+    ]
+    offload(deliveries)
+    IronWebhookDelivery.objects.bulk_create(deliveries, batch_size=BULK_CREATE_CHUNK)
+
+    if batch:
+        added = {}
+        for delivery in deliveries:
+            added[delivery.target_url] = added.get(delivery.target_url, 0) + 1
+        for target_url, count in added.items():
+            _schedule_batch(target_url, max_attempts, added=count)
+        return deliveries
+
+    _perform_webhook_delivery.defer_many(
+        [(str(delivery.id),) for delivery in deliveries],
+        max_attempts=max_attempts,
+    )
+    return deliveries
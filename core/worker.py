@@ -0,0 +1,820 @@
+# core/worker.py
+#
+# Цикл воркера IronRelay и prefork-супервизор для нескольких процессов.
+
+import asyncio
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import OutputWrapper
+from django.core.management.color import no_style
+from django.db import close_old_connections, connections, transaction
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+from . import metrics, workflows
+from .broker import (
+    DEFAULT_CLAIM_BATCH,
+    WeightedQueues,
+    claim_rank,
+    claim_tasks,
+    extend_leases,
+    lease_seconds,
+    reap_expired_leases,
+    reap_worker_tasks,
+)
+from .models import IronTask
+from .retention import schedule_prune
+from .retry import DEFAULT_RETRY_POLICY, Reschedule
+from .tasks import (
+    IronTaskWrapper,
+    TaskNotRegistered,
+    autodiscover_tasks,
+    get_task,
+)
+from .wakeup import IdleWait, get_waiter, notify
+
+
+def default_worker_id() -> str:
+    """
+    Уникальное имя воркера для locked_by: "host:pid".
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Heartbeat(threading.Thread):
+    """
+    Фоновый поток воркера: раз в треть срока аренды продлевает аренду
+    всех его running-задач (один UPDATE), а раз в срок аренды — возвращает
+    в очередь задачи умерших воркеров. Раз в IRONRELAY_RETENTION_INTERVAL
+    ставит задачу очистки истории (core/retention.py), раз в
+    IRONRELAY_METRICS_FLUSH_INTERVAL сбрасывает снимок метрик (core/metrics.py).
+
+    Работает и тогда, когда основной поток занят долгой задачей.
+    """
+
+    def __init__(self, worker):
+        super().__init__(name="ironrelay-heartbeat", daemon=True)
+        self.worker = worker
+        self.lease = lease_seconds()
+        self.flush_interval = metrics.flush_interval()
+        self.interval = max(min(self.lease / 3, self.flush_interval or self.lease), 1)
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        last_reap = 0.0
+        last_extend = 0.0
+        last_flush = time.monotonic()
+        last_prune = time.monotonic()
+        prune_interval = getattr(settings, "IRONRELAY_RETENTION_INTERVAL", 3600)
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    if time.monotonic() - last_extend >= self.lease / 3:
+                        last_extend = time.monotonic()
+                        extend_leases(self.worker.worker_id, since=self.worker.started_at)
+
+                    if self.flush_interval and time.monotonic() - last_flush >= self.flush_interval:
+                        last_flush = time.monotonic()
+                        self.worker.flush_metrics()
+
+                    if prune_interval and time.monotonic() - last_prune >= prune_interval:
+                        last_prune = time.monotonic()
+                        schedule_prune()
+
+                    if time.monotonic() - last_reap >= self.lease:
+                        last_reap = time.monotonic()
+                        reaped = reap_expired_leases(self.lease)
+                        metrics.delete_stale()
+                        if reaped:
+                            self.worker.write(
+                                f"Requeued {reaped} tasks with expired leases",
+                                self.worker.style.WARNING,
+                            )
+                            notify()
+                except Exception as e:
+                    self.worker.write(f"Heartbeat error: {e}", self.worker.style.ERROR)
+                    close_old_connections()
+        finally:
+            connections.close_all()
+
+
+class Worker:
+    """
+    Один процесс-воркер: забирает пачку задач и выполняет их по очереди.
+    """
+
+    # сколько задач воркер выполняет одновременно (для метрики загрузки)
+    slots = 1
+
+    def __init__(
+        self,
+        worker_id: str,
+        batch_size: int = DEFAULT_CLAIM_BATCH,
+        stdout=None,
+        style=None,
+        queues=None,
+    ):
+        self.worker_id = worker_id
+        self.batch_size = batch_size
+        # {очередь: вес}; None — все очереди в общем порядке приоритетов
+        self.queues = WeightedQueues(queues) if queues else None
+        self.stdout = stdout or OutputWrapper(sys.stdout)
+        self.style = style or no_style()
+        self.running = True
+        self.started_at = None
+        self.idle = None
+        self.heartbeat = None
+        self.utilization = None
+
+    def write(self, message: str, style_func=None):
+        if style_func is not None:
+            message = style_func(message)
+        self.stdout.write(message)
+
+    def stop(self, *args):
+        """
+        Мягкая остановка: текущая задача доработает, новые не берём.
+        """
+        self.running = False
+        if self.idle is not None:
+            self.idle.waiter.interrupt()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+    def setup(self):
+        """
+        Канал пробуждения и heartbeat создаются в процессе воркера
+        (после fork-а).
+        """
+        self.idle = IdleWait(get_waiter())
+        self.write(f"Wakeup channel: {self.idle.waiter.backend}")
+
+        # worker_id повторяется между процессами (prefork-слот, --worker-id):
+        # running-задачи с этим id сейчас могут быть только у умершего
+        # предшественника
+        self.started_at = timezone.now()
+        reaped = reap_worker_tasks(self.worker_id, before=self.started_at)
+        if reaped:
+            self.write(f"Requeued {reaped} tasks left running by a previous process", self.style.WARNING)
+            notify()
+
+        # до UtilizationTracker: перенесённые busy-секунды — не загрузка
+        # этого интервала
+        metrics.restore(self.worker_id)
+        self.utilization = metrics.UtilizationTracker(self.worker_id, self.slots)
+        self.heartbeat = Heartbeat(self)
+        self.heartbeat.start()
+
+    def teardown(self):
+        if self.heartbeat is not None:
+            self.heartbeat.stop()
+            self.heartbeat.join(timeout=5)
+        if self.idle is not None:
+            self.idle.waiter.close()
+        try:
+            self.flush_metrics()
+        except Exception as e:
+            self.write(f"Metrics flush error: {e}", self.style.ERROR)
+
+    def flush_metrics(self):
+        if self.utilization is not None:
+            self.utilization.update()
+        metrics.flush(self.worker_id)
+
+    def claim(self, limit: int):
+        if self.queues is None:
+            return claim_tasks(self.worker_id, limit=limit)
+        return self.queues.claim(self.worker_id, limit=limit)
+
+    def run(self):
+        self.write(f"IronRelay worker {self.worker_id} started", self.style.SUCCESS)
+        self.setup()
+
+        try:
+            while self.running:
+                # Лочим сразу пачку задач одним запросом
+                tasks = self.claim(self.batch_size)
+
+                if not tasks:
+                    # спим до уведомления о новых задачах (или до шага backoff-а)
+                    self.idle.wait()
+                    continue
+
+                self.idle.reset()
+                for job in self.jobs(tasks):
+                    self.run_job(job)
+        finally:
+            self.teardown()
+
+        self.write(f"IronRelay worker {self.worker_id} stopped")
+
+    # --- Пакетные задачи (@task(batch_size=N)) ---
+
+    def batch_size_of(self, name: str) -> int:
+        try:
+            return get_task(name).batch_size
+        except TaskNotRegistered:
+            return 1
+
+    def jobs(self, tasks) -> list:
+        """
+        Разбивает захваченные задачи на единицы работы: пакетные задачи
+        одного имени собираются в пачку, добранную до batch_size одним
+        claim-запросом, остальные идут по одной.
+        """
+        jobs = []
+        batches = {}
+        for task in tasks:
+            if self.batch_size_of(task.name) > 1:
+                batches.setdefault(task.name, []).append(task)
+            else:
+                jobs.append([task])
+
+        for name, group in batches.items():
+            size = self.batch_size_of(name)
+            if len(group) < size and self.running:
+                group += claim_tasks(
+                    self.worker_id,
+                    limit=size - len(group),
+                    names=[name],
+                    queue=group[0].queue if self.queues is not None else None,
+                )
+            jobs += [group[i:i + size] for i in range(0, len(group), size)]
+        return jobs
+
+    def run_job(self, job: list):
+        if self.batch_size_of(job[0].name) > 1:
+            self.run_batch(job)
+        else:
+            self.run_one(job[0])
+
+    def run_batch(self, tasks: list):
+        self.write(f"Running batch of {len(tasks)} ({tasks[0].name})")
+
+        started = time.monotonic()
+        for task in tasks:
+            self.task_started(task)
+        try:
+            results = IronTaskWrapper.run_batch(tasks)
+        except Exception as e:
+            results = {task.id: e for task in tasks}
+        # одно выполнение функции — одно наблюдение длительности
+        self.task_finished(tasks[0], started)
+        self.record_batch(tasks, results)
+
+    def run_one(self, task: IronTask):
+        self.write(f"Running task {task.id} ({task.name})")
+
+        started = self.task_started(task)
+        try:
+            result = IronTaskWrapper.run_task(task)
+        except Exception as e:
+            self.task_finished(task, started)
+            self.record_failure(task, e)
+        else:
+            self.task_finished(task, started)
+            self.record_success(task, result)
+
+    # --- Метрики (в памяти процесса, см. core/metrics.py) ---
+
+    def task_started(self, task: IronTask) -> float:
+        latency = (timezone.now() - task.scheduled_at).total_seconds()
+        metrics.registry.observe(
+            "ironrelay_task_queue_latency_seconds", max(latency, 0), task=task.name
+        )
+        return time.monotonic()
+
+    def task_finished(self, task: IronTask, started: float):
+        elapsed = time.monotonic() - started
+        metrics.registry.observe("ironrelay_task_duration_seconds", elapsed, task=task.name)
+        metrics.registry.inc("ironrelay_worker_busy_seconds_total", elapsed, worker=self.worker_id)
+
+    def count_outcome(self, task: IronTask, outcome: str, amount: int = 1):
+        metrics.registry.inc("ironrelay_tasks_total", amount, task=task.name, outcome=outcome)
+
+    # --- Запись результата ---
+    #
+    # Пишем только изменившиеся колонки через UPDATE по id: так несколько
+    # потоков/корутин, у каждого своё соединение, не перетирают чужие поля
+    # устаревшей копией строки (как это делал бы save()).
+
+    def _owned(self, task: IronTask):
+        """
+        Строка задачи, пока она ещё наша. Если аренду успели отобрать
+        (reaper вернул задачу в очередь), результат не пишем — задачей
+        уже владеет другой воркер.
+        """
+        return IronTask.objects.filter(
+            id=task.id,
+            status=IronTask.STATUS_RUNNING,
+            locked_by=task.locked_by,
+        )
+
+    def _still_ours(self, tasks: list, status: str) -> list:
+        """
+        Какие из задач пачки UPDATE действительно перевёл в status
+        (у остальных аренду отобрали).
+        """
+        ids = set(
+            IronTask.objects.filter(
+                id__in=[task.id for task in tasks],
+                status=status,
+                locked_by=self.worker_id,
+            ).values_list("id", flat=True)
+        )
+        return [task for task in tasks if task.id in ids]
+
+    def lease_lost(self, task: IronTask):
+        self.write(f"Task {task.id}: lease lost, result discarded", self.style.WARNING)
+
+    def finishing(self, tasks: list):
+        """
+        Статус задач chain / chord пишется в одной транзакции с продолжением
+        workflow (счётчик chord-а, следующее звено): упавший между ними
+        воркер не оставит chord навсегда недосчитанным.
+        """
+        if any(workflows.is_workflow(task) for task in tasks):
+            return transaction.atomic()
+        return nullcontext()
+
+    def finished(self, entries: list):
+        """
+        Окончательно завершённые задачи — [(task, значение, ошибка или None)]:
+        результат в IronTaskResult, продолжение workflow в очередь.
+        """
+        workflows.finished(entries)
+
+    def record_success(self, task: IronTask, result=None):
+        task.status = IronTask.STATUS_SUCCESS
+        task.updated_at = timezone.now()
+        with self.finishing([task]):
+            updated = self._owned(task).update(
+                status=task.status,
+                updated_at=task.updated_at,
+            )
+            if updated:
+                self.finished([(task, result, None)])
+        if not updated:
+            self.lease_lost(task)
+            return
+        self.count_outcome(task, "success")
+        self.write(f"Task {task.id} done", self.style.SUCCESS)
+
+    def record_batch(self, tasks: list, results: dict):
+        """
+        Результат пачки: все успешные — одним UPDATE, все неудачные —
+        ещё одним (у каждой строки свои статус, попытка и время повтора).
+        """
+        done = [task for task in tasks if results.get(task.id) is None]
+        failed = [(task, results[task.id]) for task in tasks if results.get(task.id) is not None]
+        now = timezone.now()
+
+        if done:
+            with self.finishing(done):
+                updated = IronTask.objects.filter(
+                    id__in=[task.id for task in done],
+                    status=IronTask.STATUS_RUNNING,
+                    locked_by=self.worker_id,
+                ).update(status=IronTask.STATUS_SUCCESS, updated_at=now)
+                if updated < len(done):
+                    ours = self._still_ours(done, IronTask.STATUS_SUCCESS)
+                else:
+                    ours = done
+                # у пакетной функции нет значения на элемент — только факт успеха
+                self.finished([(task, None, None) for task in ours])
+            self.count_outcome(done[0], "success", updated)
+            self.write(f"Batch {done[0].name}: {updated} done", self.style.SUCCESS)
+            if updated < len(done):
+                self.write(f"Batch: {len(done) - updated} leases lost, results discarded", self.style.WARNING)
+
+        if failed:
+            self.record_batch_failures(failed, now)
+
+    def record_batch_failures(self, failed: list, now):
+        outcomes = {}
+        for task, exc in failed:
+            if isinstance(exc, Reschedule):
+                # как reschedule(): обратно в очередь без траты попытки
+                task.status = IronTask.STATUS_PENDING
+                task.scheduled_at = now + timezone.timedelta(seconds=exc.delay)
+                outcome = "rescheduled"
+            else:
+                task.attempts += 1
+                task.last_error = str(exc)
+                policy = self.retry_policy(task)
+                if task.attempts >= task.max_attempts or not policy.should_retry(exc):
+                    task.status = IronTask.STATUS_FAILED
+                    outcome = "failed"
+                else:
+                    delay = policy.delay(task.attempts, exc)
+                    task.status = IronTask.STATUS_PENDING
+                    task.scheduled_at = now + timezone.timedelta(seconds=delay)
+                    outcome = "retry"
+            task.claim_rank = claim_rank(task.scheduled_at, task.priority)
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+        def per_row(field: str):
+            return Case(
+                *[When(id=task.id, then=Value(getattr(task, field))) for task, _ in failed],
+                output_field=IronTask._meta.get_field(field),
+            )
+
+        final = [task for task, _ in failed if task.status == IronTask.STATUS_FAILED]
+        with self.finishing(final):
+            updated = IronTask.objects.filter(
+                id__in=[task.id for task, _ in failed],
+                status=IronTask.STATUS_RUNNING,
+                locked_by=self.worker_id,
+            ).update(
+                status=per_row("status"),
+                attempts=per_row("attempts"),
+                last_error=per_row("last_error"),
+                scheduled_at=per_row("scheduled_at"),
+                claim_rank=per_row("claim_rank"),
+                updated_at=now,
+            )
+            if final:
+                if updated < len(failed):
+                    final = self._still_ours(final, IronTask.STATUS_FAILED)
+                self.finished([(task, None, task.last_error) for task in final])
+        if updated < len(failed):
+            self.write(f"Batch: {len(failed) - updated} leases lost, results discarded", self.style.WARNING)
+
+        task = failed[0][0]
+        for outcome, amount in outcomes.items():
+            self.count_outcome(task, outcome, amount)
+        self.write(
+            f"Batch {task.name}: " + ", ".join(f"{n} {o}" for o, n in sorted(outcomes.items())),
+            self.style.WARNING,
+        )
+
+        pending = [t.scheduled_at for t, _ in failed if t.status == IronTask.STATUS_PENDING]
+        if pending:
+            notify(min(pending))
+
+    def retry_policy(self, task: IronTask):
+        try:
+            return get_task(task.name).retry_policy
+        except TaskNotRegistered:
+            return DEFAULT_RETRY_POLICY
+
+    def reschedule(self, task: IronTask, exc: Reschedule):
+        """
+        Задача попросила отложить её (Reschedule): обратно в очередь
+        без траты попытки.
+        """
+        task.status = IronTask.STATUS_PENDING
+        task.scheduled_at = timezone.now() + timezone.timedelta(seconds=exc.delay)
+        task.claim_rank = claim_rank(task.scheduled_at, task.priority)
+        task.updated_at = timezone.now()
+        updated = self._owned(task).update(
+            status=task.status,
+            scheduled_at=task.scheduled_at,
+            claim_rank=task.claim_rank,
+            locked_by="",
+            locked_at=None,
+            updated_at=task.updated_at,
+        )
+        if not updated:
+            self.lease_lost(task)
+            return
+        self.count_outcome(task, "rescheduled")
+        self.write(f"Task {task.id} rescheduled in {exc.delay:.1f}s: {exc}", self.style.WARNING)
+        notify(task.scheduled_at)
+
+    def record_failure(self, task: IronTask, exc: Exception):
+        if isinstance(exc, Reschedule):
+            self.reschedule(task, exc)
+            return
+
+        task.attempts += 1
+        task.last_error = str(exc)
+        policy = self.retry_policy(task)
+
+        if task.attempts >= task.max_attempts or not policy.should_retry(exc):
+            task.status = IronTask.STATUS_FAILED
+            self.write(f"Task {task.id} FAILED", self.style.ERROR)
+
+        else:
+            # пауза по политике задачи: экспонента + jitter / Retry-After
+            delay = policy.delay(task.attempts, exc)
+            task.scheduled_at = timezone.now() + timezone.timedelta(seconds=delay)
+            task.claim_rank = claim_rank(task.scheduled_at, task.priority)
+            task.status = IronTask.STATUS_PENDING
+            self.write(f"Retry task {task.id} in {delay:.1f}s", self.style.WARNING)
+
+        task.updated_at = timezone.now()
+        final = task.status == IronTask.STATUS_FAILED
+        with self.finishing([task] if final else []):
+            updated = self._owned(task).update(
+                status=task.status,
+                attempts=task.attempts,
+                last_error=task.last_error,
+                scheduled_at=task.scheduled_at,
+                claim_rank=task.claim_rank,
+                updated_at=task.updated_at,
+            )
+            if updated and final:
+                self.finished([(task, None, task.last_error)])
+        if not updated:
+            self.lease_lost(task)
+            return
+
+        if task.status == IronTask.STATUS_PENDING:
+            self.count_outcome(task, "retry")
+            notify(task.scheduled_at)
+        else:
+            self.count_outcome(task, "failed")
+
+
+class ThreadPoolWorker(Worker):
+    """
+    Воркер для I/O-bound задач: выполняет задачи в пуле потоков.
+
+    Главный поток только забирает задачи из БД (не больше, чем свободных
+    слотов в пуле), потоки их выполняют. У каждого потока своё
+    соединение с БД (Django держит их thread-local).
+    """
+
+    def __init__(self, worker_id: str, pool_size: int = 10, **kwargs):
+        super().__init__(worker_id, **kwargs)
+        self.pool_size = pool_size
+        self.slots = pool_size
+        self.in_flight = 0
+        self.slot_freed = threading.Condition()
+
+    def run(self):
+        self.write(
+            f"IronRelay worker {self.worker_id} started (threads: {self.pool_size})",
+            self.style.SUCCESS,
+        )
+        self.setup()
+
+        try:
+            with ThreadPoolExecutor(
+                max_workers=self.pool_size,
+                thread_name_prefix="ironrelay",
+            ) as pool:
+                while self.running:
+                    with self.slot_freed:
+                        # все потоки заняты — ждём, пока освободится хотя бы один
+                        while self.running and self.in_flight >= self.pool_size:
+                            self.slot_freed.wait(timeout=1)
+                        free = self.pool_size - self.in_flight
+
+                    if not self.running:
+                        break
+
+                    tasks = self.claim(min(self.batch_size, free))
+
+                    if not tasks:
+                        self.idle.wait()
+                        continue
+
+                    self.idle.reset()
+                    # пачка пакетной задачи занимает один поток
+                    jobs = self.jobs(tasks)
+                    with self.slot_freed:
+                        self.in_flight += len(jobs)
+
+                    for job in jobs:
+                        pool.submit(self._run_in_thread, job)
+        finally:
+            self.teardown()
+            connections.close_all()
+
+        self.write(f"IronRelay worker {self.worker_id} stopped")
+
+    def _run_in_thread(self, job: list):
+        try:
+            self.run_job(job)
+        except Exception as e:
+            # сюда попадаем только если упала запись статуса в БД
+            self.write(f"Task {job[0].id}: worker error: {e}", self.style.ERROR)
+        finally:
+            close_old_connections()
+            with self.slot_freed:
+                self.in_flight -= 1
+                self.slot_freed.notify()
+
+
+class AsyncWorker(Worker):
+    """
+    Нативный asyncio-воркер: `async def` задачи await-ятся прямо в
+    event loop, обычные (sync) задачи уходят в пул потоков.
+    Один процесс держит до `max_in_flight` задач одновременно.
+
+    Все обращения к ORM идут через sync_to_async — в event loop
+    синхронный ORM вызывать нельзя.
+    """
+
+    def __init__(self, worker_id: str, max_in_flight: int = 100, **kwargs):
+        super().__init__(worker_id, **kwargs)
+        self.max_in_flight = max_in_flight
+        self.slots = max_in_flight
+
+    def run(self):
+        asyncio.run(self.arun())
+
+    def install_signal_handlers(self):
+        # сигналы в asyncio ставим внутри arun(), когда loop уже есть
+        pass
+
+    async def arun(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                # не главный поток / Windows
+                pass
+
+        self.write(
+            f"IronRelay worker {self.worker_id} started (asyncio, in-flight: {self.max_in_flight})",
+            self.style.SUCCESS,
+        )
+        await sync_to_async(self.setup, thread_sensitive=True)()
+
+        claim = sync_to_async(self.claim, thread_sensitive=True)
+        jobs = sync_to_async(self.jobs, thread_sensitive=True)
+        idle_wait = sync_to_async(self.idle.wait, thread_sensitive=False)
+        in_flight = set()
+
+        try:
+            while self.running:
+                free = self.max_in_flight - len(in_flight)
+                if free <= 0:
+                    await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+
+                tasks = await claim(min(self.batch_size, free))
+
+                if not tasks:
+                    await idle_wait()
+                    continue
+
+                self.idle.reset()
+                for job in await jobs(tasks):
+                    if self.batch_size_of(job[0].name) > 1:
+                        # пачка целиком уходит в поток: функция одна на все элементы
+                        coro = sync_to_async(self._run_batch_safe, thread_sensitive=False)(job)
+                    else:
+                        coro = self.arun_one(job[0])
+                    future = asyncio.create_task(coro)
+                    in_flight.add(future)
+                    future.add_done_callback(in_flight.discard)
+
+            if in_flight:
+                await asyncio.wait(in_flight)
+        finally:
+            await sync_to_async(self.teardown, thread_sensitive=True)()
+            await sync_to_async(connections.close_all, thread_sensitive=True)()
+        self.write(f"IronRelay worker {self.worker_id} stopped")
+
+    def _run_batch_safe(self, tasks: list):
+        try:
+            self.run_batch(tasks)
+        except Exception as e:
+            self.write(f"Task {tasks[0].id}: worker error: {e}", self.style.ERROR)
+        finally:
+            close_old_connections()
+
+    async def arun_one(self, task: IronTask):
+        self.write(f"Running task {task.id} ({task.name})")
+
+        started = self.task_started(task)
+        try:
+            try:
+                result = await IronTaskWrapper.run_task_async(task)
+            except Exception as e:
+                self.task_finished(task, started)
+                await sync_to_async(self.record_failure, thread_sensitive=True)(task, e)
+            else:
+                self.task_finished(task, started)
+                await sync_to_async(self.record_success, thread_sensitive=True)(task, result)
+        except Exception as e:
+            self.write(f"Task {task.id}: worker error: {e}", self.style.ERROR)
+
+
+class PreforkSupervisor:
+    """
+    Супервизор: один раз импортирует Django и модули задач,
+    затем делает fork() N дочерних воркеров (память делится copy-on-write)
+    и перезапускает упавших.
+    """
+
+    # Минимальная пауза между перезапусками одного и того же слота,
+    # чтобы постоянно падающий воркер не превратился в fork-бомбу
+    RESTART_DELAY = 1.0
+
+    def __init__(self, concurrency: int, make_worker, base_id: str = "", stdout=None, style=None):
+        self.concurrency = concurrency
+        self.make_worker = make_worker
+        self.base_id = base_id or default_worker_id()
+        self.stdout = stdout or OutputWrapper(sys.stdout)
+        self.style = style or no_style()
+        self.children = {}  # pid -> slot
+        self.last_started = {}  # slot -> time.monotonic()
+        self.shutting_down = False
+
+    def write(self, message: str, style_func=None):
+        if style_func is not None:
+            message = style_func(message)
+        self.stdout.write(message)
+
+    def child_id(self, slot: int) -> str:
+        return f"{self.base_id}-{slot}"
+
+    def spawn(self, slot: int):
+        last = self.last_started.get(slot)
+        if last is not None:
+            wait = self.RESTART_DELAY - (time.monotonic() - last)
+            if wait > 0:
+                time.sleep(wait)
+
+        # Соединения с БД не должны переживать fork — каждый ребёнок
+        # откроет своё.
+        connections.close_all()
+        self.stdout.flush()
+
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                worker = self.make_worker(self.child_id(slot))
+                worker.install_signal_handlers()
+                worker.run()
+            except BaseException:
+                import traceback
+
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                connections.close_all()
+                os._exit(exit_code)
+
+        self.children[pid] = slot
+        self.last_started[slot] = time.monotonic()
+        self.write(f"Spawned worker {self.child_id(slot)} (pid {pid})")
+
+    def shutdown(self, *args):
+        if self.shutting_down:
+            return
+        self.shutting_down = True
+        self.write("Stopping workers...", self.style.WARNING)
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        if not hasattr(os, "fork"):
+            raise RuntimeError("Prefork mode requires os.fork() (not available on this platform)")
+
+        autodiscover_tasks()
+
+        signal.signal(signal.SIGTERM, self.shutdown)
+        signal.signal(signal.SIGINT, self.shutdown)
+
+        for slot in range(self.concurrency):
+            self.spawn(slot)
+
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+
+            slot = self.children.pop(pid, None)
+            if slot is None:
+                continue
+
+            if self.shutting_down:
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            self.write(
+                f"Worker {self.child_id(slot)} (pid {pid}) exited with {code}, restarting",
+                self.style.ERROR,
+            )
+            self.spawn(slot)
+
+        self.write("IronRelay supervisor stopped", self.style.SUCCESS)
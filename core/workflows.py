@@ -0,0 +1,356 @@
+# core/workflows.py
+#
+# Составные задачи: chain, group, chord.
+#
+#   chain(fetch.s(url), parse.s(), store.s()).defer()
+#       parse получит результат fetch первым аргументом, store — результат
+#       parse; следующая задача ставится воркером, когда предыдущая
+#       успешно выполнена (без опроса). .si() — аргументы не дополняются.
+#
+#   group(resize.s(i) for i in ids).defer()
+#       все задачи — одним bulk INSERT (как defer_many); GroupHandle.wait()
+#       собирает результаты через gather().
+#
+#   chord(group(resize.s(i) for i in ids), notify_done.s()).defer()
+#       callback получит список результатов группы (в её порядке) первым
+#       аргументом. Координация — строка IronChord со счётчиком remaining:
+#       каждая завершившаяся задача группы уменьшает его одним UPDATE в той
+#       же транзакции, что и её статус, и ровно одна (последняя) ставит
+#       callback. Никаких задач "всё ли готово?".
+#
+# Результаты задач группы chord-а сохраняются в IronTaskResult всегда
+# (callback читает их оттуда одним запросом на пачку). Если хоть одна
+# задача группы упала окончательно, callback не выполняется — его
+# результат (при store_result) записывается как ошибка. Упавшее звено
+# chain-а так же обрывает цепочку.
+#
+# Настройки:
+#   IRONRELAY_CHORD_MAX_AGE = 30 дней  (секунды или timedelta) — счётчики
+#       chord-ов, так и не дождавшихся группы (задачи отменили вручную),
+#       удаляет prune_finished
+
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import results as task_results
+from .models import IronChord, IronTaskResult
+from .tasks import enqueue, get_task
+
+
+DEFAULT_CHORD_MAX_AGE = timedelta(days=30)
+
+# Сколько id в одном IN (...) при чтении результатов группы
+RESULTS_CHUNK = 500
+
+
+class Signature:
+    """
+    Вызов задачи, который ещё не поставлен: имя, аргументы, параметры
+    defer(). Создаётся через task.s(...) / task.si(...).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        args=(),
+        kwargs=None,
+        delay: int = 0,
+        priority: int = 0,
+        max_attempts=5,
+        immutable: bool = False,
+        id=None,
+    ):
+        self.name = name
+        self.args = list(args)
+        self.kwargs = dict(kwargs or {})
+        self.delay = delay
+        self.priority = priority
+        self.max_attempts = max_attempts
+        # True — в chain-е результат предыдущей задачи не передаётся
+        self.immutable = immutable
+        self.id = id or uuid.uuid4()
+
+    def __repr__(self) -> str:
+        return f"<Signature {self.name}>"
+
+    def set(self, delay=None, priority=None, max_attempts=None) -> "Signature":
+        if delay is not None:
+            self.delay = delay
+        if priority is not None:
+            self.priority = priority
+        if max_attempts is not None:
+            self.max_attempts = max_attempts
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "id": str(self.id),
+            "name": self.name,
+            "args": self.args,
+            "kwargs": self.kwargs,
+            "delay": self.delay,
+            "priority": self.priority,
+            "max_attempts": self.max_attempts,
+            "immutable": self.immutable,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Signature":
+        return cls(
+            data["name"],
+            data.get("args", []),
+            data.get("kwargs", {}),
+            delay=data.get("delay", 0),
+            priority=data.get("priority", 0),
+            max_attempts=data.get("max_attempts", 5),
+            immutable=data.get("immutable", False),
+            id=uuid.UUID(data["id"]),
+        )
+
+    def build(self, args=None, task_id=None, **extra):
+        """
+        Несохранённая IronTask. extra — служебные ключи payload
+        ("link", "chord", "header").
+        """
+        task = get_task(self.name)._build(
+            self.args if args is None else args,
+            self.kwargs,
+            self.delay,
+            self.priority,
+            self.max_attempts,
+        )
+        task.id = task_id or self.id
+        task.payload.update({key: value for key, value in extra.items() if value})
+        return task
+
+    def handle(self):
+        return task_results.TaskHandle(self.id, self.name)
+
+    def defer(self):
+        enqueue([self.build()])
+        return self.handle()
+
+
+class chain:
+    """
+    Задачи по очереди; каждая получает результат предыдущей первым
+    аргументом (кроме .si()). defer() возвращает handle последней.
+    """
+
+    def __init__(self, *signatures):
+        if not signatures:
+            raise ValueError("chain() needs at least one signature")
+        self.signatures = list(signatures)
+
+    def defer(self):
+        first, rest = self.signatures[0], self.signatures[1:]
+        enqueue([first.build(link=[sig.to_dict() for sig in rest])])
+        return self.signatures[-1].handle()
+
+
+class GroupHandle:
+    """
+    Handle-ы задач группы (в её порядке).
+    """
+
+    def __init__(self, handles):
+        self.handles = list(handles)
+
+    def __iter__(self):
+        return iter(self.handles)
+
+    def __len__(self) -> int:
+        return len(self.handles)
+
+    def wait(self, timeout=None, return_exceptions=False) -> list:
+        return task_results.gather(self.handles, timeout, return_exceptions=return_exceptions)
+
+
+class group:
+    """
+    Задачи параллельно; defer() ставит их одним bulk INSERT.
+    """
+
+    def __init__(self, *signatures):
+        # group(sig1, sig2) и group(sig for ...) — одно и то же
+        if len(signatures) == 1 and not isinstance(signatures[0], Signature):
+            signatures = signatures[0]
+        self.signatures = list(signatures)
+
+    def defer(self) -> GroupHandle:
+        enqueue([sig.build() for sig in self.signatures])
+        return GroupHandle(sig.handle() for sig in self.signatures)
+
+
+def member_id(chord_id, index: int) -> uuid.UUID:
+    """
+    id задачи группы chord-а выводится из id chord-а и её номера:
+    callback находит результаты группы, не храня список id.
+    """
+    return uuid.uuid5(chord_id, str(index))
+
+
+class chord:
+    """
+    Группа задач, затем callback со списком их результатов.
+    defer() возвращает handle callback-а.
+    """
+
+    def __init__(self, header, callback: Signature):
+        self.header = header if isinstance(header, group) else group(header)
+        self.callback = callback
+
+    def defer(self):
+        members = self.header.signatures
+        if not members:
+            enqueue([self.callback.build(args=[[]] + self.callback.args)])
+            return self.callback.handle()
+
+        chord_id = uuid.uuid4()
+        # счётчик и задачи — одной транзакцией: задачи вставятся на commit,
+        # когда строка IronChord уже видна воркерам
+        with transaction.atomic():
+            IronChord.objects.create(
+                id=chord_id,
+                callback=self.callback.to_dict(),
+                size=len(members),
+                remaining=len(members),
+            )
+            enqueue([
+                sig.build(task_id=member_id(chord_id, index), chord=str(chord_id))
+                for index, sig in enumerate(members)
+            ])
+        return self.callback.handle()
+
+
+# --- Воркер ---
+
+
+def is_workflow(task) -> bool:
+    """
+    Завершение задачи что-то запускает (следующее звено chain-а
+    или счётчик chord-а).
+    """
+    payload = task.get_payload() or {}
+    return "link" in payload or "chord" in payload
+
+
+def in_chord(task) -> bool:
+    return "chord" in (task.get_payload() or {})
+
+
+def stores_result(task) -> bool:
+    # результаты группы chord-а нужны его callback-у
+    return in_chord(task) or task_results.stores_result(task.name)
+
+
+def header_results(chord_id, size: int) -> list:
+    """
+    Результаты группы chord-а в её порядке (аргумент callback-а).
+    """
+    chord_id = uuid.UUID(str(chord_id))
+    ids = [member_id(chord_id, index) for index in range(size)]
+    values = {}
+    for start in range(0, len(ids), RESULTS_CHUNK):
+        values.update(
+            IronTaskResult.objects.filter(task_id__in=ids[start:start + RESULTS_CHUNK])
+            .values_list("task_id", "value")
+        )
+    return [values.get(task_id) for task_id in ids]
+
+
+def _abort(signatures, error: str):
+    """
+    Задачи, которые уже не выполнятся: ожидающим их результат — ошибка.
+    """
+    task_results.save([
+        task_results.failure(sig, error)
+        for sig in signatures
+        if get_task(sig.name).store_result
+    ])
+
+
+def _count_down(chord_id: str, finished: int, failed: int) -> list:
+    """
+    Уменьшает счётчик chord-а. Вызывается в транзакции: после UPDATE строка
+    заблокирована до commit-а, так что ноль увидит ровно одна транзакция.
+    """
+    updated = IronChord.objects.filter(id=chord_id).update(
+        remaining=F("remaining") - finished,
+        failed=F("failed") + failed,
+    )
+    if not updated:
+        return []
+    counter = IronChord.objects.get(id=chord_id)
+    if counter.remaining > 0:
+        return []
+
+    counter.delete()
+    callback = Signature.from_dict(counter.callback)
+    if counter.failed:
+        _abort([callback], f"Chord {chord_id}: {counter.failed} of {counter.size} tasks failed")
+        return []
+    return [callback.build(header={"id": str(chord_id), "size": counter.size})]
+
+
+def advance(entries):
+    """
+    Продолжение workflow после окончательного завершения задач:
+    entries — [(task, значение, ошибка или None)]. Следующие звенья
+    chain-ов и callback-и chord-ов ставятся одним enqueue (на commit).
+    """
+    follow = []
+    chords = {}
+    for task, value, error in entries:
+        payload = task.get_payload() or {}
+
+        link = [Signature.from_dict(data) for data in payload.get("link", [])]
+        if link:
+            if error is None:
+                step, rest = link[0], link[1:]
+                args = step.args if step.immutable else [value] + step.args
+                follow.append(step.build(args=args, link=[sig.to_dict() for sig in rest]))
+            else:
+                _abort(link, f"Chain aborted: {task.name} failed: {error}")
+
+        chord_id = payload.get("chord")
+        if chord_id:
+            counts = chords.setdefault(chord_id, [0, 0])
+            counts[0] += 1
+            counts[1] += error is not None
+
+    with transaction.atomic(savepoint=False):
+        # пачка задач одного chord-а — один UPDATE
+        for chord_id, (finished, failed) in chords.items():
+            follow += _count_down(chord_id, finished, failed)
+        enqueue(follow)
+
+
+def finished(entries):
+    """
+    Окончательно завершённые задачи — [(task, значение, ошибка или None)]:
+    результат в IronTaskResult, продолжение workflow в очередь. Общий путь
+    воркера и reaper-а (core/broker.py); вызывается в транзакции, которая
+    записала статус задач.
+    """
+    task_results.save([
+        task_results.success(task, value) if error is None else task_results.failure(task, error)
+        for task, value, error in entries
+        if stores_result(task)
+    ])
+    flow = [entry for entry in entries if is_workflow(entry[0])]
+    if flow:
+        advance(flow)
+
+
+def delete_stale_chords() -> int:
+    max_age = getattr(settings, "IRONRELAY_CHORD_MAX_AGE", DEFAULT_CHORD_MAX_AGE)
+    if not isinstance(max_age, timedelta):
+        max_age = timedelta(seconds=max_age)
+    deleted, _ = IronChord.objects.filter(created_at__lt=timezone.now() - max_age).delete()
+    return deleted
@@ -9,6 +9,9 @@ from core.views import (
     ironrelay_incoming,
     ironrelay_dashboard,
     ironrelay_status,
+    ironrelay_metrics,
+    ironrelay_incoming_async,
+    ironrelay_status_async,
 )
 
 urlpatterns = [
@@ -45,4 +48,23 @@ urlpatterns = [
         ironrelay_status,
         name="ironrelay_status",
     ),
+
+    # 🔹 Async-версии для ASGI (uvicorn playground.asgi:application)
+    path(
+        "ironrelay/async/incoming/<str:source>/",
+        ironrelay_incoming_async,
+        name="ironrelay_incoming_async",
+    ),
+    path(
+        "ironrelay/async/status/",
+        ironrelay_status_async,
+        name="ironrelay_status_async",
+    ),
+
+    # 🔹 Метрики Prometheus
+    path(
+        "ironrelay/metrics/",
+        ironrelay_metrics,
+        name="ironrelay_metrics",
+    ),
 ]